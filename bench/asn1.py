@@ -0,0 +1,125 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+#
+# Benchmark for the integer coding in the ASN.1 codec. The Python codec is
+# compared with the byte-by-byte integer coding that was used up to version
+# 1.0.4, and with the C codec if it was built. Run from the top-level
+# directory with "PYTHONPATH=lib python bench/asn1.py".
+
+from __future__ import absolute_import
+from __future__ import print_function
+import timeit
+
+import six
+from six.moves import map
+from six.moves import range
+
+from activedirectory.protocol import asn1, ldap
+
+
+class LoopEncoder(asn1.PyEncoder):
+    """Encoder with the integer encoding used up to version 1.0.4."""
+
+    def _encode_integer(self, value):
+        if value < 0:
+            value = -value
+            negative = True
+            limit = 0x80
+        else:
+            negative = False
+            limit = 0x7f
+        values = []
+        while value > limit:
+            values.append(value & 0xff)
+            value >>= 8
+        values.append(value & 0xff)
+        if negative:
+            for i in range(len(values)):
+                values[i] = 0xff - values[i]
+            for i in range(len(values)):
+                values[i] += 1
+                if values[i] <= 0xff:
+                    break
+                values[i] = 0x00
+        values.reverse()
+        values = list(map(six.int2byte, values))
+        return b''.join(values)
+
+
+class LoopDecoder(asn1.PyDecoder):
+    """Decoder with the integer decoding used up to version 1.0.4."""
+
+    def _decode_integer(self, bytes):
+        values = [b for b in bytearray(bytes)]
+        if len(values) > 1 and \
+                (values[0] == 0xff and values[1] & 0x80 or
+                 values[0] == 0x00 and not (values[1] & 0x80)):
+            raise asn1.Error('ASN1 syntax error')
+        negative = values[0] & 0x80
+        if negative:
+            for i in range(len(values)):
+                values[i] = 0xff - values[i]
+            for i in range(len(values)-1, -1, -1):
+                values[i] += 1
+                if values[i] <= 0xff:
+                    break
+                values[i] = 0x00
+        value = 0
+        for val in values:
+            value = (value << 8) | val
+        if negative:
+            value = -value
+        return value
+
+
+def encode_results(encoder, count=100):
+    """Encode `count' LDAPResult messages, as a server would send for a
+    batch of operations."""
+    encoder.start()
+    for msgid in range(1000, 1000 + count):
+        encoder.enter(asn1.Sequence)
+        encoder.write(msgid)
+        encoder.enter(ldap.MODIFY_RESPONSE, asn1.ClassApplication)
+        encoder.write(ldap.SUCCESS, asn1.Enumerated)
+        encoder.write(b'')
+        encoder.write(b'')
+        encoder.leave()
+        encoder.leave()
+    return encoder.output()
+
+
+def decode_results(decoder, buffer):
+    """Decode the messages produced by encode_results()."""
+    decoder.start(buffer)
+    while not decoder.eof():
+        decoder.enter()
+        decoder.read()
+        decoder.enter()
+        decoder.read()
+        decoder.read()
+        decoder.read()
+        decoder.leave()
+        decoder.leave()
+
+
+def bench(name, encoder, decoder, number=2000):
+    buffer = encode_results(encoder)
+    elapsed = timeit.timeit(lambda: encode_results(encoder), number=number)
+    print('%-12s encode %8.2f us/message' % (name, elapsed / number * 1e4))
+    elapsed = timeit.timeit(lambda: decode_results(decoder, buffer),
+                            number=number)
+    print('%-12s decode %8.2f us/message' % (name, elapsed / number * 1e4))
+
+
+if __name__ == '__main__':
+    bench('loop', LoopEncoder(), LoopDecoder())
+    bench('table', asn1.PyEncoder(), asn1.PyDecoder())
+    if asn1.Encoder is not asn1.PyEncoder:
+        bench('C', asn1.Encoder(), asn1.Decoder())
+    else:
+        print('The _asn1 extension is not built, skipping C benchmark.')
@@ -0,0 +1,133 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+#
+# Benchmark for the LDAP filter parser. If PLY is installed, the former PLY
+# based parser is benchmarked as well for comparison. Run from the top-level
+# directory with "PYTHONPATH=lib python bench/ldapfilter.py".
+
+from __future__ import absolute_import
+from __future__ import print_function
+import re
+import timeit
+
+from activedirectory.protocol import ldapfilter
+
+try:
+    from ply import lex, yacc
+except ImportError:
+    lex = yacc = None
+
+
+FILTERS = (
+    '(objectClass=*)',
+    '(&(DnsDomain=FREEADI.ORG)(Host=magellan)(NtVer=\\06\\00\\00\\00))',
+    '(&(objectClass=user)(|(sAMAccountName=jdoe)(cn=John Doe))'
+    '(!(userAccountControl<=2)))',
+)
+
+
+class PLYParser(object):
+    """The PLY based parser that was used up to version 1.0.4."""
+
+    tokens = ('LPAREN', 'RPAREN', 'EQUALS', 'AND', 'OR', 'NOT',
+              'LTE', 'GTE', 'APPROX', 'PRESENT', 'STRING')
+
+    t_LPAREN = r'\('
+    t_RPAREN = r'\)'
+    t_EQUALS = r'='
+    t_AND = r'&'
+    t_OR = r'\|'
+    t_NOT = r'!'
+    t_LTE = r'<='
+    t_GTE = r'>='
+    t_APPROX = r'~='
+    t_PRESENT = r'=\*'
+
+    re_escape = re.compile(r'\\([0-9a-fA-F]{2})')
+
+    def __init__(self):
+        self.lexer = lex.lex(object=self)
+        self.parser = yacc.yacc(module=self, debug=0, write_tables=0)
+
+    def parse(self, input):
+        self.lexer.input(input)
+        return self.parser.parse(lexer=self.lexer)
+
+    def t_STRING(self, t):
+        r'[^()=&|!<>~*]+'
+        t.value = self.re_escape.sub(lambda m: chr(int(m.group(1), 16)),
+                                     t.value)
+        return t
+
+    def t_error(self, t):
+        raise ldapfilter.Error('illegal token')
+
+    def p_error(self, p):
+        raise ldapfilter.Error('syntax error')
+
+    def p_filter(self, p):
+        """filter : LPAREN and RPAREN
+                  | LPAREN or RPAREN
+                  | LPAREN not RPAREN
+                  | LPAREN item RPAREN
+        """
+        p[0] = p[2]
+
+    def p_and(self, p):
+        'and : AND filterlist'
+        p[0] = ldapfilter.AND(*p[2])
+
+    def p_or(self, p):
+        'or : OR filterlist'
+        p[0] = ldapfilter.OR(*p[2])
+
+    def p_not(self, p):
+        'not : NOT filter'
+        p[0] = ldapfilter.NOT(p[2])
+
+    def p_filterlist(self, p):
+        """filterlist : filter
+                      | filter filterlist
+        """
+        if len(p) == 2:
+            p[0] = (p[1],)
+        else:
+            p[0] = (p[1],) + p[2]
+
+    def p_item(self, p):
+        """item : STRING EQUALS STRING
+                | STRING LTE STRING
+                | STRING GTE STRING
+                | STRING APPROX STRING
+                | STRING PRESENT
+        """
+        if p[2] == '=':
+            p[0] = ldapfilter.EQUALS(p[1], p[3])
+        elif p[2] == '<=':
+            p[0] = ldapfilter.LTE(p[1], p[3])
+        elif p[2] == '>=':
+            p[0] = ldapfilter.GTE(p[1], p[3])
+        elif p[2] == '~=':
+            p[0] = ldapfilter.APPROX(p[1], p[3])
+        elif p[2] == '=*':
+            p[0] = ldapfilter.PRESENT(p[1])
+
+
+def bench(name, parse, number=20000):
+    for filter in FILTERS:
+        elapsed = timeit.timeit(lambda: parse(filter), number=number)
+        print('%-20s %8.2f us  %s' % (name, elapsed / number * 1e6,
+                                      filter[:40]))
+
+
+if __name__ == '__main__':
+    bench('recursive descent', ldapfilter.Parser().parse)
+    if yacc is not None:
+        bench('PLY (cached)', PLYParser().parse)
+    else:
+        print('PLY is not installed, skipping PLY benchmark.')
@@ -0,0 +1,98 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+#
+# Benchmark for the netlogon reply decoder. The decoder is compared with
+# the byte-by-byte decoder that was used up to version 1.0.4. Run from the
+# top-level directory with "PYTHONPATH=lib python bench/netlogon.py".
+
+from __future__ import absolute_import
+from __future__ import print_function
+import os.path
+import timeit
+
+import six
+from six.moves import range
+
+from activedirectory.protocol import netlogon
+
+
+class ByteDecoder(netlogon.Decoder):
+    """Decoder with the decoding used up to version 1.0.4."""
+
+    def parse(self):
+        type = self._decode_uint32()
+        flags = self._decode_uint32()
+        domain_guid = self._read_bytes(16)
+        names = [ self._decode_rfc1035() for i in range(8) ]
+        return netlogon.Reply(type=type, flags=flags, domain_guid=domain_guid,
+                              names=names)
+
+    def _decode_rfc1035(self, _pointer=False):
+        result = []
+        if _pointer == False:
+            _pointer = []
+        while True:
+            tag = self._read_byte()
+            if tag == 0:
+                break
+            elif tag & 0xc0 == 0xc0:
+                byte = self._read_byte()
+                ptr = ((tag & ~0xc0) << 8) + byte
+                if ptr in _pointer:
+                    raise netlogon.Error('Cyclic pointer')
+                _pointer.append(ptr)
+                saved, self.m_offset = self.m_offset, ptr
+                result.append(self._decode_rfc1035(_pointer))
+                self.m_offset = saved
+                break
+            elif tag & 0xc0:
+                raise netlogon.Error('Illegal tag')
+            else:
+                s = self._read_bytes(tag)
+                result.append(s)
+        return b'.'.join(result)
+
+    def _decode_uint32(self):
+        value = 0
+        for i in range(4):
+            byte = self._read_byte()
+            value |= (byte << i*8)
+        return value
+
+    def _read_byte(self, offset=None):
+        if self.m_offset >= len(self.m_buffer):
+            raise netlogon.Error('Premature end of input.')
+        byte = self.m_buffer[self.m_offset]
+        if isinstance(byte, str):
+            byte = ord(byte)
+        self.m_offset += 1
+        return byte
+
+    def _read_bytes(self, count, offset=None):
+        bytes = self.m_buffer[self.m_offset:self.m_offset+count]
+        if len(bytes) != count:
+            raise netlogon.Error('Premature end of input.')
+        self.m_offset += count
+        return bytes
+
+
+def bench(name, decoder, buffer, number=20000):
+    def decode():
+        decoder.start(buffer)
+        decoder.parse()
+    elapsed = timeit.timeit(decode, number=number)
+    print('%-8s %8.2f us/reply' % (name, elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    fname = os.path.join(os.path.dirname(__file__), '..', 'tests',
+                         'protocol', 'netlogon.bin')
+    with open(fname, 'rb') as fin:
+        buffer = fin.read()
+    bench('byte', ByteDecoder(), buffer)
+    bench('struct', netlogon.Decoder(), buffer)
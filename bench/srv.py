@@ -0,0 +1,73 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+#
+# Benchmark for the ordering of DNS SRV records. The ordering is compared
+# with the quadratic weighted shuffle that was used up to version 1.0.4.
+# Run from the top-level directory with "PYTHONPATH=lib python bench/srv.py".
+
+from __future__ import absolute_import
+from __future__ import print_function
+import random
+import timeit
+
+from six.moves import range
+
+from activedirectory.core.locate import Locator
+
+
+class SRV(object):
+    """Synthetic SRV record."""
+
+    def __init__(self, priority, weight):
+        self.priority = priority
+        self.weight = weight
+
+
+class QuadraticLocator(Locator):
+    """Locator with the weighted shuffle used up to version 1.0.4. Weights
+    of zero are replaced by one, because it cannot handle them."""
+
+    def _srv_weighted_shuffle(self, answer):
+        result = []
+        for i in range(len(answer)):
+            total = 0
+            cumulative = []
+            for j in range(len(answer)):
+                total += answer[j].weight or 1
+                cumulative.append((total, j))
+            rnd = random.randrange(0, total)
+            for j in range(len(answer)):
+                if rnd < cumulative[j][0]:
+                    k = cumulative[j][1]
+                    result.append(answer[k])
+                    del answer[k]
+                    break
+        return result
+
+
+def create_records(count, rng):
+    """Create `count' SRV records in a few priority groups, with a quarter
+    of weights set to zero as is common in AD."""
+    return [ SRV(rng.choice((0, 0, 0, 10)), rng.choice((0, 50, 100, 100)))
+             for i in range(count) ]
+
+
+def bench(name, locator, records, number):
+    elapsed = timeit.timeit(lambda: locator._order_dns_srv(records),
+                            number=number)
+    print('%-10s %6d records %10.1f us/order' %
+          (name, len(records), elapsed / number * 1e6))
+
+
+if __name__ == '__main__':
+    rng = random.Random(0)
+    for count in (10, 100, 1000, 5000):
+        records = create_records(count, rng)
+        number = max(1, 20000 // count)
+        bench('quadratic', QuadraticLocator(), records, max(1, number // 10))
+        bench('sort', Locator(rng=random.Random(0)), records, number)
@@ -0,0 +1,119 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import ast
+import logging
+import sqlite3
+
+from ..protocol import netlogon
+
+
+class FileCache(object):
+    """A cache of located domain controllers in an SQLite database.
+
+    The cache can be shared by any number of processes. SQLite provides
+    the locking between processes, and every update is a single atomic
+    statement. Domain controllers are stored per (domain, role, site), and
+    detected sites per domain. Errors accessing the database are logged and
+    treated as a cache miss, so a broken cache file never prevents domain
+    controllers from being located.
+    """
+
+    _timeout = 10  # wait this long for a lock held by another process
+
+    def __init__(self, fname):
+        """Constructor. `fname' is the name of the database file. It is
+        created if it does not exist."""
+        self.m_fname = fname
+        self.m_logger = logging.getLogger('activedirectory.core.cache')
+        self.m_initialized = False
+
+    def get(self, domain, role, site):
+        """Return the cache entry for `role' in `domain' and `site' as the
+        tuple (stamp, nrequested, servers), or None if there is none."""
+        query = 'SELECT stamp, nrequested, servers FROM servers' \
+                ' WHERE domain = ? AND role = ? AND site = ?'
+        row = self._fetch(query, (domain, role, site or ''))
+        if row is None:
+            return
+        stamp, nrequested, servers = row
+        try:
+            servers = [ netlogon.Reply(**attrs)
+                        for attrs in ast.literal_eval(servers) ]
+        except (ValueError, SyntaxError, TypeError):
+            self.m_logger.error('invalid cache entry for %s' % domain)
+            return
+        return (stamp, nrequested, servers)
+
+    def put(self, domain, role, site, stamp, nrequested, servers):
+        """Store the netlogon.Reply instances `servers' for `role' in
+        `domain' and `site'."""
+        servers = repr([ reply.__dict__ for reply in servers ])
+        query = 'INSERT OR REPLACE INTO servers' \
+                ' (domain, role, site, stamp, nrequested, servers)' \
+                ' VALUES (?, ?, ?, ?, ?, ?)'
+        self._execute(query, (domain, role, site or '', stamp, nrequested,
+                              servers))
+
+    def get_site(self, domain):
+        """Return the tuple (stamp, site) for the site that was detected
+        for `domain', or None if there is none."""
+        query = 'SELECT stamp, site FROM sites WHERE domain = ?'
+        return self._fetch(query, (domain,))
+
+    def put_site(self, domain, stamp, site):
+        """Store the detected site `site' for `domain'."""
+        query = 'INSERT OR REPLACE INTO sites (domain, stamp, site)' \
+                ' VALUES (?, ?, ?)'
+        self._execute(query, (domain, stamp, site))
+
+    def clear(self):
+        """Remove all entries."""
+        self._execute('DELETE FROM servers')
+        self._execute('DELETE FROM sites')
+
+    def _connect(self):
+        """Open a connection to the database. A new connection is used for
+        every operation, so that the cache can be used from any thread and
+        after a fork."""
+        conn = sqlite3.connect(self.m_fname, timeout=self._timeout)
+        if not self.m_initialized:
+            with conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS servers'
+                             ' (domain TEXT, role TEXT, site TEXT,'
+                             ' stamp REAL, nrequested INTEGER, servers TEXT,'
+                             ' PRIMARY KEY (domain, role, site))')
+                conn.execute('CREATE TABLE IF NOT EXISTS sites'
+                             ' (domain TEXT PRIMARY KEY, stamp REAL,'
+                             ' site TEXT)')
+            self.m_initialized = True
+        return conn
+
+    def _fetch(self, query, args):
+        """Execute `query' and return the first row, or None."""
+        try:
+            conn = self._connect()
+            try:
+                return conn.execute(query, args).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error as err:
+            self.m_logger.error('cache error: %s' % err)
+
+    def _execute(self, query, args=()):
+        """Execute the update `query' in a transaction."""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(query, args)
+            finally:
+                conn.close()
+        except sqlite3.Error as err:
+            self.m_logger.error('cache error: %s' % err)
@@ -8,6 +8,10 @@
 
 from __future__ import absolute_import
 import re
+import time
+import weakref
+import contextlib
+import collections
 import dns
 import dns.resolver
 import dns.exception
@@ -15,13 +19,17 @@ import ldap
 import ldap.sasl
 import ldap.controls
 import socket
+import threading
 
 from .exception import Error as ADError
 from .object import factory, instance
 from .creds import Creds
 from .locate import Locator
+from .pool import ConnectionPool
+from .result import SearchResult
 from .constant import LDAP_PORT, GC_PORT
 from ..protocol import krb5
+from ..protocol import ldap as protocol_ldap
 from ..util import compat
 
 
@@ -36,17 +44,24 @@ class Client(object):
     _sizelimit = 0
     _referrals = False
     _pagesize = 500
+    _prefetch = True
+    _range_requests = 20
+    _pool_minsize = 0
+    _pool_maxsize = 10
+    _pool_idletime = 300
 
     def __init__(self, domain, creds=None):
         """Constructor."""
         self.m_locator = None
         self.m_connections = None
+        self.m_lock = threading.Lock()
         self.m_naming_contexts = None
         self.m_domain = self.dn_from_domain_name(domain)
         self.m_forest = None
         self.m_schema = None
         self.m_configuration = None
         self.m_creds = creds
+        self.m_servers = weakref.WeakKeyDictionary()  # conn -> (srv, srvs)
 
     def _locator(self):
         """Return our resource locator."""
@@ -101,6 +116,61 @@ class Client(object):
             ld.sasl_interactive_bind_s('', sasl)
         return ld
 
+    def _connect(self, servers, scheme=None, bind=True):
+        """Open an LDAP connection to one of `servers'. The servers are
+        tried one by one, most healthy first, and the outcome is recorded
+        in the health registry.
+
+        The latency that is recorded is the time until the bind completes.
+        As ldap.initialize() does not contact the server, the rootDSE is
+        read instead when `bind' is False."""
+        health = self._locator().m_health
+        error = None
+        for server in health.order(servers, probe=True):
+            uri = self._create_ldap_uri([server], scheme)
+            start = time.time()
+            try:
+                conn = self._create_ldap_connection(uri, bind)
+                if not bind:
+                    conn.search_s('', ldap.SCOPE_BASE, attrlist=['1.1'])
+            except (ldap.SERVER_DOWN, ldap.TIMEOUT) as err:
+                health.record_failure(server)
+                error = err
+                continue
+            health.record_ldap(server, time.time() - start)
+            self.m_servers[conn] = (server, servers)
+            return conn
+        if error is not None:
+            raise error
+        uri = self._create_ldap_uri(servers, scheme)
+        return self._create_ldap_connection(uri, bind)
+
+    def _acceptable_connection(self, conn):
+        """Return True if the server of `conn' is still healthy and not
+        much slower than the other servers it was selected from."""
+        entry = self.m_servers.get(conn)
+        if entry is None:
+            return True
+        server, servers = entry
+        return self._locator().m_health.acceptable(server, servers)
+
+    @contextlib.contextmanager
+    def _track(self, conn):
+        """Context manager that records the outcome of the LDAP operations
+        on `conn' in the health registry. Their duration depends on the
+        request, so it is not recorded as the latency."""
+        entry = self.m_servers.get(conn)
+        if entry is None:
+            yield
+            return
+        health = self._locator().m_health
+        try:
+            yield
+        except (ldap.SERVER_DOWN, ldap.TIMEOUT):
+            health.record_failure(entry[0])
+            raise
+        health.record_ldap(entry[0])
+
     def domain_name_from_dn(self, dn):
         """Given a DN, return a domain."""
         parts = compat.str2dn(dn)
@@ -126,8 +196,7 @@ class Client(object):
             return
         locator = self._locator()
         servers = locator.locate_many(self.domain())
-        uri = self._create_ldap_uri(servers)
-        conn = self._create_ldap_connection(uri, bind=False)
+        conn = self._connect(servers, bind=False)
         try:
             attrs = ('rootDomainNamingContext', 'schemaNamingContext',
                      'configurationNamingContext')
@@ -179,8 +248,7 @@ class Client(object):
             return
         locator = self._locator()
         servers = locator.locate_many(self.domain())
-        uri = self._create_ldap_uri(servers)
-        conn = self._create_ldap_connection(uri)
+        conn = self._connect(servers)
         base = 'cn=Partitions,%s' % self.configuration_base()
         filter = '(objectClass=crossRef)'
         try:
@@ -225,44 +293,70 @@ class Client(object):
                 naming_context = nc
         return naming_context
     
-    def _ldap_connection(self, base, server=None, scheme=None):
-        """Return the (cached) LDAP connection for a naming naming_context."""
+    def _connection_pool(self, base, server=None, scheme=None):
+        """Return the connection pool for a naming naming_context."""
         naming_context = self._resolve_naming_context(base)
         scheme = self._fixup_scheme(scheme)
-        if self.m_connections is None:
-            self.m_connections = {}
         key = (naming_context, server, scheme)
-        if key not in self.m_connections:
-            locator = self._locator()
-            if naming_context == '':
-                assert server != None
-                uri = self._create_ldap_uri([server])
-                bind = False  # No need to bind for rootDSE
+        with self.m_lock:
+            if self.m_connections is None:
+                self.m_connections = {}
+            if key in self.m_connections:
+                return self.m_connections[key]
+        locator = self._locator()
+        if naming_context == '':
+            assert server is not None
+            domain = None
+            bind = False  # No need to bind for rootDSE
+        else:
+            domain = self.domain_name_from_dn(naming_context)
+            if scheme == 'gc':
+                role = 'gc'
+            elif scheme == 'ldap':
+                role = 'dc'
+            if server is not None and \
+                    not locator.check_domain_controller(server, domain, role):
+                raise ADError('Unsuitable server provided.')
+            bind = True
+
+        def factory():
+            if domain is None:
+                return self._connect([server], bind=bind)
+            elif server is None:
+                servers = locator.locate_many(domain, role=role)
             else:
-                domain = self.domain_name_from_dn(naming_context)
-                if scheme == 'gc':
-                    role = 'gc'
-                elif scheme == 'ldap':
-                    role = 'dc'
-                if server is None:
-                    servers = locator.locate_many(domain, role=role)
-                    uri = self._create_ldap_uri(servers, scheme)
-                else:
-                    if not locator.check_domain_controller(server, domain, role):
-                        raise ADError('Unsuitable server provided.')
-                    uri = self._create_ldap_uri([server], scheme)
+                servers = [server]
+            if bind:
                 creds = self._credentials()
                 creds._resolve_servers_for_domain(domain)
-                bind = True
-            conn = self._create_ldap_connection(uri, bind)
-            self.m_connections[key] = conn
-        return self.m_connections[key]
+            return self._connect(servers, scheme, bind)
+
+        pool = ConnectionPool(factory, self._pool_minsize,
+                              self._pool_maxsize, self._pool_idletime,
+                              self._acceptable_connection)
+        with self.m_lock:
+            if self.m_connections is None:
+                self.m_connections = {}
+            pool = self.m_connections.setdefault(key, pool)
+        return pool
+
+    @contextlib.contextmanager
+    def _ldap_connection(self, base, server=None, scheme=None):
+        """Check out an LDAP connection for a naming naming_context. This
+        returns a context manager that checks in the connection again when
+        it is left."""
+        pool = self._connection_pool(base, server, scheme)
+        with pool.connection() as conn:
+            with self._track(conn):
+                yield conn
 
     def close(self):
         """Close any active LDAP connection."""
-        for conn in self.m_connections.values():
-            conn.unbind_s()
-        self.m_connections = None
+        with self.m_lock:
+            pools = self.m_connections or {}
+            self.m_connections = None
+        for pool in pools.values():
+            pool.close()
 
     def _remove_empty_search_entries(self, result):
         """Remove empty search entries from a search result."""
@@ -271,50 +365,97 @@ class Client(object):
 
     re_range = re.compile('([^;]+);[Rr]ange=([0-9]+)(?:-([0-9]+|\\*))?')
 
-    def _retrieve_all_ranges(self, dn, key, attrs):
-        """Retrieve all ranges for a multivalued attributed."""
-        assert key in attrs
-        mobj = self.re_range.match(key)
-        assert mobj is not None
-        type, lo, hi = mobj.groups()
-        values = attrs[key]
-        conn = self._ldap_connection(dn)
-        base = self._resolve_naming_context(dn)
-        while hi != '*':
-            try:
-                hi = int(hi)
-            except ValueError:
-                m = 'Error while retrieving multi-valued attributes.'
-                raise ADError(m)
-            rqattrs = ('%s;range=%s-*' % (type, hi+1),)
-            filter = '(distinguishedName=%s)' % dn
-            result = conn.search_s(base, ldap.SCOPE_SUBTREE, filter, rqattrs)
-            if not result:
-                # Object deleted? Assume it was and return no further
-                # attributes.
+    def _parse_range_high(self, hi):
+        """Parse the upper bound of a range subtype."""
+        try:
+            hi = int(hi)
+        except ValueError:
+            m = 'Error while retrieving multi-valued attributes.'
+            raise ADError(m)
+        return hi
+
+    def _request_range(self, conns, dn, type, hi):
+        """Send a request for the values of `type' after `hi'. Return the
+        connection and message ID of the request. Connections are checked
+        out once per pool and are stored in `conns'."""
+        pool = self._connection_pool(dn)
+        if pool not in conns:
+            conns[pool] = pool.checkout()
+        conn = conns[pool]
+        rqattrs = ('%s;range=%d-*' % (type, hi+1),)
+        msgid = conn.search_ext(dn, ldap.SCOPE_BASE, '(objectClass=*)',
+                                rqattrs)
+        return conn, msgid
+
+    def _receive_range(self, conn, msgid, type, hi):
+        """Receive the reply to a range request. Return the tuple (values,
+        hi) with `hi' the upper bound of the range that was returned, or
+        None if the object does not exist anymore."""
+        try:
+            rtype, result, rmsgid, ctrls = conn.result3(msgid)
+        except ldap.NO_SUCH_OBJECT:
+            result = []
+        result = self._remove_empty_search_entries(result)
+        if not result:
+            # Object deleted? Assume it was and return no further
+            # attributes.
+            return None
+        dn2, attrs2 = result[0]
+        for key2 in attrs2:
+            mobj = self.re_range.match(key2)
+            if mobj is None:
+                continue
+            type2, lo2, hi2 = mobj.groups()
+            if type2 == type and lo2 == str(hi+1):
                 break
-            dn2, attrs2 = result[0]
-            for key2 in attrs2:
-                mobj = self.re_range.match(key2)
-                if mobj is None:
-                    continue
-                type2, lo2, hi2 = mobj.groups()
-                if type2 == type and lo2 == str(hi+1):
-                    break
-            else:
-                m = 'Error while retrieving multi-valued attributes.'
-                raise ADError(m)
-            values += attrs2[key2]
-            hi = hi2
-        attrs[type] = values
-        del attrs[key]
+        else:
+            m = 'Error while retrieving multi-valued attributes.'
+            raise ADError(m)
+        return attrs2[key2], hi2
 
     def _process_range_subtypes(self, result):
-        """Incremental retrieval of multi-valued attributes."""
+        """Incremental retrieval of multi-valued attributes.
+
+        The remaining ranges of all entries in `result' are retrieved
+        concurrently, with up to `_range_requests' requests outstanding at
+        any time. Each request is a base search on the object itself.
+        """
+        queue = collections.deque()
         for dn,attrs in result:
-            for key in attrs.keys():  # dict will be updated
-                if self.re_range.match(key):
-                    self._retrieve_all_ranges(dn, key, attrs)
+            for key in list(attrs.keys()):  # dict will be updated
+                mobj = self.re_range.match(key)
+                if mobj is None:
+                    continue
+                type, lo, hi = mobj.groups()
+                attrs[type] = attrs.pop(key)
+                if hi != '*':
+                    queue.append((dn, type, self._parse_range_high(hi), attrs))
+        outstanding = collections.deque()
+        conns = {}
+        failed = False
+        try:
+            while queue or outstanding:
+                while queue and len(outstanding) < self._range_requests:
+                    dn, type, hi, attrs = queue.popleft()
+                    conn, msgid = self._request_range(conns, dn, type, hi)
+                    outstanding.append((conn, msgid, dn, type, hi, attrs))
+                conn, msgid, dn, type, hi, attrs = outstanding.popleft()
+                reply = self._receive_range(conn, msgid, type, hi)
+                if reply is None:
+                    continue
+                values, hi = reply
+                attrs[type] += values
+                if hi != '*':
+                    queue.append((dn, type, self._parse_range_high(hi), attrs))
+        except ldap.SERVER_DOWN:
+            failed = True
+            raise
+        finally:
+            if not failed:
+                for conn, msgid, dn, type, hi, attrs in outstanding:
+                    conn.abandon(msgid)
+            for pool, conn in conns.items():
+                pool.checkin(conn, failed)
         return result
 
     def _fixup_filter(self, filter):
@@ -363,40 +504,45 @@ class Client(object):
             raise TypeError('Expecting sequence of strings.')
         return attrs
 
-    def _search_with_paged_results(self, conn, filter, base, scope, attrs):
-        """Perform an ldap search operation with paged results."""
-        ctrl = compat.SimplePagedResultsControl(self._pagesize)
-        result = []
-        while True:
-            msgid = conn.search_ext(base, scope, filter, attrs,
-                                    serverctrls=[ctrl])
-            type, data, msgid, ctrls = conn.result3(msgid)
-            result += data
-            rctrls = [ c for c in ctrls
-                       if c.controlType == compat.LDAP_CONTROL_PAGED_RESULTS ]
-            if not rctrls:
-                m = 'Server does not honour paged results.'
-                raise ADError(m)
-
-            size = rctrls[0].size
-            cookie = rctrls[0].cookie
-
-            if not cookie:
-                break
-            ctrl.controlValue = (self._pagesize, cookie)
-        return result
-
-    def search(self, filter=None, base=None, scope=None, attrs=None,
-               server=None, scheme=None):
-        """Search Active Directory and return a list of objects.
+    def _iter_paged_results(self, conn, filter, base, scope, attrs):
+        """Perform an ldap search operation with paged results. This is a
+        generator that yields one page of results at a time.
 
-        The `filter' argument specifies an RFC 2254 search filter. If it is
-        not provided, the default is '(objectClass=*)'.  `base' is the search
-        base and defaults to the base of the current domain.  `scope' is the
-        search scope and must be one of 'base', 'one' or 'subtree'. The
-        default scope is 'substree'. `attrs' is the attribute list to
-        retrieve. The default is to retrieve all attributes.
+        If `_prefetch' is set, the request for the next page is sent out
+        before the current page is yielded, so that the server can produce
+        it while the caller is processing the current one. The paged results
+        control makes every request depend on the cookie of the previous
+        page, so at most one page can be prefetched.
         """
+        ctrl = compat.SimplePagedResultsControl(self._pagesize)
+        msgid = conn.search_ext(base, scope, filter, attrs, serverctrls=[ctrl])
+        try:
+            while msgid is not None:
+                type, data, rmsgid, ctrls = conn.result3(msgid)
+                msgid = None
+                rctrls = [ c for c in ctrls
+                           if c.controlType == compat.LDAP_CONTROL_PAGED_RESULTS ]
+                if not rctrls:
+                    m = 'Server does not honour paged results.'
+                    raise ADError(m)
+                cookie = rctrls[0].cookie
+                if cookie:
+                    ctrl.cookie = cookie
+                    if self._prefetch:
+                        msgid = conn.search_ext(base, scope, filter, attrs,
+                                                serverctrls=[ctrl])
+                yield data
+                if cookie and msgid is None:
+                    msgid = conn.search_ext(base, scope, filter, attrs,
+                                            serverctrls=[ctrl])
+        finally:
+            # The caller stopped iterating while a page was outstanding.
+            if msgid is not None:
+                conn.abandon(msgid)
+
+    def _search_pages(self, filter, base, scope, attrs, server, scheme):
+        """Check the search arguments and return an iterator over the pages
+        of the search result."""
         filter = self._fixup_filter(filter)
         base = self._fixup_base(base)
         scope = self._fixup_scope(scope)
@@ -409,15 +555,66 @@ class Client(object):
             if scope != ldap.SCOPE_BASE:
                 m = 'Search scope must be base when querying rootDSE'
                 raise ADError(m)
-        conn = self._ldap_connection(base, server, scheme)
-        if base == '':
-            # search rootDSE does not honour paged results
-            result = conn.search_s(base, scope, filter, attrs)
-        else:
-            result = self._search_with_paged_results(conn, filter, base,
-                                                     scope, attrs)
-        result = self._remove_empty_search_entries(result)
-        result = self._process_range_subtypes(result)
+        pool = self._connection_pool(base, server, scheme)
+        return self._iter_search_pages(pool, filter, base, scope, attrs)
+
+    def _iter_search_pages(self, pool, filter, base, scope, attrs):
+        """Check out a connection from `pool' and yield the pages of the
+        search result. The connection is checked in after the last page."""
+        with pool.connection() as conn, self._track(conn):
+            if base == '':
+                # search rootDSE does not honour paged results
+                yield conn.search_s(base, scope, filter, attrs)
+            else:
+                pages = self._iter_paged_results(conn, filter, base, scope,
+                                                 attrs)
+                try:
+                    for page in pages:
+                        yield page
+                finally:
+                    pages.close()  # abandon any prefetched page first
+
+    def _iter_search_entries(self, pages):
+        """Post-process the search result `pages' one page at a time and
+        yield the individual entries."""
+        for page in pages:
+            page = self._remove_empty_search_entries(page)
+            page = self._process_range_subtypes(page)
+            for entry in page:
+                yield entry
+
+    def iter_search(self, filter=None, base=None, scope=None, attrs=None,
+                    server=None, scheme=None):
+        """Search Active Directory and return an iterator over the objects.
+
+        The arguments are the same as for search(). Contrary to search(),
+        results are produced per page as they are received from the server,
+        so only one page of results needs to be kept in memory.
+        """
+        pages = self._search_pages(filter, base, scope, attrs, server, scheme)
+        return self._iter_search_entries(pages)
+
+    def search(self, filter=None, base=None, scope=None, attrs=None,
+               server=None, scheme=None, stream=False, compact=False):
+        """Search Active Directory and return a list of objects.
+
+        The `filter' argument specifies an RFC 2254 search filter. If it is
+        not provided, the default is '(objectClass=*)'.  `base' is the search
+        base and defaults to the base of the current domain.  `scope' is the
+        search scope and must be one of 'base', 'one' or 'subtree'. The
+        default scope is 'substree'. `attrs' is the attribute list to
+        retrieve. The default is to retrieve all attributes. If `stream' is
+        True, an iterator is returned instead of a list (see iter_search()).
+        If `compact' is True, the result is returned as a SearchResult,
+        which needs a lot less memory for large results.
+        """
+        if stream and compact:
+            raise ValueError('Cannot combine stream and compact.')
+        result = self.iter_search(filter, base, scope, attrs, server, scheme)
+        if compact:
+            result = SearchResult(result)
+        elif not stream:
+            result = list(result)
         return result
 
     def _fixup_add_list(self, attrs):
@@ -448,20 +645,12 @@ class Client(object):
         a list of strings.
         """
         attrs = self._fixup_add_list(attrs)
-        conn = self._ldap_connection(dn, server)
-        conn.add_s(dn, attrs)
+        with self._ldap_connection(dn, server) as conn:
+            conn.add_s(dn, attrs)
 
     def _fixup_modify_operation(self, op):
         """Fixup an ldap modify operation."""
-        if op == 'add':
-            op = ldap.MOD_ADD
-        elif op == 'replace':
-            op = ldap.MOD_REPLACE
-        elif op == 'delete':
-            op = ldap.MOD_DELETE
-        elif op not in (ldap.MOD_ADD, ldap.MOD_REPLACE, ldap.MOD_DELETE):
-            raise ValueError('Illegal modify operation: %s' % op)
-        return op
+        return protocol_ldap.modify_operation(op)
 
     def _fixup_modify_list(self, mods):
         """Check the `mods' argument to modify()."""
@@ -493,13 +682,13 @@ class Client(object):
         value(s).
         """
         mods = self._fixup_modify_list(mods)
-        conn = self._ldap_connection(dn, server)
-        conn.modify_s(dn, mods)
+        with self._ldap_connection(dn, server) as conn:
+            conn.modify_s(dn, mods)
 
     def delete(self, dn, server=None):
         """Delete the LDAP object referenced by `dn'."""
-        conn = self._ldap_connection(dn, server)
-        conn.delete_s(dn)
+        with self._ldap_connection(dn, server) as conn:
+            conn.delete_s(dn)
 
     def modrdn(self, dn, newrdn, delold=True, server=None):
         """Change the RDN of an object in Active Direcotry.
@@ -516,8 +705,8 @@ class Client(object):
         modrdn(). If the `newsuperior' argument is specified, it must be a
         DN and the object is moved there.
         """
-        conn = self._ldap_connection(dn, server)
-        conn.rename_s(dn, newrdn, newsuperior, delold)
+        with self._ldap_connection(dn, server) as conn:
+            conn.rename_s(dn, newrdn, newsuperior, delold)
 
     def set_password(self, principal, password, server=None):
         """Set the password of `principal' to `password'."""
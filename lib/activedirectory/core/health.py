@@ -0,0 +1,221 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import time
+import threading
+
+import six
+from six.moves import range
+
+
+class ServerHealth(object):
+    """Health statistics of one domain controller."""
+
+    def __init__(self):
+        """Constructor."""
+        self.ldap_latency = None
+        self.netlogon_latency = None
+        self.error_rate = 0.0
+        self.failures = 0  # consecutive failures
+        self.opened = None  # time the circuit breaker was opened
+        self.probed = time.time()  # time the LDAP latency was last measured
+
+
+class HealthRegistry(object):
+    """A registry of domain controller health.
+
+    For every server, exponentially weighted moving averages are kept of
+    the time to set up an LDAP connection, the Netlogon latency and the
+    error rate. A circuit breaker opens after `_failures' consecutive
+    failures. A server with an open circuit is not used for
+    `_reset_timeout' seconds, after which it is tried again. One more
+    failure opens the circuit again, and a successful LDAP operation closes
+    it.
+
+    Servers are identified by their host name, which is not case
+    sensitive. The registry can be used from any thread.
+    """
+
+    _alpha = 0.3  # weight of a new latency sample
+    _error_alpha = 0.1  # weight of a new outcome in the error rate
+    _failures = 3  # consecutive failures that open the circuit
+    _reset_timeout = 30  # try a server with an open circuit after this
+    _tolerance = 2.0  # maximum slowdown relative to the fastest server
+    _netlogon_scale = 2.0  # LDAP connect round trips per Netlogon reply
+    _probe_interval = 60  # measure a slower server again after this
+
+    def __init__(self):
+        """Constructor."""
+        self.m_lock = threading.Lock()
+        self.m_servers = {}
+
+    def record_ldap(self, server, latency=None):
+        """Record a successful LDAP operation on `server'. If `latency' is
+        given, the operation set up a connection, which took `latency'
+        seconds."""
+        with self.m_lock:
+            health = self._get(server)
+            if latency is not None:
+                health.ldap_latency = self._average(health.ldap_latency,
+                                                    latency, self._alpha)
+                health.probed = time.time()
+            self._record_success(health)
+
+    def record_netlogon(self, server, latency):
+        """Record a Netlogon reply from `server' that took `latency'
+        seconds. A reply does not close the circuit, as it does not show
+        that LDAP requests succeed."""
+        with self.m_lock:
+            health = self._get(server)
+            health.netlogon_latency = self._average(health.netlogon_latency,
+                                                    latency, self._alpha)
+
+    def record_failure(self, server):
+        """Record a failed request to `server'."""
+        with self.m_lock:
+            health = self._get(server)
+            health.error_rate = self._average(health.error_rate, 1.0,
+                                              self._error_alpha)
+            health.failures += 1
+            if health.failures >= self._failures:
+                health.opened = time.time()
+
+    def get(self, server):
+        """Return the ServerHealth of `server', or None if nothing is known
+        about it."""
+        with self.m_lock:
+            return self.m_servers.get(self._key(server))
+
+    def available(self, server):
+        """Return True if `server' may be used, i.e. if its circuit is not
+        open."""
+        with self.m_lock:
+            return self._available(self.m_servers.get(self._key(server)))
+
+    def order(self, servers, key=None, probe=False):
+        """Return `servers' ordered from most to least preferred. If `key'
+        is given, it is called to get the host name of each item in
+        `servers'.
+
+        Available servers come before servers with an open circuit, and
+        are ordered by their cost. Servers that nothing is known about keep
+        their original order after the others. If `probe' is True, an
+        available server whose latency has not been measured for
+        `_probe_interval' seconds is put first, so that a server that was
+        slow is measured again.
+        """
+        if key is None:
+            key = _identity
+        with self.m_lock:
+            health = [ self.m_servers.get(self._key(key(server)))
+                       for server in servers ]
+            ranks = [ self._rank(item) for item in health ]
+            order = sorted(range(len(servers)), key=ranks.__getitem__)
+            if probe:
+                self._probe(order, health)
+        return [ servers[i] for i in order ]
+
+    def acceptable(self, server, servers):
+        """Return True if `server' is available and at most `_tolerance'
+        times slower than any of `servers'."""
+        with self.m_lock:
+            health = self.m_servers.get(self._key(server))
+            if not self._available(health):
+                return False
+            cost = self._cost(health)
+            if cost is None:
+                return True
+            for other in servers:
+                other = self.m_servers.get(self._key(other))
+                if not self._available(other):
+                    continue
+                other = self._cost(other)
+                if other is not None and cost > self._tolerance * other:
+                    return False
+            return True
+
+    def clear(self):
+        """Forget all servers."""
+        with self.m_lock:
+            self.m_servers = {}
+
+    def _key(self, server):
+        """Return the registry key for `server'."""
+        return six.ensure_text(server).lower().rstrip(u'.')
+
+    def _get(self, server):
+        """Return the ServerHealth for `server', creating it if needed. Must
+        be called with the lock held."""
+        key = self._key(server)
+        health = self.m_servers.get(key)
+        if health is None:
+            health = self.m_servers[key] = ServerHealth()
+        return health
+
+    def _average(self, average, sample, alpha):
+        """Return the moving average `average' updated with `sample'."""
+        if average is None:
+            return sample
+        return (1 - alpha) * average + alpha * sample
+
+    def _record_success(self, health):
+        """Record a success in `health' and close its circuit."""
+        health.error_rate = self._average(health.error_rate, 0.0,
+                                          self._error_alpha)
+        health.failures = 0
+        health.opened = None
+
+    def _available(self, health):
+        """Return True if the circuit of `health' is not open."""
+        if health is None or health.opened is None:
+            return True
+        return time.time() - health.opened >= self._reset_timeout
+
+    def _cost(self, health):
+        """Return the cost of the server with ServerHealth `health', which
+        may be None, or None if no latency is known. The cost is the LDAP
+        latency, or the Netlogon latency scaled by `_netlogon_scale' if
+        that is unknown, increased by the error rate."""
+        if health is None:
+            return
+        if health.ldap_latency is not None:
+            latency = health.ldap_latency
+        elif health.netlogon_latency is not None:
+            latency = health.netlogon_latency * self._netlogon_scale
+        else:
+            return
+        return latency / (1.0 - min(health.error_rate, 0.9))
+
+    def _rank(self, health):
+        """Return the sort key of the ServerHealth `health', which may be
+        None."""
+        cost = self._cost(health)
+        return (not self._available(health), cost is None, cost or 0.0)
+
+    def _probe(self, order, health):
+        """Move the first server in `order' that is due to be measured
+        again to the front. `order' is a list of indices into `health'.
+        Must be called with the lock held."""
+        now = time.time()
+        for position in range(1, len(order)):
+            item = health[order[position]]
+            if self._cost(item) is None or not self._available(item):
+                break
+            if now - item.probed >= self._probe_interval:
+                item.probed = now
+                order.insert(0, order.pop(position))
+                break
+
+
+def _identity(server):
+    """Return `server'."""
+    return server
+
+
+health_registry = HealthRegistry()
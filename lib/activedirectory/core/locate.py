@@ -7,9 +7,12 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import math
 import time
 import random
+import itertools
 import logging
+import threading
 
 import six
 import ldap
@@ -19,8 +22,10 @@ import dns.exception
 
 from ..protocol import netlogon
 from ..protocol.netlogon import Client as NetlogonClient
+from .cache import FileCache
+from .health import health_registry
 from .exception import Error as ADError
-from ..util import compat
+from ..util import compat, misc
 from six.moves import range
 
 
@@ -50,22 +55,50 @@ class Locator(object):
       situation is is preferable to use timing information to order domain
       controllers.
 
+    Both orders are overridden by the health of the domain controllers, as
+    recorded in a HealthRegistry. Domain controllers that are known to be
+    faster come first, and domain controllers whose circuit breaker is open
+    come last. Results from the cache are reordered every time, so that a
+    domain controller that becomes slow or fails is not used until the cache
+    entry expires.
+
     Both policies (selection and ordering) can be changed by subclassing this
     class.
     """
 
     _maxservers = 3
     _timeout = 300  # cache entries for 5 minutes
+    _refresh = 0.75  # part of the lifetime after which entries are refreshed
+    _max_stale = 3600  # use expired entries this long if locating fails
+    _retry = 30  # use expired entries this long after locating failed
+    _deadline = 10  # maximum time to locate domain controllers
+    _threads = 16  # maximum number of concurrent DNS queries
 
-    def __init__(self, site=None, resolver=None, resolve_hostnames=False):
-        """Constructor."""
+    def __init__(self, site=None, resolver=None, resolve_hostnames=False,
+                 cache_file=None, health=None, rng=None):
+        """Constructor. If `cache_file' is given, located domain controllers
+        and the detected site are also cached in that file, so that they
+        can be reused by other processes. The HealthRegistry `health'
+        defaults to the shared health.health_registry. SRV records are
+        shuffled with the random.Random instance `rng', which can be seeded
+        to get a reproducible order."""
         self.m_site = site
         self.m_site_detected = False
         self.m_logger = logging.getLogger('activedirectory.core.locate')
         self.m_cache = {}
+        self.m_lock = threading.Lock()
+        self.m_refreshing = set()
+        # (domain, role) -> time until which to use the expired entry
+        self.m_failed = {}
+        if cache_file is not None:
+            self.m_file_cache = FileCache(cache_file)
+        else:
+            self.m_file_cache = None
         self.m_timeout = self._timeout
         self.m_resolver = resolver or dns.resolver.get_default_resolver()
         self.m_resolve_hostnames = resolve_hostnames
+        self.m_health = health or health_registry
+        self.m_random = rng or random.Random()
 
     def locate(self, domain, role=None):
         """Locate one domain controller."""
@@ -95,54 +128,65 @@ class Locator(object):
         domain = domain.upper()
         self.m_logger.debug('locating domain controllers for %s (role %s)' %
                             (domain, role))
-        key = (domain, role)
-        if key in self.m_cache:
-            stamp, nrequested, servers = self.m_cache[key]
-            now = time.time()
-            if now - stamp < self._timeout and nrequested >= maxservers:
-                self.m_logger.debug('domain controllers found in cache')
-                return servers
+        entry = self._cache_lookup(domain, role)
+        if self._cache_usable(entry, maxservers):
+            self.m_logger.debug('domain controllers found in cache')
+            if time.time() - entry[0] >= self._refresh * self.m_timeout:
+                self._start_refresh(domain, role, entry[1])
+            return self._order_domain_controllers(entry[2])[:maxservers]
+        stale = self._cache_stale_usable(entry)
+        if stale and self._recently_failed(domain, role):
+            self.m_logger.debug('locating failed recently, using expired '
+                                'cache entry')
+            self._start_refresh(domain, role, entry[1])
+            return self._order_domain_controllers(entry[2])[:maxservers]
         self.m_logger.debug('domain controllers not in cache, going to network')
-        servers = []
-        candidates = []
-        if self.m_site is None and not self.m_site_detected:
-            self.m_site = self._detect_site(domain)
-            self.m_site_detected = True
+        servers = self._discover(domain, role, maxservers)
+        if not servers and stale:
+            self.m_logger.error('could not locate domain controllers, '
+                                'using expired cache entry')
+            self._record_failure(domain, role)
+            return self._order_domain_controllers(entry[2])[:maxservers]
+        self._cache_store(domain, role, maxservers, servers)
+        return servers
+
+    def _discover(self, domain, role, maxservers):
+        """Locate up to `maxservers' domain controllers for `domain' with
+        role `role' on the network."""
+        end = time.time() + self._deadline
+        queries = []
         if self.m_site and role != 'pdc':
             query = '_ldap._tcp.%s._sites.%s._msdcs.%s' % \
                     (self.m_site, role, domain.lower())
-            answer = self._dns_query(query, 'SRV')
-            candidates += self._order_dns_srv(answer)
+            queries.append((query, 'SRV'))
         query = '_ldap._tcp.%s._msdcs.%s' % (role, domain.lower())
-        answer = self._dns_query(query, 'SRV')
-        candidates += self._order_dns_srv(answer)
+        queries.append((query, 'SRV'))
+        candidates = []
+        for answer in self._dns_query_many(queries, end):
+            candidates += self._order_dns_srv(answer)
         addresses = self._extract_addresses_from_srv(candidates)
         addresses = self._remove_duplicates(addresses)
-        replies = []
         netlogon = NetlogonClient()
-        for i in range(0, len(addresses), maxservers):
-            for addr in addresses[i:i+maxservers]:
-                addr = (addr[0], LDAP_PORT)  # in case we queried for GC
-                netlogon.query(addr, domain)
-            replies += netlogon.call()
-            if self._sufficient_domain_controllers(replies, role, maxservers):
-                break
+        for addr in addresses:
+            addr = (addr[0], LDAP_PORT)  # in case we queried for GC
+            netlogon.query(addr, domain)
+
+        def sufficient(replies):
+            return self._sufficient_domain_controllers(replies, role,
+                                                       maxservers, end)
+
+        replies = netlogon.call(deadline=max(end - time.time(), 0),
+                                sufficient=sufficient)
         servers = self._select_domain_controllers(replies, role, maxservers,
                                                   addresses)
         self.m_logger.debug('found %d domain controllers' % len(servers))
 
         if self.m_resolve_hostnames:
-            for srv in servers:
-                hostname = srv.hostname.decode('utf-8')
-                try:
-                    address = self._dns_query(hostname, 'A')[0].address
-                except IndexError:
-                    continue
-                else:
-                    srv.hostname = address.encode('utf-8')
-
-        now = time.time()
-        self.m_cache[key] = (now, maxservers, servers)
+            queries = [ (srv.hostname.decode('utf-8'), 'A') for srv in servers ]
+            answers = self._dns_query_many(queries, end)
+            for srv, answer in zip(servers, answers):
+                if answer:
+                    srv.hostname = answer[0].address.encode('utf-8')
         return servers
 
     def check_domain_controller(self, server, domain, role):
@@ -159,11 +203,27 @@ class Locator(object):
         result = self._check_domain_controller(reply, role)
         return result
 
+    def check_domain_controllers(self, servers, domain, role):
+        """Like check_domain_controller(), but check all of `servers' at
+        once. Return a dictionary mapping each server to True or False."""
+        client = NetlogonClient()
+        for server in servers:
+            client.query((server, LDAP_PORT), domain.upper())
+        result = dict((server, False) for server in servers)
+        replies = client.call()
+        self._check_replies(replies, role)
+        for reply in replies:
+            result[reply.q_hostname] = reply.checked
+        return result
+
     def _dns_query(self, query, type):
         """Perform a DNS query."""
         self.m_logger.debug('DNS query %s type %s' % (query, type))
         try:
             answer = self.m_resolver.query(query, type)
+        except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+            answer = []
+            self.m_logger.debug('DNS query returned no results')
         except dns.exception.DNSException as err:
             answer = []
             self.m_logger.error('DNS query error: %s' % (str(err) or err.__doc__))
@@ -171,6 +231,123 @@ class Locator(object):
             self.m_logger.debug('DNS query returned %d results' % len(answer))
         return answer
 
+    def _dns_query_many(self, queries, end=None):
+        """Perform the DNS queries `queries', a list of (query, type)
+        tuples, concurrently. Return the list of answers. Queries that have
+        not completed at time `end', or that failed, have an empty answer."""
+        timeout = None if end is None else max(end - time.time(), 0)
+        answers = misc.run_parallel(lambda query: self._dns_query(*query),
+                                    queries, self._threads, timeout)
+        for index, answer in enumerate(answers):
+            if isinstance(answer, Exception):
+                self.m_logger.error('DNS query %s type %s failed: %r' %
+                                    (queries[index] + (answer,)))
+            if answer is None or isinstance(answer, Exception):
+                answers[index] = []
+        return answers
+
+    def _cache_lookup(self, domain, role):
+        """Return the most recent cache entry for `domain' and `role' from
+        memory or from the cache file, or None. The entry may have
+        expired."""
+        with self.m_lock:
+            entry = self.m_cache.get((domain, role))
+        if entry is not None and time.time() - entry[0] < self.m_timeout:
+            return entry
+        if self.m_site is None and not self.m_site_detected:
+            self.m_site = self._detect_site_cached(domain)
+            self.m_site_detected = True
+        if self.m_file_cache is not None:
+            stored = self.m_file_cache.get(domain, role, self.m_site)
+            if stored is not None and (entry is None or stored[0] > entry[0]):
+                entry = stored
+                with self.m_lock:
+                    self.m_cache[(domain, role)] = entry
+        return entry
+
+    def _cache_store(self, domain, role, maxservers, servers):
+        """Store the located domain controllers `servers' in the cache."""
+        now = time.time()
+        with self.m_lock:
+            self.m_cache[(domain, role)] = (now, maxservers, servers)
+            self.m_failed.pop((domain, role), None)
+        if self.m_file_cache is not None and servers:
+            self.m_file_cache.put(domain, role, self.m_site, now, maxservers,
+                                  servers)
+
+    def _start_refresh(self, domain, role, maxservers):
+        """Refresh the cache entry for `domain' and `role' in a background
+        thread, unless that is already being done."""
+        with self.m_lock:
+            if (domain, role) in self.m_refreshing:
+                return
+            self.m_refreshing.add((domain, role))
+        self.m_logger.debug('refreshing cache entry for %s (role %s)' %
+                            (domain, role))
+        thread = threading.Thread(target=self._refresh_entry,
+                                  args=(domain, role, maxservers))
+        thread.daemon = True
+        thread.start()
+
+    def _refresh_entry(self, domain, role, maxservers):
+        """Locate domain controllers again and update the cache entry. The
+        current entry is kept if no domain controllers are found."""
+        try:
+            servers = self._discover(domain, role, maxservers)
+            if servers:
+                self._cache_store(domain, role, maxservers, servers)
+            else:
+                self.m_logger.error('could not refresh domain controllers '
+                                    'for %s (role %s)' % (domain, role))
+                self._record_failure(domain, role)
+        except Exception as err:
+            self.m_logger.error('error refreshing domain controllers: %s'
+                                % err)
+            self._record_failure(domain, role)
+        finally:
+            with self.m_lock:
+                self.m_refreshing.discard((domain, role))
+
+    def _cache_usable(self, entry, maxservers):
+        """Return True if the cache entry `entry' is recent and has at least
+        `maxservers' domain controllers."""
+        if entry is None:
+            return False
+        stamp, nrequested, servers = entry
+        return time.time() - stamp < self.m_timeout and \
+            nrequested >= maxservers
+
+    def _cache_stale_usable(self, entry):
+        """Return True if the expired cache entry `entry' may be used
+        because locating domain controllers fails."""
+        return entry is not None and bool(entry[2]) and \
+            time.time() - entry[0] < self.m_timeout + self._max_stale
+
+    def _record_failure(self, domain, role):
+        """Record that locating domain controllers for `domain' and `role'
+        failed. The expired cache entry is used for the next `_retry'
+        seconds."""
+        with self.m_lock:
+            self.m_failed[(domain, role)] = time.time() + self._retry
+
+    def _recently_failed(self, domain, role):
+        """Return True if locating domain controllers for `domain' and
+        `role' failed less than `_retry' seconds ago."""
+        with self.m_lock:
+            return self.m_failed.get((domain, role), 0) > time.time()
+
+    def _detect_site_cached(self, domain):
+        """Like _detect_site(), but use the cache file if there is one."""
+        if self.m_file_cache is not None:
+            entry = self.m_file_cache.get_site(domain)
+            if entry is not None and time.time() - entry[0] < self.m_timeout:
+                self.m_logger.debug('site found in cache file')
+                return entry[1]
+        site = self._detect_site(domain)
+        if site is not None and self.m_file_cache is not None:
+            self.m_file_cache.put_site(domain, time.time(), site)
+        return site
+
     def _detect_site(self, domain):
         """Detect our site using the netlogon protocol."""
         self.m_logger.debug('detecting site')
@@ -178,16 +355,12 @@ class Locator(object):
         answer = self._dns_query(query, 'SRV')
         servers = self._order_dns_srv(answer)
         addresses = self._extract_addresses_from_srv(servers)
-        replies = []
         netlogon = NetlogonClient()
-        for i in range(0, len(addresses), 3):
-            for addr in addresses[i:i+3]:
-                self.m_logger.debug('NetLogon query to %s' % addr[0])
-                netlogon.query(addr, domain)
-            replies += netlogon.call()
-            self.m_logger.debug('%d replies' % len(replies))
-            if len(replies) >= 3:
-                break
+        for addr in addresses:
+            self.m_logger.debug('NetLogon query to %s' % addr[0])
+            netlogon.query(addr, domain)
+        replies = netlogon.call(sufficient=lambda replies: len(replies) >= 3)
+        self.m_logger.debug('%d replies' % len(replies))
         if not replies:
             self.m_logger.error('could not detect site')
             return
@@ -203,39 +376,34 @@ class Locator(object):
         return six.ensure_text(sites[0][1])
 
     def _order_dns_srv(self, answer):
-        """Order the results of a DNS SRV query."""
-        answer = list(answer)
-        answer.sort(key=lambda x: x.priority)
+        """Order the results of a DNS SRV query as described in RFC 2782.
+        Records are ordered by priority, and records with the same priority
+        are shuffled by weight."""
+        answer = sorted(answer, key=lambda x: x.priority)
         result = []
-        for i in range(len(answer)):
-            if i == 0:
-                low = i
-                prio = answer[i].priority
-            if i > 0 and answer[i].priority != prio:
-                result += self._srv_weighted_shuffle(answer[low:i])
-                low = i
-                prio = answer[i].priority
-            elif i == len(answer)-1:
-                result += self._srv_weighted_shuffle(answer[low:])
+        for prio, group in itertools.groupby(answer, lambda x: x.priority):
+            result += self._srv_weighted_shuffle(list(group))
         return result
 
     def _srv_weighted_shuffle(self, answer):
-        """Do a weighted shuffle on the SRV query result `result'."""
-        result = []
-        for i in range(len(answer)):
-            total = 0
-            cumulative = []
-            for j in range(len(answer)):
-                total += answer[j].weight
-                cumulative.append((total, j))
-            rnd = random.randrange(0, total)
-            for j in range(len(answer)):
-                if rnd < cumulative[j][0]:
-                    k = cumulative[j][1]
-                    result.append(answer[k])
-                    del answer[k]
-                    break
-        return result
+        """Do a weighted shuffle on the SRV records `answer'.
+
+        The result has the same distribution as repeatedly selecting a
+        record with a probability proportional to its weight (RFC 2782),
+        but it is computed in O(n log n) by sorting on a random key per
+        record (Efraimidis and Spirakis). Records with weight zero are only
+        selected after all other records, in random order.
+        """
+        keyed = []
+        for srv in answer:
+            rnd = 1.0 - self.m_random.random()  # in (0, 1]
+            if srv.weight > 0:
+                key = (1, math.log(rnd) / srv.weight)
+            else:
+                key = (0, rnd)
+            keyed.append((key, srv))
+        keyed.sort(key=lambda x: x[0], reverse=True)
+        return [ srv for key, srv in keyed ]
 
     def _extract_addresses_from_srv(self, answer):
         """Extract IP addresses from a DNS SRV query answer."""
@@ -291,16 +459,32 @@ class Locator(object):
         self.m_logger.debug('Controller is OK')
         return True
 
-    def _sufficient_domain_controllers(self, replies, role, maxservers):
+    def _check_replies(self, replies, role, end=None):
+        """Check the domain controllers in `replies' concurrently, and set
+        the `checked' attribute of each reply to the result. A check that
+        has not completed at time `end' fails."""
+        timeout = None if end is None else max(end - time.time(), 0)
+
+        def check(reply):
+            return self._check_domain_controller(reply, role)
+
+        results = misc.run_parallel(check, replies, self._threads, timeout)
+        for reply, result in zip(replies, results):
+            if isinstance(result, Exception):
+                self.m_logger.error('Checking controller %s failed: %r' %
+                                    (reply.q_hostname, result))
+                result = False
+            reply.checked = bool(result)
+
+    def _sufficient_domain_controllers(self, replies, role, maxservers,
+                                       end=None):
         """Return True if there are sufficient domain controllers in `replies'
-        to satisfy `maxservers'."""
-        total = 0
-        for reply in replies:
-            if not hasattr(reply, 'checked'):
-                checked = self._check_domain_controller(reply, role)
-                reply.checked = checked
-            if reply.checked:
-                total += 1
+        to satisfy `maxservers'. Replies that have not been checked yet are
+        checked before time `end'."""
+        unchecked = [ reply for reply in replies
+                      if not hasattr(reply, 'checked') ]
+        self._check_replies(unchecked, role, end)
+        total = len([ reply for reply in replies if reply.checked ])
         return total >= maxservers
 
     def _select_domain_controllers(self, replies, role, maxservers, addresses):
@@ -312,9 +496,10 @@ class Locator(object):
         remote = []
         for reply in replies:
             assert hasattr(reply, 'checked')
+            self.m_health.record_netlogon(reply.hostname, reply.q_timing)
             if not reply.checked:
                 continue
-            if self.m_site.lower() == six.ensure_text(reply.server_site).lower():
+            if self._is_local(reply):
                 local.append(reply)
             else:
                 remote.append(reply)
@@ -324,8 +509,29 @@ class Locator(object):
                                 (x.q_hostname, x.q_port) for x in local]))
         self.m_logger.debug('Remote DCs: %s' % ', '.join(['%s:%s' %
                                 (x.q_hostname, x.q_port) for x in remote]))
-        result = local + remote
+        result = self._order_domain_controllers(local + remote)
         result = result[:maxservers]
         self.m_logger.debug('Selected DCs: %s' % ', '.join(['%s:%s' %
                                 (x.q_hostname, x.q_port) for x in result]))
         return result
+
+    def _order_domain_controllers(self, replies):
+        """Order `replies' by health and site. Domain controllers with an
+        open circuit breaker come last, and local domain controllers come
+        before remote ones. Within these groups, the order of the health
+        registry is used."""
+        replies = self.m_health.order(replies, key=self._hostname)
+        replies.sort(key=lambda reply:
+                     (not self.m_health.available(reply.hostname),
+                      not self._is_local(reply)))
+        return replies
+
+    def _is_local(self, reply):
+        """Return True if `reply' is from a domain controller in our
+        site."""
+        return self.m_site is not None and self.m_site.lower() == \
+            six.ensure_text(reply.server_site).lower()
+
+    def _hostname(self, reply):
+        """Return the host name of `reply'."""
+        return reply.hostname
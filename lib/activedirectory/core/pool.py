@@ -0,0 +1,213 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import time
+import threading
+import contextlib
+
+import ldap
+from six.moves import _thread
+
+from .exception import Error as ADError
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of LDAP connections.
+
+    Connections are created on demand by calling `factory', up to a maximum
+    of `maxsize' connections. A thread that needs a connection checks one
+    out, and checks it in again when it is done with it. Nested checkouts
+    from the same thread return the connection that thread already holds,
+    so that a thread never waits for itself. Checkouts are counted per
+    connection, so a connection can be checked in from another thread than
+    the one that checked it out, e.g. when a generator holding it is closed
+    elsewhere.
+
+    Connections that have been idle for longer than `_check_interval'
+    seconds are checked before they are handed out, and connections that
+    have been idle for longer than `idletime' seconds are closed, keeping
+    at least `minsize' idle connections open. Connections that fail are
+    discarded and replaced by a new connection on the next checkout.
+
+    If `check' is given, it is called with every idle connection before it
+    is handed out. Connections for which it returns False are closed and
+    replaced by a new connection.
+    """
+
+    _minsize = 0
+    _maxsize = 10
+    _idletime = 300  # close connections after 5 minutes of inactivity
+    _check_interval = 60
+
+    def __init__(self, factory, minsize=None, maxsize=None, idletime=None,
+                 check=None):
+        """Constructor."""
+        if minsize is None:
+            minsize = self._minsize
+        if maxsize is None:
+            maxsize = self._maxsize
+        if idletime is None:
+            idletime = self._idletime
+        if maxsize < 1 or minsize < 0 or minsize > maxsize:
+            raise ValueError('Illegal pool size: %s-%s' % (minsize, maxsize))
+        self.m_factory = factory
+        self.m_minsize = minsize
+        self.m_maxsize = maxsize
+        self.m_idletime = idletime
+        self.m_check = check
+        self.m_lock = threading.Condition()
+        self.m_idle = []  # list of (stamp, conn), most recently used last
+        self.m_owned = {}  # conn -> [depth, failed, thread id]
+        self.m_threads = {}  # thread id -> conn
+        self.m_size = 0
+        self.m_closed = False
+
+    def size(self):
+        """Return the number of open connections."""
+        return self.m_size
+
+    def checkout(self, timeout=None):
+        """Check out a connection. If all connections are in use, wait for
+        at most `timeout' seconds for one to become available."""
+        ident = _thread.get_ident()
+        with self.m_lock:
+            conn = self.m_threads.get(ident)
+            if conn is not None:
+                self.m_owned[conn][0] += 1
+                return conn
+            expired = self._evict_idle_connections()
+        for old in expired:
+            self._close_connection(old)
+        with self.m_lock:
+            if timeout is not None:
+                end = time.time() + timeout
+            while True:
+                if self.m_closed:
+                    raise ADError('Connection pool is closed.')
+                if self.m_idle:
+                    stamp, conn = self.m_idle.pop()
+                    break
+                elif self.m_size < self.m_maxsize:
+                    stamp, conn = None, None
+                    self.m_size += 1
+                    break
+                if timeout is None:
+                    self.m_lock.wait()
+                else:
+                    timeleft = end - time.time()
+                    if timeleft <= 0:
+                        m = 'Timeout waiting for an LDAP connection.'
+                        raise ADError(m)
+                    self.m_lock.wait(timeleft)
+        if conn is not None and not self._usable_connection(conn, stamp):
+            self._close_connection(conn)
+            conn = None
+        if conn is None:
+            try:
+                conn = self.m_factory()
+            except Exception:
+                with self.m_lock:
+                    self.m_size -= 1
+                    self.m_lock.notify()
+                raise
+        with self.m_lock:
+            self.m_owned[conn] = [1, False, ident]
+            self.m_threads[ident] = conn
+        return conn
+
+    def checkin(self, conn, failed=False):
+        """Return a connection to the pool. If `failed' is True, the
+        connection is discarded instead."""
+        with self.m_lock:
+            entry = self.m_owned.get(conn)
+            if entry is None:
+                raise ADError('Connection was not checked out.')
+            entry[0] -= 1
+            entry[1] = entry[1] or failed
+            if entry[0] > 0:
+                return
+            del self.m_owned[conn]
+            if self.m_threads.get(entry[2]) is conn:
+                del self.m_threads[entry[2]]
+            if entry[1] or self.m_closed:
+                self.m_size -= 1
+                discard = conn
+            else:
+                self.m_idle.append((time.time(), conn))
+                discard = None
+            self.m_lock.notify()
+        if discard is not None:
+            self._close_connection(discard)
+
+    @contextlib.contextmanager
+    def connection(self, timeout=None):
+        """Context manager that checks out a connection and checks it in
+        again afterwards. The connection is discarded if the server went
+        away."""
+        conn = self.checkout(timeout)
+        try:
+            yield conn
+        except ldap.SERVER_DOWN:
+            self.checkin(conn, failed=True)
+            raise
+        except BaseException:
+            self.checkin(conn)
+            raise
+        else:
+            self.checkin(conn)
+
+    def close(self):
+        """Close all idle connections. Connections that are currently
+        checked out are closed when they are checked in."""
+        with self.m_lock:
+            self.m_closed = True
+            idle = self.m_idle
+            self.m_idle = []
+            self.m_size -= len(idle)
+            self.m_lock.notify_all()
+        for stamp, conn in idle:
+            self._close_connection(conn)
+
+    def _evict_idle_connections(self):
+        """Remove connections that have been idle for too long from the
+        pool and return them. Must be called with the lock held."""
+        now = time.time()
+        expired = []
+        while len(self.m_idle) > self.m_minsize:
+            stamp, conn = self.m_idle[0]
+            if now - stamp < self.m_idletime:
+                break
+            del self.m_idle[0]
+            self.m_size -= 1
+            expired.append(conn)
+        return expired
+
+    def _usable_connection(self, conn, stamp):
+        """Return True if the idle connection `conn', which was checked in
+        at time `stamp', can be handed out."""
+        if self.m_check is not None and not self.m_check(conn):
+            return False
+        if time.time() - stamp > self._check_interval:
+            return self._check_connection(conn)
+        return True
+
+    def _check_connection(self, conn):
+        """Return True if the connection `conn' is still usable."""
+        try:
+            conn.whoami_s()
+        except ldap.LDAPError:
+            return False
+        return True
+
+    def _close_connection(self, conn):
+        """Close the connection `conn', ignoring errors."""
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
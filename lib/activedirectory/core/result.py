@@ -0,0 +1,175 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import array
+
+from six.moves import intern, range
+
+
+try:
+    array.array('Q')
+    _large = 'Q'  # 'L' is 32 bits on Windows
+except ValueError:
+    _large = 'L'  # Python 2 has no 'Q'
+
+
+def _extend(offsets, items):
+    """Extend the array `offsets' with `items' and return it. If an item
+    does not fit, a copy with 64-bit items is returned instead."""
+    try:
+        items = array.array(offsets.typecode, items)
+    except OverflowError:
+        offsets = array.array(_large, offsets)
+        items = array.array(_large, items)
+    offsets.extend(items)
+    return offsets
+
+
+class SearchResult(object):
+    """A compact list of search results.
+
+    The result behaves like the list of (dn, attrs) tuples that is returned
+    by Client.search(), but uses a lot less memory for large results. All
+    attribute values are stored back to back in a single bytearray, and
+    arrays of offsets record where each attribute and value starts.
+    Attribute names are interned and sorted, and entries with the same
+    attributes share one index of attribute names, whatever the order of
+    their attribute dictionaries. The attribute dictionary of an
+    entry is a ResultEntry, which decodes values when they are accessed.
+    """
+
+    def __init__(self, entries=()):
+        """Constructor. `entries' is an iterable of (dn, attrs) tuples."""
+        self.m_entries = []
+        self.m_layouts = {}
+        self.m_arena = bytearray()
+        # Value i is stored at m_values[i] up to m_values[i+1] in the arena.
+        # Attribute j has the values starting at m_attributes[j] up to
+        # m_attributes[j+1]. Both arrays start out with 32-bit items.
+        self.m_values = array.array('I', [0])
+        self.m_attributes = array.array('I')
+        self.extend(entries)
+
+    def append(self, dn, attrs):
+        """Add the entry `dn' with attribute dictionary `attrs'."""
+        names = tuple(sorted(intern(name) for name in attrs))
+        layout = self.m_layouts.get(names)
+        if layout is None:
+            index = dict((name, i) for i, name in enumerate(names))
+            layout = self.m_layouts[names] = (names, index)
+        start = len(self.m_attributes)
+        arena = self.m_arena
+        first = len(self.m_values) - 1
+        attributes = []
+        values = []
+        for name in names:
+            attributes.append(first + len(values))
+            for value in attrs[name]:
+                arena += value
+                values.append(len(arena))
+        self.m_attributes = _extend(self.m_attributes, attributes)
+        self.m_values = _extend(self.m_values, values)
+        self.m_entries.append(ResultEntry(self, dn, layout, start))
+
+    def extend(self, entries):
+        """Add the (dn, attrs) tuples in `entries'."""
+        for dn, attrs in entries:
+            self.append(dn, attrs)
+
+    def entries(self):
+        """Return the list of ResultEntry instances."""
+        return self.m_entries
+
+    def _attribute(self, pos):
+        """Return the values of the attribute with index `pos'."""
+        attributes = self.m_attributes
+        first = attributes[pos]
+        if pos + 1 < len(attributes):
+            last = attributes[pos+1]
+        else:
+            last = len(self.m_values) - 1
+        arena = self.m_arena
+        values = self.m_values
+        return [ bytes(arena[values[i]:values[i+1]])
+                 for i in range(first, last) ]
+
+    def __len__(self):
+        return len(self.m_entries)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ (entry.dn, entry) for entry in self.m_entries[index] ]
+        entry = self.m_entries[index]
+        return (entry.dn, entry)
+
+    def __iter__(self):
+        for entry in self.m_entries:
+            yield (entry.dn, entry)
+
+
+class ResultEntry(object):
+    """The attributes of an entry in a SearchResult.
+
+    This is a read-only mapping of attribute names to lists of values. The
+    distinguished name of the entry is available as the `dn' attribute.
+    """
+
+    __slots__ = ('dn', 'm_result', 'm_layout', 'm_start')
+
+    def __init__(self, result, dn, layout, start):
+        """Constructor."""
+        self.dn = dn
+        self.m_result = result
+        self.m_layout = layout
+        self.m_start = start
+
+    def __getitem__(self, name):
+        """Return the values of attribute `name'."""
+        return self.m_result._attribute(self.m_start + self.m_layout[1][name])
+
+    def get(self, name, default=None):
+        """Return the values of attribute `name', or `default' if the entry
+        does not have that attribute."""
+        if name not in self.m_layout[1]:
+            return default
+        return self[name]
+
+    def __contains__(self, name):
+        return name in self.m_layout[1]
+
+    def __iter__(self):
+        return iter(self.m_layout[0])
+
+    def __len__(self):
+        return len(self.m_layout[0])
+
+    def keys(self):
+        """Return the attribute names."""
+        return list(self.m_layout[0])
+
+    def items(self):
+        """Return a list of (name, values) tuples."""
+        return [ (name, self[name]) for name in self.m_layout[0] ]
+
+    def __eq__(self, other):
+        try:
+            return dict(self.items()) == dict(other.items())
+        except AttributeError:
+            return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'ResultEntry(%r, %r)' % (self.dn, dict(self.items()))
@@ -0,0 +1,941 @@
+/*
+ * This file is part of Python-AD. Python-AD is free software that is made
+ * available under the MIT license. Consult the file "LICENSE" that is
+ * distributed together with this file for the exact licensing terms.
+ *
+ * Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+ * "AUTHORS" for a complete overview.
+ */
+
+/*
+ * C implementation of the ASN.1 Encoder and Decoder from asn1.py. The
+ * types in this module have the same interface and semantics as the
+ * Python versions, and raise the same asn1.Error exception. Values that
+ * are rare in LDAP (object identifiers, integers that do not fit in 64
+ * bits) are handed off to the Python implementation.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+
+#define Boolean 0x01
+#define Integer 0x02
+#define OctetString 0x04
+#define Null 0x05
+#define ObjectIdentifier 0x06
+#define Enumerated 0x0a
+
+#define TypeConstructed 0x20
+#define TypePrimitive 0x00
+#define ClassUniversal 0x00
+
+#if PY_MAJOR_VERSION >= 3
+#define IS_INTEGER(o) PyLong_Check(o)
+#else
+#define IS_INTEGER(o) (PyInt_Check(o) || PyLong_Check(o))
+#endif
+
+#define ERR_NOT_STARTED "Encoder not initialized. Call start() first."
+#define ERR_NO_INPUT "No input selected. Call start() first."
+#define ERR_PREMATURE "Premature end of input."
+#define ERR_SYNTAX "ASN1 syntax error"
+
+
+/* The asn1 module provides the exception type and the fallback code. It
+ * is imported lazily because it imports this module itself. */
+
+static PyObject *asn1_error = NULL;
+static PyObject *py_encoder = NULL;
+static PyObject *py_decoder = NULL;
+
+static int
+load_asn1(void)
+{
+    PyObject *module, *cls;
+
+    if (asn1_error != NULL)
+        return 0;
+    module = PyImport_ImportModule("activedirectory.protocol.asn1");
+    if (module == NULL)
+        return -1;
+    cls = PyObject_GetAttrString(module, "PyEncoder");
+    if (cls == NULL)
+        goto error;
+    py_encoder = PyObject_CallObject(cls, NULL);
+    Py_DECREF(cls);
+    if (py_encoder == NULL)
+        goto error;
+    cls = PyObject_GetAttrString(module, "PyDecoder");
+    if (cls == NULL)
+        goto error;
+    py_decoder = PyObject_CallObject(cls, NULL);
+    Py_DECREF(cls);
+    if (py_decoder == NULL)
+        goto error;
+    asn1_error = PyObject_GetAttrString(module, "Error");
+    if (asn1_error == NULL)
+        goto error;
+    Py_DECREF(module);
+    return 0;
+
+error:
+    Py_CLEAR(py_encoder);
+    Py_CLEAR(py_decoder);
+    Py_DECREF(module);
+    return -1;
+}
+
+static void
+set_error(const char *message)
+{
+    if (load_asn1() < 0)
+        return;
+    PyErr_SetString(asn1_error, message);
+}
+
+static PyObject *
+call_python(PyObject **helper, const char *method, PyObject *arg)
+{
+    if (load_asn1() < 0)
+        return NULL;
+    return PyObject_CallMethod(*helper, (char *) method, "O", arg);
+}
+
+/* Convert an optional integer argument. */
+static int
+optional_int(PyObject *obj, long def, long *value)
+{
+    if (obj == NULL || obj == Py_None)
+    {
+        *value = def;
+        return 0;
+    }
+    *value = PyLong_AsLong(obj);
+    if (*value == -1 && PyErr_Occurred())
+        return -1;
+    return 0;
+}
+
+
+/*
+ * Encoder
+ */
+
+typedef struct {
+    PyObject_HEAD
+    int started;
+    unsigned char *buffer;
+    Py_ssize_t length;
+    Py_ssize_t allocated;
+    Py_ssize_t *stack;
+    Py_ssize_t depth;
+    Py_ssize_t stacksize;
+} Encoder;
+
+static int
+enc_reserve(Encoder *self, Py_ssize_t count)
+{
+    Py_ssize_t size;
+    unsigned char *buffer;
+
+    if (self->length + count <= self->allocated)
+        return 0;
+    size = self->allocated ? self->allocated : 256;
+    while (size < self->length + count)
+        size *= 2;
+    buffer = PyMem_Realloc(self->buffer, size);
+    if (buffer == NULL)
+    {
+        PyErr_NoMemory();
+        return -1;
+    }
+    self->buffer = buffer;
+    self->allocated = size;
+    return 0;
+}
+
+static int
+enc_emit(Encoder *self, const void *data, Py_ssize_t count)
+{
+    if (enc_reserve(self, count) < 0)
+        return -1;
+    memcpy(self->buffer + self->length, data, count);
+    self->length += count;
+    return 0;
+}
+
+static int
+enc_emit_tag(Encoder *self, long nr, long typ, long cls)
+{
+    unsigned char values[sizeof (long) * 2];
+    Py_ssize_t i = sizeof (values);
+
+    if (nr < 31)
+    {
+        values[0] = (unsigned char) (nr | typ | cls);
+        return enc_emit(self, values, 1);
+    }
+    values[--i] = nr & 0x7f;
+    nr >>= 7;
+    while (nr)
+    {
+        values[--i] = (nr & 0x7f) | 0x80;
+        nr >>= 7;
+    }
+    values[--i] = (unsigned char) (typ | cls | 0x1f);
+    return enc_emit(self, values + i, sizeof (values) - i);
+}
+
+/* Store the length octets for `length' in `values'. Return the number of
+ * octets. */
+static Py_ssize_t
+enc_encode_length(Py_ssize_t length, unsigned char *values)
+{
+    Py_ssize_t count, i;
+    size_t value;
+
+    if (length < 128)
+    {
+        values[0] = (unsigned char) length;
+        return 1;
+    }
+    count = 0;
+    for (value = length; value; value >>= 8)
+        count++;
+    values[0] = 0x80 | (unsigned char) count;
+    value = length;
+    for (i = count; i > 0; i--)
+    {
+        values[i] = value & 0xff;
+        value >>= 8;
+    }
+    return count + 1;
+}
+
+static int
+enc_emit_length(Encoder *self, Py_ssize_t length)
+{
+    unsigned char values[sizeof (Py_ssize_t) + 1];
+
+    return enc_emit(self, values, enc_encode_length(length, values));
+}
+
+static int
+enc_check_started(Encoder *self)
+{
+    if (!self->started)
+    {
+        set_error(ERR_NOT_STARTED);
+        return -1;
+    }
+    return 0;
+}
+
+/* Return the universal type for `value', or -1 on error. */
+static long
+enc_universal_type(PyObject *value)
+{
+    if (IS_INTEGER(value))
+        return Integer;
+    else if (PyBytes_Check(value) || PyUnicode_Check(value))
+        return OctetString;
+    else if (value == Py_None)
+        return Null;
+    if (load_asn1() == 0)
+        PyErr_Format(asn1_error, "Cannot encode value of type %s.",
+                     Py_TYPE(value)->tp_name);
+    return -1;
+}
+
+/* Encode the minimal two's complement representation of `value'. */
+static Py_ssize_t
+enc_encode_integer(long long value, unsigned char *values)
+{
+    Py_ssize_t count = 1, i;
+    unsigned long long bits;
+
+    while (count < 8)
+    {
+        long long limit = 1LL << (8 * count - 1);
+        if (value >= -limit && value < limit)
+            break;
+        count++;
+    }
+    bits = (unsigned long long) value;
+    for (i = count - 1; i >= 0; i--)
+    {
+        values[i] = bits & 0xff;
+        bits >>= 8;
+    }
+    return count;
+}
+
+static PyObject *
+Encoder_start(Encoder *self, PyObject *args)
+{
+    self->started = 1;
+    self->length = 0;
+    self->depth = 0;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Encoder_enter(Encoder *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = { "nr", "cls", NULL };
+    long nr, cls;
+    PyObject *clsobj = NULL;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "l|O", kwlist,
+                                     &nr, &clsobj))
+        return NULL;
+    if (enc_check_started(self) < 0)
+        return NULL;
+    if (optional_int(clsobj, ClassUniversal, &cls) < 0)
+        return NULL;
+    if (enc_emit_tag(self, nr, TypeConstructed, cls) < 0)
+        return NULL;
+    if (enc_reserve(self, 1) < 0)
+        return NULL;
+    self->buffer[self->length++] = 0;  /* length slot, patched by leave() */
+    if (self->depth == self->stacksize)
+    {
+        Py_ssize_t size = self->stacksize ? self->stacksize * 2 : 16;
+        Py_ssize_t *stack;
+        stack = PyMem_Realloc(self->stack, size * sizeof (Py_ssize_t));
+        if (stack == NULL)
+            return PyErr_NoMemory();
+        self->stack = stack;
+        self->stacksize = size;
+    }
+    self->stack[self->depth++] = self->length;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Encoder_leave(Encoder *self, PyObject *args)
+{
+    Py_ssize_t offset, length, count;
+    unsigned char values[sizeof (Py_ssize_t) + 1];
+
+    if (enc_check_started(self) < 0)
+        return NULL;
+    if (self->depth == 0)
+    {
+        set_error("Tag stack is empty.");
+        return NULL;
+    }
+    offset = self->stack[--self->depth];
+    length = self->length - offset;
+    count = enc_encode_length(length, values);
+    if (count > 1)
+    {
+        if (enc_reserve(self, count - 1) < 0)
+            return NULL;
+        memmove(self->buffer + offset + count - 1, self->buffer + offset,
+                length);
+        self->length += count - 1;
+    }
+    memcpy(self->buffer + offset - 1, values, count);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Encoder_write(Encoder *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = { "value", "nr", "typ", "cls", NULL };
+    PyObject *value, *nrobj = NULL, *typobj = NULL, *clsobj = NULL;
+    PyObject *encoded = NULL;
+    long nr, typ, cls, type;
+    unsigned char values[8];
+    const void *data = values;
+    Py_ssize_t length = 0;
+    int overflow;
+    long long number;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|OOO", kwlist, &value,
+                                     &nrobj, &typobj, &clsobj))
+        return NULL;
+    if (enc_check_started(self) < 0)
+        return NULL;
+    if (nrobj == NULL || nrobj == Py_None)
+    {
+        if ((nr = enc_universal_type(value)) < 0)
+            return NULL;
+    }
+    else if (optional_int(nrobj, 0, &nr) < 0)
+        return NULL;
+    if (optional_int(typobj, TypePrimitive, &typ) < 0)
+        return NULL;
+    if (optional_int(clsobj, ClassUniversal, &cls) < 0)
+        return NULL;
+    if (cls == ClassUniversal)
+        type = nr;
+    else if ((type = enc_universal_type(value)) < 0)
+        return NULL;
+
+    switch (type)
+    {
+    case Integer:
+    case Enumerated:
+        number = PyLong_AsLongLongAndOverflow(value, &overflow);
+        if (number == -1 && PyErr_Occurred())
+            return NULL;
+        if (overflow)
+        {
+            encoded = call_python(&py_encoder, "_encode_integer", value);
+            if (encoded == NULL)
+                return NULL;
+        }
+        else
+            length = enc_encode_integer(number, values);
+        break;
+    case Boolean:
+        overflow = PyObject_IsTrue(value);
+        if (overflow < 0)
+            return NULL;
+        values[0] = overflow ? 0xff : 0x00;
+        length = 1;
+        break;
+    case Null:
+        break;
+    case ObjectIdentifier:
+        encoded = call_python(&py_encoder, "_encode_object_identifier",
+                              value);
+        if (encoded == NULL)
+            return NULL;
+        break;
+    case OctetString:
+        if (PyUnicode_Check(value))
+        {
+            encoded = PyUnicode_AsUTF8String(value);
+            if (encoded == NULL)
+                return NULL;
+            break;
+        }
+        /* fall through */
+    default:
+        Py_INCREF(value);
+        encoded = value;
+        break;
+    }
+
+    if (encoded != NULL)
+    {
+        if (!PyBytes_Check(encoded))
+        {
+            Py_DECREF(encoded);
+            PyErr_SetString(PyExc_AssertionError,
+                            "Cannot emit a non-bytes value.");
+            return NULL;
+        }
+        data = PyBytes_AS_STRING(encoded);
+        length = PyBytes_GET_SIZE(encoded);
+    }
+    if (enc_emit_tag(self, nr, typ, cls) < 0 ||
+            enc_emit_length(self, length) < 0 ||
+            enc_emit(self, data, length) < 0)
+    {
+        Py_XDECREF(encoded);
+        return NULL;
+    }
+    Py_XDECREF(encoded);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Encoder_write_encoded(Encoder *self, PyObject *value)
+{
+    if (enc_check_started(self) < 0)
+        return NULL;
+    if (!PyBytes_Check(value))
+    {
+        PyErr_SetString(PyExc_AssertionError,
+                        "Cannot emit a non-bytes value.");
+        return NULL;
+    }
+    if (enc_emit(self, PyBytes_AS_STRING(value), PyBytes_GET_SIZE(value)) < 0)
+        return NULL;
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Encoder_output(Encoder *self, PyObject *args)
+{
+    if (enc_check_started(self) < 0)
+        return NULL;
+    if (self->depth != 0)
+    {
+        set_error("Stack is not empty.");
+        return NULL;
+    }
+    return PyBytes_FromStringAndSize((char *) self->buffer, self->length);
+}
+
+static void
+Encoder_dealloc(Encoder *self)
+{
+    PyMem_Free(self->buffer);
+    PyMem_Free(self->stack);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static PyMethodDef Encoder_methods[] =
+{
+    { "start", (PyCFunction) Encoder_start, METH_NOARGS,
+            "Start encoding." },
+    { "enter", (PyCFunction) Encoder_enter, METH_VARARGS | METH_KEYWORDS,
+            "Start a constructed data value." },
+    { "leave", (PyCFunction) Encoder_leave, METH_NOARGS,
+            "Finish a constructed data value." },
+    { "write", (PyCFunction) Encoder_write, METH_VARARGS | METH_KEYWORDS,
+            "Write a primitive data value." },
+    { "write_encoded", (PyCFunction) Encoder_write_encoded, METH_O,
+            "Write an already encoded data value." },
+    { "output", (PyCFunction) Encoder_output, METH_NOARGS,
+            "Return the encoded output." },
+    { NULL, NULL }
+};
+
+static PyTypeObject EncoderType =
+{
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "activedirectory.protocol._asn1.Encoder",  /* tp_name */
+    sizeof (Encoder),                           /* tp_basicsize */
+    0,                                          /* tp_itemsize */
+    (destructor) Encoder_dealloc,               /* tp_dealloc */
+};
+
+
+/*
+ * Decoder
+ */
+
+typedef struct {
+    PyObject_HEAD
+    int started;
+    Py_buffer view;
+    const unsigned char *data;
+    Py_ssize_t offset;
+    Py_ssize_t end;
+    Py_ssize_t *stack;
+    Py_ssize_t depth;
+    Py_ssize_t stacksize;
+    PyObject *tag;
+} Decoder;
+
+static int
+dec_check_started(Decoder *self)
+{
+    if (!self->started)
+    {
+        set_error(ERR_NO_INPUT);
+        return -1;
+    }
+    return 0;
+}
+
+static int
+dec_read_byte(Decoder *self, unsigned char *byte)
+{
+    if (self->offset >= self->end)
+    {
+        set_error(ERR_PREMATURE);
+        return -1;
+    }
+    *byte = self->data[self->offset++];
+    return 0;
+}
+
+static PyObject *
+dec_read_tag(Decoder *self)
+{
+    unsigned char byte;
+    long nr, typ, cls;
+
+    if (dec_read_byte(self, &byte) < 0)
+        return NULL;
+    cls = byte & 0xc0;
+    typ = byte & 0x20;
+    nr = byte & 0x1f;
+    if (nr == 0x1f)
+    {
+        nr = 0;
+        do {
+            if (dec_read_byte(self, &byte) < 0)
+                return NULL;
+            if (nr > (LONG_MAX >> 7))
+            {
+                set_error(ERR_SYNTAX);
+                return NULL;
+            }
+            nr = (nr << 7) | (byte & 0x7f);
+        } while (byte & 0x80);
+    }
+    return Py_BuildValue("(lll)", nr, typ, cls);
+}
+
+/* Read a length. Lengths that do not fit are clamped, which makes the
+ * subsequent bounds check fail. */
+static int
+dec_read_length(Decoder *self, Py_ssize_t *length)
+{
+    unsigned char byte, count;
+    size_t value;
+
+    if (dec_read_byte(self, &byte) < 0)
+        return -1;
+    if (!(byte & 0x80))
+    {
+        *length = byte;
+        return 0;
+    }
+    count = byte & 0x7f;
+    if (count == 0x7f)
+    {
+        set_error(ERR_SYNTAX);
+        return -1;
+    }
+    if (count > self->end - self->offset)
+    {
+        set_error(ERR_PREMATURE);
+        return -1;
+    }
+    value = 0;
+    while (count--)
+    {
+        if (value > ((size_t) PY_SSIZE_T_MAX >> 8))
+            value = PY_SSIZE_T_MAX;
+        else
+            value = (value << 8) | self->data[self->offset];
+        self->offset++;
+    }
+    *length = (Py_ssize_t) value;
+    return 0;
+}
+
+static PyObject *
+dec_peek(Decoder *self)
+{
+    if (self->tag == NULL)
+        self->tag = dec_read_tag(self);
+    return self->tag;
+}
+
+static PyObject *
+dec_decode_integer(const unsigned char *data, Py_ssize_t length)
+{
+    unsigned long long bits = 0;
+    PyObject *bytes, *value;
+    Py_ssize_t i;
+
+    if (length == 0 || (length > 1 &&
+            ((data[0] == 0xff && data[1] & 0x80) ||
+             (data[0] == 0x00 && !(data[1] & 0x80)))))
+    {
+        set_error(ERR_SYNTAX);
+        return NULL;
+    }
+    if (length > 8)
+    {
+        bytes = PyBytes_FromStringAndSize((const char *) data, length);
+        if (bytes == NULL)
+            return NULL;
+        value = call_python(&py_decoder, "_decode_integer", bytes);
+        Py_DECREF(bytes);
+        return value;
+    }
+    for (i = 0; i < length; i++)
+        bits = (bits << 8) | data[i];
+    if (data[0] & 0x80 && length < 8)
+        bits |= ~0ULL << (8 * length);
+#if PY_MAJOR_VERSION < 3
+    if ((long long) bits >= LONG_MIN && (long long) bits <= LONG_MAX)
+        return PyInt_FromLong((long) (long long) bits);
+#endif
+    return PyLong_FromLongLong((long long) bits);
+}
+
+static PyObject *
+dec_decode_value(long nr, const unsigned char *data, Py_ssize_t length)
+{
+    PyObject *bytes, *value;
+
+    switch (nr)
+    {
+    case Boolean:
+        if (length != 1)
+            break;
+        return PyBool_FromLong(data[0] != 0);
+    case Integer:
+    case Enumerated:
+        return dec_decode_integer(data, length);
+    case Null:
+        if (length != 0)
+            break;
+        Py_RETURN_NONE;
+    case ObjectIdentifier:
+        bytes = PyBytes_FromStringAndSize((const char *) data, length);
+        if (bytes == NULL)
+            return NULL;
+        value = call_python(&py_decoder, "_decode_object_identifier",
+                            bytes);
+        Py_DECREF(bytes);
+        return value;
+    default:
+        return PyBytes_FromStringAndSize((const char *) data, length);
+    }
+    set_error(ERR_SYNTAX);
+    return NULL;
+}
+
+static PyObject *
+Decoder_start(Decoder *self, PyObject *data)
+{
+    if (!PyBytes_Check(data) && !PyByteArray_Check(data) &&
+            !PyMemoryView_Check(data))
+    {
+        if (load_asn1() == 0)
+            PyErr_Format(asn1_error, "Expecting %s instance.",
+                         PyBytes_Type.tp_name);
+        return NULL;
+    }
+    if (self->started)
+        PyBuffer_Release(&self->view);
+    self->started = 0;
+    if (PyObject_GetBuffer(data, &self->view, PyBUF_SIMPLE) < 0)
+        return NULL;
+    self->started = 1;
+    self->data = self->view.buf;
+    self->offset = 0;
+    self->end = self->view.len;
+    self->depth = 0;
+    Py_CLEAR(self->tag);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Decoder_peek(Decoder *self, PyObject *args)
+{
+    PyObject *tag;
+
+    if (dec_check_started(self) < 0)
+        return NULL;
+    if (self->offset == self->end)
+        Py_RETURN_NONE;
+    tag = dec_peek(self);
+    Py_XINCREF(tag);
+    return tag;
+}
+
+static PyObject *
+Decoder_read(Decoder *self, PyObject *args)
+{
+    PyObject *tag, *value, *result;
+    Py_ssize_t length;
+    const unsigned char *data;
+    long nr, cls;
+
+    if (dec_check_started(self) < 0)
+        return NULL;
+    if (self->offset == self->end)
+        Py_RETURN_NONE;
+    if ((tag = dec_peek(self)) == NULL)
+        return NULL;
+    if (dec_read_length(self, &length) < 0)
+        return NULL;
+    if (length > self->end - self->offset)
+    {
+        set_error(ERR_PREMATURE);
+        return NULL;
+    }
+    data = self->data + self->offset;
+    self->offset += length;
+    nr = PyLong_AsLong(PyTuple_GET_ITEM(tag, 0));
+    cls = PyLong_AsLong(PyTuple_GET_ITEM(tag, 2));
+    if (cls == ClassUniversal)
+        value = dec_decode_value(nr, data, length);
+    else
+        value = PyBytes_FromStringAndSize((const char *) data, length);
+    if (value == NULL)
+        return NULL;
+    result = PyTuple_Pack(2, tag, value);
+    Py_DECREF(value);
+    Py_CLEAR(self->tag);
+    return result;
+}
+
+static PyObject *
+Decoder_eof(Decoder *self, PyObject *args)
+{
+    if (dec_check_started(self) < 0)
+        return NULL;
+    return PyBool_FromLong(self->offset == self->end);
+}
+
+static PyObject *
+Decoder_enter(Decoder *self, PyObject *args)
+{
+    PyObject *tag;
+    Py_ssize_t length;
+
+    if (dec_check_started(self) < 0)
+        return NULL;
+    if (self->offset == self->end)
+    {
+        set_error(ERR_PREMATURE);
+        return NULL;
+    }
+    if ((tag = dec_peek(self)) == NULL)
+        return NULL;
+    if (PyLong_AsLong(PyTuple_GET_ITEM(tag, 1)) != TypeConstructed)
+    {
+        set_error("Cannot enter a non-constructed tag.");
+        return NULL;
+    }
+    if (dec_read_length(self, &length) < 0)
+        return NULL;
+    if (length > self->end - self->offset)
+    {
+        set_error(ERR_PREMATURE);
+        return NULL;
+    }
+    if (self->depth == self->stacksize)
+    {
+        Py_ssize_t size = self->stacksize ? self->stacksize * 2 : 16;
+        Py_ssize_t *stack;
+        stack = PyMem_Realloc(self->stack, size * sizeof (Py_ssize_t));
+        if (stack == NULL)
+            return PyErr_NoMemory();
+        self->stack = stack;
+        self->stacksize = size;
+    }
+    self->stack[self->depth++] = self->end;
+    self->end = self->offset + length;
+    Py_CLEAR(self->tag);
+    Py_RETURN_NONE;
+}
+
+static PyObject *
+Decoder_leave(Decoder *self, PyObject *args)
+{
+    if (dec_check_started(self) < 0)
+        return NULL;
+    if (self->depth == 0)
+    {
+        set_error("Tag stack is empty.");
+        return NULL;
+    }
+    if (self->offset != self->end)
+    {
+        set_error("Unread data in constructed tag.");
+        return NULL;
+    }
+    self->end = self->stack[--self->depth];
+    Py_CLEAR(self->tag);
+    Py_RETURN_NONE;
+}
+
+static void
+Decoder_dealloc(Decoder *self)
+{
+    if (self->started)
+        PyBuffer_Release(&self->view);
+    PyMem_Free(self->stack);
+    Py_XDECREF(self->tag);
+    Py_TYPE(self)->tp_free((PyObject *) self);
+}
+
+static PyMethodDef Decoder_methods[] =
+{
+    { "start", (PyCFunction) Decoder_start, METH_O,
+            "Start processing `data'." },
+    { "peek", (PyCFunction) Decoder_peek, METH_NOARGS,
+            "Return the value of the next tag without moving to the next\n"
+            "TLV record." },
+    { "read", (PyCFunction) Decoder_read, METH_NOARGS,
+            "Read a simple value and move to the next TLV record." },
+    { "eof", (PyCFunction) Decoder_eof, METH_NOARGS,
+            "Return True if we are end of input." },
+    { "enter", (PyCFunction) Decoder_enter, METH_NOARGS,
+            "Enter a constructed tag." },
+    { "leave", (PyCFunction) Decoder_leave, METH_NOARGS,
+            "Leave the last entered constructed tag. All of its contents must\n"
+            "have been read." },
+    { NULL, NULL }
+};
+
+static PyTypeObject DecoderType =
+{
+    PyVarObject_HEAD_INIT(NULL, 0)
+    "activedirectory.protocol._asn1.Decoder",  /* tp_name */
+    sizeof (Decoder),                           /* tp_basicsize */
+    0,                                          /* tp_itemsize */
+    (destructor) Decoder_dealloc,               /* tp_dealloc */
+};
+
+
+/*
+ * Module
+ */
+
+static PyMethodDef asn1_methods[] =
+{
+    { NULL, NULL }
+};
+
+#if PY_MAJOR_VERSION >= 3
+
+static struct PyModuleDef moduledef = {
+        PyModuleDef_HEAD_INIT,
+        "_asn1",
+        NULL,
+        -1,
+        asn1_methods
+};
+
+#define INITERROR return NULL
+
+PyMODINIT_FUNC
+PyInit__asn1(void)
+
+#else
+#define INITERROR return
+
+void
+init_asn1(void)
+#endif
+{
+    PyObject *module;
+
+    EncoderType.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE;
+    EncoderType.tp_doc = "A ASN.1 encoder. Uses DER encoding.";
+    EncoderType.tp_methods = Encoder_methods;
+    EncoderType.tp_new = PyType_GenericNew;
+    DecoderType.tp_flags = Py_TPFLAGS_DEFAULT | Py_TPFLAGS_BASETYPE;
+    DecoderType.tp_doc = "A ASN.1 decoder. Understands BER (and DER which "
+                         "is a subset).";
+    DecoderType.tp_methods = Decoder_methods;
+    DecoderType.tp_new = PyType_GenericNew;
+    if (PyType_Ready(&EncoderType) < 0 || PyType_Ready(&DecoderType) < 0)
+        INITERROR;
+
+#if PY_MAJOR_VERSION >= 3
+    module = PyModule_Create(&moduledef);
+#else
+    module = Py_InitModule("_asn1", asn1_methods);
+#endif
+
+    if (module == NULL)
+        INITERROR;
+
+    Py_INCREF(&EncoderType);
+    PyModule_AddObject(module, "Encoder", (PyObject *) &EncoderType);
+    Py_INCREF(&DecoderType);
+    PyModule_AddObject(module, "Decoder", (PyObject *) &DecoderType);
+
+#if PY_MAJOR_VERSION >= 3
+    return module;
+#endif
+}
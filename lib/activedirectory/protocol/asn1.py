@@ -8,6 +8,7 @@
 
 from __future__ import absolute_import
 import re
+import binascii
 import six
 from six.moves import map
 from six.moves import range
@@ -33,16 +34,63 @@ class Error(Exception):
     """ASN1 error"""
 
 
+def _integer_length(value):
+    """Return the number of octets in the two's complement representation
+    of `value'."""
+    if value < 0:
+        value = ~value
+    return value.bit_length() // 8 + 1
+
+
+if six.PY3:
+    def _integer_to_bytes(value):
+        """Return the two's complement representation of `value'."""
+        return value.to_bytes(_integer_length(value), 'big', signed=True)
+
+    def _integer_from_bytes(bytes):
+        """Return the integer with two's complement representation
+        `bytes'."""
+        return int.from_bytes(bytes, 'big', signed=True)
+else:
+    def _integer_to_bytes(value):
+        """Return the two's complement representation of `value'."""
+        length = _integer_length(value)
+        if value < 0:
+            value += 1 << (8 * length)
+        return binascii.unhexlify('%0*x' % (2 * length, value))
+
+    def _integer_from_bytes(bytes):
+        """Return the integer with two's complement representation
+        `bytes'."""
+        value = int(binascii.hexlify(bytes), 16)
+        if ord(bytes[0]) & 0x80:
+            value -= 1 << (8 * len(bytes))
+        return value
+
+
+# Message IDs, result codes, scopes and limits are nearly always small.
+_small_integers = tuple(_integer_to_bytes(i) for i in range(65536))
+
+
 class Encoder(object):
-    """A ASN.1 encoder. Uses DER encoding."""
+    """A ASN.1 encoder. Uses DER encoding.
+
+    The output is written into a single bytearray so that every byte is
+    copied once. Because the length of a constructed value is only known
+    when it is left, enter() reserves a one byte length slot that leave()
+    fills in. Values of 128 bytes or more need the long length form, for
+    which the slot is widened in place.
+    """
 
     def __init__(self):
         """Constructor."""
+        self.m_buffer = None
         self.m_stack = None
 
     def start(self):
         """Start encoding."""
-        self.m_stack = [[]]
+        self.m_buffer = bytearray()
+        self.m_stack = []
 
     def enter(self, nr, cls=None):
         """Start a constructed data value."""
@@ -51,108 +99,110 @@ class Encoder(object):
         if cls is None:
             cls = ClassUniversal
         self._emit_tag(nr, TypeConstructed, cls)
-        self.m_stack.append([])
+        self.m_buffer.append(0)  # length slot, patched by leave()
+        self.m_stack.append(len(self.m_buffer))
 
     def leave(self):
         """Finish a constructed data value."""
         if self.m_stack is None:
             raise Error('Encoder not initialized. Call start() first.')
-        if len(self.m_stack) == 1:
+        if not self.m_stack:
             raise Error('Tag stack is empty.')
-        value = b''.join(self.m_stack[-1])
-        del self.m_stack[-1]
-        self._emit_length(len(value))
-        self._emit(value)
+        offset = self.m_stack.pop()
+        length = len(self.m_buffer) - offset
+        if length < 128:
+            self.m_buffer[offset-1] = length
+        else:
+            self.m_buffer[offset-1:offset] = self._encode_length(length)
 
     def write(self, value, nr=None, typ=None, cls=None):
         """Write a primitive data value."""
         if self.m_stack is None:
             raise Error('Encoder not initialized. Call start() first.')
         if nr is None:
-            if isinstance(value, six.integer_types):
-                nr = Integer
-            elif isinstance(value, six.string_types):
-                nr = OctetString
-                if isinstance(value, six.text_type):
-                    value = value.encode('utf-8')
-            elif value is None:
-                nr = Null
+            nr = self._universal_type(value)
         if typ is None:
             typ = TypePrimitive
         if cls is None:
             cls = ClassUniversal
-        value = self._encode_value(nr, value)
+        if cls == ClassUniversal:
+            value = self._encode_value(nr, value)
+        else:
+            # Implicitly tagged value: encode it based on its Python type.
+            value = self._encode_value(self._universal_type(value), value)
         self._emit_tag(nr, typ, cls)
         self._emit_length(len(value))
         self._emit(value)
 
+    def write_encoded(self, value):
+        """Write an already encoded data value."""
+        if self.m_stack is None:
+            raise Error('Encoder not initialized. Call start() first.')
+        self._emit(value)
+
     def output(self):
         """Return the encoded output."""
         if self.m_stack is None:
             raise Error('Encoder not initialized. Call start() first.')
-        if len(self.m_stack) != 1:
+        if self.m_stack:
             raise Error('Stack is not empty.')
-        output = b''.join(self.m_stack[0])
-        return output
+        return bytes(self.m_buffer)
 
     def _emit_tag(self, nr, typ, cls):
         """Emit a tag."""
         if nr < 31:
-            self._emit_tag_short(nr, typ, cls)
+            self.m_buffer.append(nr | typ | cls)
         else:
             self._emit_tag_long(nr, typ, cls)
 
-    def _emit_tag_short(self, nr, typ, cls):
-        """Emit a short (< 31 bytes) tag."""
-        assert nr < 31
-        self._emit(six.int2byte(nr | typ | cls))
-
     def _emit_tag_long(self, nr, typ, cls):
-        """Emit a long (>= 31 bytes) tag."""
-        head = six.int2byte(typ | cls | 0x1f)
-        self._emit(head)
-        values = []
-        values.append((nr & 0x7f))
+        """Emit a long (>= 31) tag."""
+        values = bytearray()
+        values.append(nr & 0x7f)
         nr >>= 7
         while nr:
             values.append((nr & 0x7f) | 0x80)
             nr >>= 7
+        values.append(typ | cls | 0x1f)
         values.reverse()
-        values = list(map(six.int2byte, values))
-        for val in values:
-            self._emit(val)
+        self.m_buffer += values
 
     def _emit_length(self, length):
-        """Emit length octects."""
+        """Emit length octets."""
         if length < 128:
-            self._emit_length_short(length)
+            self.m_buffer.append(length)
         else:
-            self._emit_length_long(length)
-
-    def _emit_length_short(self, length):
-        """Emit the short length form (< 128 octets)."""
-        assert length < 128
-        self._emit(six.int2byte(length))
+            self.m_buffer += self._encode_length(length)
 
-    def _emit_length_long(self, length):
-        """Emit the long length form (>= 128 octets)."""
-        values = []
+    def _encode_length(self, length):
+        """Return the long length form (>= 128 octets) of `length'."""
+        values = bytearray()
         while length:
             values.append(length & 0xff)
             length >>= 8
-        values.reverse()
-        values = list(map(six.int2byte, values))
         # really for correctness as this should not happen anytime soon
         assert len(values) < 127
-        head = six.int2byte(0x80 | len(values))
-        self._emit(head)
-        for val in values:
-            self._emit(val)
+        values.append(0x80 | len(values))
+        values.reverse()
+        return values
 
     def _emit(self, s):
         """Emit raw bytes."""
         assert isinstance(s, six.binary_type)
-        self.m_stack[-1].append(s)
+        self.m_buffer += s
+
+    def _universal_type(self, value):
+        """Return the universal type for the Python value `value'."""
+        if isinstance(value, six.integer_types):
+            nr = Integer
+        elif isinstance(value, (six.binary_type, six.text_type)):
+            nr = OctetString
+        elif value is None:
+            nr = Null
+        else:
+            raise Error('Cannot encode value of type %s.' %
+                        type(value).__name__)
+        return nr
 
     def _encode_value(self, nr, value):
         """Encode a value."""
@@ -174,36 +224,16 @@ class Encoder(object):
 
     def _encode_integer(self, value):
         """Encode an integer."""
-        if value < 0:
-            value = -value
-            negative = True
-            limit = 0x80
-        else:
-            negative = False
-            limit = 0x7f
-        values = []
-        while value > limit:
-            values.append(value & 0xff)
-            value >>= 8
-        values.append(value & 0xff)
-        if negative:
-            # create two's complement
-            for i in range(len(values)):
-                values[i] = 0xff - values[i]
-            for i in range(len(values)):
-                values[i] += 1
-                if values[i] <= 0xff:
-                    break
-                assert i != len(values)-1
-                values[i] = 0x00
-        values.reverse()
-        values = list(map(six.int2byte, values))
-        return b''.join(values)
+        if 0 <= value < 65536:
+            return _small_integers[value]
+        return _integer_to_bytes(value)
 
     def _encode_octet_string(self, value):
         """Encode an octetstring."""
         # Use the primitive encoding
-        return value 
+        if isinstance(value, six.text_type):
+            value = value.encode('utf-8')
+        return value
 
     def _encode_null(self):
         """Encode a Null value."""
@@ -232,18 +262,32 @@ class Encoder(object):
 
 
 class Decoder(object):
-    """A ASN.1 decoder. Understands BER (and DER which is a subset)."""
+    """A ASN.1 decoder. Understands BER (and DER which is a subset).
+
+    The decoder does not copy the input when it enters a constructed
+    value. Instead it keeps an (offset, end) window into a single view of
+    the input, and copies bytes only for the primitive values it returns.
+    """
 
     def __init__(self):
         """Constructor."""
+        self.m_data = None
+        self.m_offset = None
+        self.m_end = None
         self.m_stack = None
         self.m_tag = None
 
     def start(self, data):
         """Start processing `data'."""
-        if not isinstance(data, six.binary_type):
+        if not isinstance(data, (six.binary_type, bytearray, memoryview)):
             raise Error('Expecting %s instance.' % six.binary_type.__name__)
-        self.m_stack = [[0, data]]
+        if six.PY2:
+            self.m_data = bytearray(data)  # index as integers
+        else:
+            self.m_data = memoryview(data).cast('B')
+        self.m_offset = 0
+        self.m_end = len(self.m_data)
+        self.m_stack = []  # end of the enclosing windows
         self.m_tag = None
 
     def peek(self):
@@ -265,33 +309,46 @@ class Decoder(object):
             return None
         tag = self.peek()
         length = self._read_length()
-        value = self._read_value(tag[0], length)
+        if tag[2] == ClassUniversal:
+            value = self._read_value(tag[0], length)
+        else:
+            value = self._read_bytes(length)
         self.m_tag = None
         return (tag, value)
 
     def eof(self):
         """Return True if we are end of input."""
+        if self.m_stack is None:
+            raise Error('No input selected. Call start() first.')
         return self._end_of_input()
 
     def enter(self):
         """Enter a constructed tag."""
         if self.m_stack is None:
             raise Error('No input selected. Call start() first.')
+        if self._end_of_input():
+            raise Error('Premature end of input.')
         nr, typ, cls = self.peek()
         if typ != TypeConstructed:
             raise Error('Cannot enter a non-constructed tag.')
         length = self._read_length()
-        bytes = self._read_bytes(length)
-        self.m_stack.append([0, bytes])
+        end = self.m_offset + length
+        if end > self.m_end:
+            raise Error('Premature end of input.')
+        self.m_stack.append(self.m_end)
+        self.m_end = end
         self.m_tag = None
 
     def leave(self):
-        """Leave the last entered constructed tag."""
+        """Leave the last entered constructed tag. All of its contents must
+        have been read."""
         if self.m_stack is None:
             raise Error('No input selected. Call start() first.')
-        if len(self.m_stack) == 1:
+        if not self.m_stack:
             raise Error('Tag stack is empty.')
-        del self.m_stack[-1]
+        if self.m_offset != self.m_end:
+            raise Error('Unread data in constructed tag.')
+        self.m_end = self.m_stack.pop()
         self.m_tag = None
 
     def _decode_boolean(self, bytes):
@@ -325,13 +382,13 @@ class Decoder(object):
             count = byte & 0x7f
             if count == 0x7f:
                 raise Error('ASN1 syntax error')
-            bytes = self._read_bytes(count)
-            bytes = [ b for b in bytes ]
+            offset = self.m_offset
+            if offset + count > self.m_end:
+                raise Error('Premature end of input.')
             length = 0
-            for byte in bytes:
-                if isinstance(byte, str):
-                    byte = ord(byte)
+            for byte in self.m_data[offset:offset+count]:
                 length = (length << 8) | byte
+            self.m_offset = offset + count
             try:
                 length = int(length)
             except OverflowError:
@@ -359,60 +416,38 @@ class Decoder(object):
 
     def _read_byte(self):
         """Return the next input byte, or raise an error on end-of-input."""
-        index, input = self.m_stack[-1]
-        try:
-            byte = input[index]
-        except IndexError:
+        offset = self.m_offset
+        if offset >= self.m_end:
             raise Error('Premature end of input.')
-        self.m_stack[-1][0] += 1
-        if isinstance(byte, str):
-            byte = ord(byte)
-        return byte
+        self.m_offset = offset + 1
+        return self.m_data[offset]
 
     def _read_bytes(self, count):
         """Return the next `count' bytes of input. Raise error on
         end-of-input."""
-        index, input = self.m_stack[-1]
-        bytes = input[index:index+count]
-        if len(bytes) != count:
+        offset = self.m_offset
+        end = offset + count
+        if end > self.m_end:
             raise Error('Premature end of input.')
-        self.m_stack[-1][0] += count
-        return bytes
+        self.m_offset = end
+        return bytes(self.m_data[offset:end])
 
     def _end_of_input(self):
         """Return True if we are at the end of input."""
-        index, input = self.m_stack[-1]
-        assert not index > len(input)
-        return index == len(input)
+        assert not self.m_offset > self.m_end
+        return self.m_offset == self.m_end
 
     def _decode_integer(self, bytes):
         """Decode an integer value."""
-        if six.PY2:
-            values = [ord(b) for b in bytes]
-        else:
-            values = [b for b in bytes]
-
-        # check if the integer is normalized
-        if len(values) > 1 and \
-                (values[0] == 0xff and values[1] & 0x80 or
-                 values[0] == 0x00 and not (values[1] & 0x80)):
+        if not bytes:
             raise Error('ASN1 syntax error')
-        negative = values[0] & 0x80
-        if negative:
-            # make positive by taking two's complement
-            for i in range(len(values)):
-                values[i] = 0xff - values[i]
-            for i in range(len(values)-1, -1, -1):
-                values[i] += 1
-                if values[i] <= 0xff:
-                    break
-                assert i > 0
-                values[i] = 0x00
-        value = 0
-        for val in values:
-            value = (value << 8) |  val
-        if negative:
-            value = -value
+        # check if the integer is normalized
+        if len(bytes) > 1:
+            first, second = bytearray(bytes[:2])
+            if first == 0xff and second & 0x80 or \
+                    first == 0x00 and not second & 0x80:
+                raise Error('ASN1 syntax error')
+        value = _integer_from_bytes(bytes)
         try:
             value = int(value)
         except OverflowError:
@@ -448,3 +483,15 @@ class Decoder(object):
         result = [result[0] // 40, result[0] % 40] + result[1:]
         result = [six.text_type(r).encode('utf-8') for r in result]
         return b'.'.join(result)
+
+
+# Use the C implementation from the _asn1 extension if it was built. The
+# Python versions remain available, and are used by _asn1 for the values it
+# does not handle itself.
+PyEncoder = Encoder
+PyDecoder = Decoder
+
+try:
+    from ._asn1 import Encoder, Decoder
+except ImportError:
+    pass
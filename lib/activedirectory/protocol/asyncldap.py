@@ -0,0 +1,204 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+"""Asyncio LDAP client. This module requires Python 3.5 or later."""
+
+from __future__ import absolute_import
+import asyncio
+import collections
+
+from . import asn1, ldap
+from .ldap import Error
+
+
+class AsyncClient(object):
+    """An asyncio LDAP client.
+
+    The client uses the LDAP encoder and decoder from the `ldap' module and
+    talks to the server over an asyncio stream. All operations share one
+    connection and are multiplexed by message ID, so any number of
+    operations can be in progress at the same time. Only simple binds are
+    supported.
+    """
+
+    _port = 389
+    _read_size = 65536
+
+    def __init__(self):
+        """Constructor."""
+        self.m_client = ldap.Client()
+        self.m_framer = ldap.MessageFramer()
+        self.m_messages = collections.deque()
+        self.m_reader = None
+        self.m_writer = None
+        self.m_write_lock = None
+        self.m_task = None
+        self.m_pending = {}
+        self.m_msgid = 0
+        self.m_error = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def connect(self, host, port=None, ssl=None):
+        """Connect to the LDAP server at `host':`port'."""
+        if port is None:
+            port = self._port
+        self.m_reader, self.m_writer = \
+            await asyncio.open_connection(host, port, ssl=ssl)
+        self.m_write_lock = asyncio.Lock()
+        self.m_framer = ldap.MessageFramer()
+        self.m_messages.clear()
+        self.m_error = None
+        self.m_task = asyncio.ensure_future(self._read_messages())
+
+    async def close(self):
+        """Unbind and close the connection."""
+        if self.m_writer is None:
+            return
+        writer, self.m_writer = self.m_writer, None
+        if self.m_error is None:
+            writer.write(self.m_client.create_unbind_request(
+                         self._create_message_id()))
+        writer.close()
+        self.m_task.cancel()
+        try:
+            await self.m_task
+        except asyncio.CancelledError:
+            pass
+        self.m_task = None
+        self._fail_pending(Error('Connection closed.'))
+
+    async def bind(self, dn='', password=''):
+        """Perform a simple bind as `dn' with password `password'."""
+        messages = await self._request(self.m_client.create_bind_request,
+                                       dn, password)
+        self._check_result(messages[-1])
+
+    async def search(self, base, filter=None, attrs=None, scope=None,
+                     sizelimit=None, timelimit=None):
+        """Search the directory. The arguments have the same meaning as for
+        ldap.Client.create_search_request(). The result is a list of
+        (dn, attrs) tuples, where `attrs' is a dictionary of attribute
+        names to lists of values."""
+        messages = await self._request(self.m_client.create_search_request,
+                                       base, filter, attrs, scope,
+                                       sizelimit, timelimit)
+        self._check_result(messages[-1])
+        entries = self.m_client.parse_search_result(b''.join(messages[:-1]))
+        result = []
+        for msgid, dn, attrs in entries:
+            attrs = dict((name.decode('utf-8'), values)
+                         for name, values in attrs.items())
+            result.append((dn.decode('utf-8'), attrs))
+        return result
+
+    async def add(self, dn, attrs):
+        """Add an object `dn' with attributes `attrs'. The latter must be a
+        list of (type, values) tuples."""
+        messages = await self._request(self.m_client.create_add_request,
+                                       dn, attrs)
+        self._check_result(messages[-1])
+
+    async def modify(self, dn, mods):
+        """Modify the object `dn' with `mods'. The latter must be a list of
+        (op, type, values) tuples, with `op' one of 'add', 'replace' or
+        'delete'."""
+        mods = [ (ldap.modify_operation(op), type, values)
+                 for op, type, values in mods ]
+        messages = await self._request(self.m_client.create_modify_request,
+                                       dn, mods)
+        self._check_result(messages[-1])
+
+    async def delete(self, dn):
+        """Delete the object `dn'."""
+        messages = await self._request(self.m_client.create_delete_request,
+                                       dn)
+        self._check_result(messages[-1])
+
+    def _create_message_id(self):
+        """Create a new message ID."""
+        self.m_msgid += 1
+        if self.m_msgid == 2**31:
+            self.m_msgid = 1
+        return self.m_msgid
+
+    async def _request(self, create, *args):
+        """Send the request created by `create' and wait for the response.
+        Return the list of response messages."""
+        if self.m_writer is None:
+            raise Error('Not connected.')
+        if self.m_error is not None:
+            raise self.m_error
+        msgid = self._create_message_id()
+        packet = create(*args, msgid=msgid)
+        future = asyncio.get_event_loop().create_future()
+        self.m_pending[msgid] = ([], future)
+        try:
+            # Concurrent drain() calls fail on Python < 3.10 when the
+            # transport is paused, so writes are serialized.
+            async with self.m_write_lock:
+                if self.m_writer is None:
+                    raise Error('Connection closed.')
+                self.m_writer.write(packet)
+                await self.m_writer.drain()
+            return await future
+        except asyncio.CancelledError:
+            if self.m_pending.pop(msgid, None) and self.m_writer is not None:
+                self.m_writer.write(self.m_client.create_abandon_request(
+                                    msgid, self._create_message_id()))
+            raise
+
+    async def _read_message(self):
+        """Read one complete LDAPMessage from the connection."""
+        while not self.m_messages:
+            data = await self.m_reader.read(self._read_size)
+            if not data:
+                raise asyncio.IncompleteReadError(b'', None)
+            self.m_messages.extend(self.m_framer.feed(data))
+        return self.m_messages.popleft()
+
+    async def _read_messages(self):
+        """Read messages and dispatch them to the pending operations."""
+        try:
+            while True:
+                message = await self._read_message()
+                msgid, op = self.m_client.parse_message_header(message)
+                if msgid not in self.m_pending:
+                    continue  # abandoned or unsolicited
+                messages, future = self.m_pending[msgid]
+                messages.append(message)
+                if op in (ldap.SEARCH_RESULT_ENTRY,
+                          ldap.SEARCH_RESULT_REFERENCE):
+                    continue
+                del self.m_pending[msgid]
+                if not future.done():
+                    future.set_result(messages)
+        except (asyncio.IncompleteReadError, OSError, asn1.Error,
+                Error) as err:
+            self.m_error = Error('Connection lost: %s' % err)
+            self._fail_pending(self.m_error)
+
+    def _fail_pending(self, error):
+        """Fail all pending operations with `error'."""
+        pending, self.m_pending = self.m_pending, {}
+        for messages, future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _check_result(self, message):
+        """Raise an error if the LDAPResult in `message' indicates an
+        error."""
+        msgid, op, code, matcheddn, text = self.m_client.parse_result(message)
+        if code != ldap.SUCCESS:
+            text = text.decode('utf-8', 'replace')
+            err = Error(text or 'LDAP result code %d' % code)
+            err.code = code
+            raise err
@@ -0,0 +1,188 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+"""Asyncio Netlogon client. This module requires Python 3.5 or later."""
+
+from __future__ import absolute_import
+import time
+import asyncio
+
+from . import asn1, ldap, netlogon
+from .netlogon import Error
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    """Datagram protocol that passes datagrams to an AsyncClient."""
+
+    def __init__(self, client):
+        self.m_client = client
+
+    def datagram_received(self, data, addr):
+        self.m_client._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        pass  # ICMP errors are treated like lost datagrams
+
+
+class AsyncClient(object):
+    """An asyncio Netlogon client.
+
+    The client sends CLDAP netlogon queries over one UDP endpoint per
+    address family and matches the replies to the queries by message ID, so
+    any number of pings can be in progress at the same time. Queries are
+    encoded and replies are decoded by netlogon.Client, and retries use the
+    same exponential backoff. Host names are resolved in the default
+    executor through a netlogon.AddressCache.
+    """
+
+    _timeout = netlogon.Client._timeout
+    _backoff = netlogon.Client._backoff
+    _retries = netlogon.Client._retries
+    _deadline = netlogon.Client._deadline
+
+    def __init__(self, cache=None):
+        """Constructor. Host names are resolved through the AddressCache
+        `cache', which defaults to the shared netlogon.address_cache."""
+        self.m_client = netlogon.Client(cache)
+        self.m_transports = None
+        self.m_pending = {}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+    async def open(self):
+        """Open the client. UDP endpoints are created when they are first
+        needed."""
+        if self.m_transports is None:
+            self.m_transports = {}
+
+    def close(self):
+        """Close the UDP endpoints. Pings that are in progress fail."""
+        if self.m_transports is None:
+            return
+        transports, self.m_transports = self.m_transports, None
+        for transport in transports.values():
+            transport.close()
+        pending, self.m_pending = self.m_pending, {}
+        for query, addr, future in pending.values():
+            if not future.done():
+                future.set_exception(Error('Client closed.'))
+
+    async def ping(self, addr, domain, timeout=None, retries=None):
+        """Send a netlogon query for `domain' to `addr', which is a
+        (hostname, port) tuple. Return a netlogon.Reply, or None if the
+        server did not send a valid reply."""
+        if self.m_transports is None:
+            raise Error('Client is not open.')
+        if timeout is None:
+            timeout = self._timeout
+        if retries is None:
+            retries = self._retries
+        hostname, port = addr
+        loop = asyncio.get_event_loop()
+        cache = self.m_client.m_cache
+        address = await loop.run_in_executor(None, cache.resolve, hostname)
+        if address is None:
+            raise Error('Could not resolve %s.' % hostname)
+        family = netlogon._address_family(address)
+        transport = await self._get_transport(family)
+        address = (address, port)
+        query = netlogon.Query(hostname, port, domain)
+        future = loop.create_future()
+        try:
+            for i in range(retries):
+                if self.m_transports is None:
+                    raise Error('Client closed.')
+                msgid = self.m_client._create_message_id()
+                packet = self.m_client._create_netlogon_query(domain, msgid)
+                self.m_pending[msgid] = (query, address, future)
+                query.sent[msgid] = time.time()
+                transport.sendto(packet, address)
+                try:
+                    return await asyncio.wait_for(asyncio.shield(future),
+                                                  timeout)
+                except asyncio.TimeoutError:
+                    timeout *= self._backoff
+            return None
+        finally:
+            for msgid in query.sent:
+                self.m_pending.pop(msgid, None)
+
+    async def ping_many(self, addrs, domain, timeout=None, retries=None,
+                        deadline=None, sufficient=None):
+        """Ping all of `addrs' for `domain' at the same time. Return the
+        list of replies in the order they arrived.
+
+        The arguments have the same meaning as for netlogon.Client.call().
+        Servers that cannot be resolved or do not reply are left out of the
+        result.
+        """
+        if deadline is None:
+            deadline = self._deadline
+        loop = asyncio.get_event_loop()
+        end = loop.time() + deadline
+        pending = set(asyncio.ensure_future(
+                      self.ping(addr, domain, timeout, retries))
+                      for addr in addrs)
+        result = []
+        try:
+            while pending:
+                timeleft = end - loop.time()
+                if timeleft <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeleft,
+                                    return_when=asyncio.FIRST_COMPLETED)
+                replies = [ task.result() for task in done
+                            if task.exception() is None and task.result() ]
+                if not replies:
+                    continue
+                result += replies
+                if sufficient is not None and sufficient(result):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        return result
+
+    async def _get_transport(self, family):
+        """Return the UDP endpoint for address family `family'."""
+        if self.m_transports is None:
+            raise Error('Client closed.')
+        transport = self.m_transports.get(family)
+        if transport is None:
+            loop = asyncio.get_event_loop()
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: _Protocol(self), family=family)
+            if self.m_transports is None:
+                transport.close()
+                raise Error('Client closed.')
+            if family in self.m_transports:
+                transport.close()  # created by a concurrent ping
+            else:
+                self.m_transports[family] = transport
+            transport = self.m_transports[family]
+        return transport
+
+    def _datagram_received(self, data, addr):
+        """Complete the ping that `data' from `addr' is a reply to."""
+        try:
+            msgid, opcode = self.m_client._parse_message_header(data)
+        except (asn1.Error, ldap.Error, Error):
+            return
+        if msgid not in self.m_pending:
+            return  # late, or someone sent us an erroneous datagram
+        query, address, future = self.m_pending[msgid]
+        if addr[:2] != address[:2] or future.done():
+            return
+        reply = self.m_client._create_reply(data, addr[:2], query, msgid)
+        future.set_result(reply)
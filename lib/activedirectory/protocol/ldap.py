@@ -7,6 +7,11 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import threading
+import collections
+
+import six
+
 from . import asn1, ldapfilter
 
 
@@ -19,11 +24,268 @@ DEREF_IN_SEARCHING = 1
 DEREF_FINDING_BASE_OBJ = 2
 DEREF_ALWAYS = 3
 
+MOD_ADD = 0
+MOD_DELETE = 1
+MOD_REPLACE = 2
+
+# Protocol operations (application tags)
+BIND_REQUEST = 0
+BIND_RESPONSE = 1
+UNBIND_REQUEST = 2
+SEARCH_REQUEST = 3
+SEARCH_RESULT_ENTRY = 4
+SEARCH_RESULT_DONE = 5
+MODIFY_REQUEST = 6
+MODIFY_RESPONSE = 7
+ADD_REQUEST = 8
+ADD_RESPONSE = 9
+DELETE_REQUEST = 10
+DELETE_RESPONSE = 11
+ABANDON_REQUEST = 16
+SEARCH_RESULT_REFERENCE = 19
+
+SUCCESS = 0
+
 
 class Error(Exception):
     """LDAP Error"""
 
 
+def modify_operation(op):
+    """Return the MOD_* constant for the modify operation `op', which is
+    one of 'add', 'replace' or 'delete', or already a MOD_* constant. The
+    constants have the same values as in python-ldap."""
+    if op == 'add':
+        op = MOD_ADD
+    elif op == 'replace':
+        op = MOD_REPLACE
+    elif op == 'delete':
+        op = MOD_DELETE
+    elif op not in (MOD_ADD, MOD_REPLACE, MOD_DELETE):
+        raise ValueError('Illegal modify operation: %s' % op)
+    return op
+
+
+class FilterCache(object):
+    """A bounded LRU cache that maps LDAP filter strings to their BER
+    encoding. The cache is thread-safe and keeps hit and miss counters so
+    that it can be sized."""
+
+    def __init__(self, maxsize=1024):
+        """Constructor."""
+        self.m_maxsize = maxsize
+        self.m_entries = collections.OrderedDict()
+        self.m_lock = threading.Lock()
+        self.m_hits = 0
+        self.m_misses = 0
+
+    def get(self, filter):
+        """Return the encoding of `filter', or None if it is not cached."""
+        with self.m_lock:
+            encoded = self.m_entries.pop(filter, None)
+            if encoded is None:
+                self.m_misses += 1
+                return None
+            self.m_entries[filter] = encoded  # most recently used
+            self.m_hits += 1
+            return encoded
+
+    def put(self, filter, encoded):
+        """Store the encoding of `filter'."""
+        with self.m_lock:
+            self.m_entries.pop(filter, None)
+            self.m_entries[filter] = encoded
+            while len(self.m_entries) > self.m_maxsize:
+                self.m_entries.popitem(last=False)
+
+    def set_maxsize(self, maxsize):
+        """Change the maximum number of cached filters."""
+        with self.m_lock:
+            self.m_maxsize = maxsize
+            while len(self.m_entries) > self.m_maxsize:
+                self.m_entries.popitem(last=False)
+
+    def clear(self):
+        """Remove all entries and reset the counters."""
+        with self.m_lock:
+            self.m_entries.clear()
+            self.m_hits = 0
+            self.m_misses = 0
+
+    def stats(self):
+        """Return a dictionary with the cache statistics."""
+        with self.m_lock:
+            return {'hits': self.m_hits, 'misses': self.m_misses,
+                    'size': len(self.m_entries), 'maxsize': self.m_maxsize}
+
+
+filter_cache = FilterCache()
+
+
+class MessageFramer(object):
+    """Split a stream of bytes into LDAPMessages.
+
+    Data is passed to feed() in chunks of any size, for example as it is
+    read from a socket. feed() returns the messages that are complete,
+    so that they can be parsed before the rest of the response arrives.
+    Only the bytes of incomplete messages are kept.
+    """
+
+    _compact_size = 65536
+
+    def __init__(self):
+        """Constructor."""
+        self.m_buffer = bytearray()
+        self.m_offset = 0
+
+    def feed(self, data):
+        """Add `data' to the stream and return a list of the complete
+        messages that are available."""
+        self.m_buffer += data
+        messages = []
+        while True:
+            end = self._message_end()
+            if end is None:
+                break
+            messages.append(bytes(self.m_buffer[self.m_offset:end]))
+            self.m_offset = end
+        # Discard consumed data. The buffer is only compacted once the
+        # consumed part is large, so that small messages are not copied
+        # around for every chunk.
+        if self.m_offset == len(self.m_buffer):
+            del self.m_buffer[:]
+            self.m_offset = 0
+        elif self.m_offset > self._compact_size and \
+                self.m_offset * 2 > len(self.m_buffer):
+            del self.m_buffer[:self.m_offset]
+            self.m_offset = 0
+        return messages
+
+    def pending(self):
+        """Return the number of bytes of incomplete messages."""
+        return len(self.m_buffer) - self.m_offset
+
+    def _message_end(self):
+        """Return the end offset of the message at the start of the buffer,
+        or None if it is not complete."""
+        buffer = self.m_buffer
+        offset = self.m_offset
+        available = len(buffer) - offset
+        if available < 2:
+            return None
+        if buffer[offset] != 0x30:  # universal constructed sequence
+            raise Error('LDAP syntax error')
+        length = buffer[offset+1]
+        offset += 2
+        if length & 0x80:
+            count = length & 0x7f
+            if count == 0 or count > 8:  # indefinite or absurd length
+                raise Error('LDAP syntax error')
+            if available < 2 + count:
+                return None
+            length = 0
+            for byte in buffer[offset:offset+count]:
+                length = (length << 8) | byte
+            offset += count
+        end = offset + length
+        if end > len(buffer):
+            return None
+        return end
+
+
+def _read_header(data, offset, end, tag):
+    """Read the header of a TLV record with tag byte `tag' at `offset'.
+    Return the offsets of the start and end of its value."""
+    if offset + 2 > end or six.indexbytes(data, offset) != tag:
+        raise Error('LDAP syntax error')
+    length = six.indexbytes(data, offset + 1)
+    offset += 2
+    if length & 0x80:
+        count = length & 0x7f
+        if count == 0 or offset + count > end:
+            raise Error('LDAP syntax error')
+        length = 0
+        for i in range(offset, offset + count):
+            length = (length << 8) | six.indexbytes(data, i)
+        offset += count
+    if offset + length > end:
+        raise Error('LDAP syntax error')
+    return offset, offset + length
+
+
+class SearchResultEntry(object):
+    """A search result entry that decodes its attributes on access.
+
+    The entry is a read-only mapping of attribute types to lists of
+    values, like the attribute dictionaries that are returned by
+    Client.parse_search_result(). The encoded attributes are scanned once
+    to find where each attribute is. The values of an attribute are
+    decoded every time it is accessed.
+    """
+
+    __slots__ = ('msgid', 'dn', 'm_data', 'm_index')
+
+    def __init__(self, msgid, dn, data):
+        """Constructor. The `data' argument is the encoded contents of the
+        attributes SEQUENCE of a SearchResultEntry."""
+        self.msgid = msgid
+        self.dn = dn
+        self.m_data = data
+        self.m_index = self._scan_attributes(data)
+
+    def _scan_attributes(self, data):
+        """Return a dictionary mapping attribute types to the offsets of
+        their encoded values."""
+        index = {}
+        offset, end = 0, len(data)
+        while offset < end:
+            start, offset = _read_header(data, offset, end, 0x30)
+            start, next = _read_header(data, start, offset, 0x04)
+            name = data[start:next]
+            index[name] = _read_header(data, next, offset, 0x31)
+        return index
+
+    def __getitem__(self, name):
+        """Return the values of attribute `name'."""
+        start, end = self.m_index[name]
+        decoder = asn1.Decoder()
+        decoder.start(memoryview(self.m_data)[start:end])
+        values = []
+        while True:
+            tag = decoder.peek()
+            if tag is None:
+                break
+            if tag != (asn1.OctetString, asn1.TypePrimitive,
+                       asn1.ClassUniversal):
+                raise Error('LDAP syntax error')
+            values.append(decoder.read()[1])
+        return values
+
+    def get(self, name, default=None):
+        """Return the values of attribute `name', or `default' if the entry
+        does not have that attribute."""
+        if name not in self.m_index:
+            return default
+        return self[name]
+
+    def __contains__(self, name):
+        return name in self.m_index
+
+    def __iter__(self):
+        return iter(self.m_index)
+
+    def __len__(self):
+        return len(self.m_index)
+
+    def keys(self):
+        """Return the attribute types."""
+        return list(self.m_index)
+
+    def items(self):
+        """Return a list of (type, values) tuples."""
+        return [ (name, self[name]) for name in self.m_index ]
+
+
 class Client(object):
     """LDAP client."""
 
@@ -41,7 +303,7 @@ class Client(object):
             encoder.leave()
         elif isinstance(filter, ldapfilter.NOT):
             encoder.enter(2, asn1.ClassContext)
-            self._encode_filter(encoder, term)
+            self._encode_filter(encoder, filter.term)
             encoder.leave()
         elif isinstance(filter, ldapfilter.EQUALS):
             encoder.enter(3, asn1.ClassContext)
@@ -59,20 +321,60 @@ class Client(object):
             encoder.write(filter.value)
             encoder.leave()
         elif isinstance(filter, ldapfilter.PRESENT):
-            encoder.enter(7, asn1.ClassContext)
+            encoder.write(filter.type, 7, asn1.TypePrimitive,
+                          asn1.ClassContext)
+        elif isinstance(filter, ldapfilter.SUBSTRING):
+            encoder.enter(4, asn1.ClassContext)
             encoder.write(filter.type)
+            encoder.enter(asn1.Sequence)
+            if filter.initial is not None:
+                encoder.write(filter.initial, 0, asn1.TypePrimitive,
+                              asn1.ClassContext)
+            for value in filter.any:
+                encoder.write(value, 1, asn1.TypePrimitive, asn1.ClassContext)
+            if filter.final is not None:
+                encoder.write(filter.final, 2, asn1.TypePrimitive,
+                              asn1.ClassContext)
+            encoder.leave()
             encoder.leave()
         elif isinstance(filter, ldapfilter.APPROX):
             encoder.enter(8, asn1.ClassContext)
             encoder.write(filter.type)
             encoder.write(filter.value)
             encoder.leave()
+        elif isinstance(filter, ldapfilter.EXTENSIBLE):
+            encoder.enter(9, asn1.ClassContext)
+            if filter.rule is not None:
+                encoder.write(filter.rule, 1, asn1.TypePrimitive,
+                              asn1.ClassContext)
+            if filter.type is not None:
+                encoder.write(filter.type, 2, asn1.TypePrimitive,
+                              asn1.ClassContext)
+            encoder.write(filter.value, 3, asn1.TypePrimitive,
+                          asn1.ClassContext)
+            if filter.dnattrs:
+                encoder.write(b'\xff', 4, asn1.TypePrimitive,
+                              asn1.ClassContext)
+            encoder.leave()
+
+    def _encode_filter_string(self, filter):
+        """Parse and encode the filter string `filter'. Encoded filters are
+        kept in `filter_cache'."""
+        encoded = filter_cache.get(filter)
+        if encoded is None:
+            parser = ldapfilter.Parser()
+            parsed = parser.parse(filter)
+            encoder = asn1.Encoder()
+            encoder.start()
+            self._encode_filter(encoder, parsed)
+            encoded = encoder.output()
+            filter_cache.put(filter, encoded)
+        return encoded
 
     def create_search_request(self, dn, filter=None, attrs=None, scope=None,
                               sizelimit=None, timelimit=None, deref=None,
                               typesonly=None, msgid=None):
-        """Create a search request. This only supports a very simple AND
-        filter."""
+        """Create a search request."""
         if filter is None:
             filter = '(objectClass=*)'
         if attrs is None:
@@ -89,8 +391,7 @@ class Client(object):
             typesonly = False
         if msgid is None:
             msgid = 1
-        parser = ldapfilter.Parser()
-        parsed =  parser.parse(filter)
+        encoded = self._encode_filter_string(filter)
         encoder = asn1.Encoder()
         encoder.start()
         encoder.enter(asn1.Sequence)  # LDAPMessage
@@ -102,7 +403,7 @@ class Client(object):
         encoder.write(sizelimit)
         encoder.write(timelimit)
         encoder.write(typesonly, asn1.Boolean)
-        self._encode_filter(encoder, parsed)
+        encoder.write_encoded(encoded)  # filter
         encoder.enter(asn1.Sequence)  # attributes
         for attr in attrs:
             encoder.write(attr)
@@ -112,6 +413,89 @@ class Client(object):
         result = encoder.output()
         return result
 
+    def _start_message(self, msgid):
+        """Return an encoder positioned inside a new LDAPMessage."""
+        encoder = asn1.Encoder()
+        encoder.start()
+        encoder.enter(asn1.Sequence)  # LDAPMessage
+        encoder.write(msgid)
+        return encoder
+
+    def _finish_message(self, encoder):
+        """Finish the LDAPMessage started by _start_message()."""
+        encoder.leave()  # end of LDAPMessage
+        return encoder.output()
+
+    def _encode_attribute(self, encoder, type, values):
+        """Encode an attribute `type' with values `values'."""
+        encoder.enter(asn1.Sequence)  # PartialAttribute
+        encoder.write(type)
+        encoder.enter(asn1.Set)
+        for value in values:
+            encoder.write(value, asn1.OctetString)
+        encoder.leave()  # end of vals
+        encoder.leave()  # end of PartialAttribute
+
+    def create_bind_request(self, dn, password, msgid):
+        """Create a simple bind request."""
+        encoder = self._start_message(msgid)
+        encoder.enter(BIND_REQUEST, asn1.ClassApplication)
+        encoder.write(3)  # version
+        encoder.write(dn, asn1.OctetString)
+        encoder.write(password, 0, asn1.TypePrimitive, asn1.ClassContext)
+        encoder.leave()  # end of BindRequest
+        return self._finish_message(encoder)
+
+    def create_unbind_request(self, msgid):
+        """Create an unbind request."""
+        encoder = self._start_message(msgid)
+        encoder.write(None, UNBIND_REQUEST, asn1.TypePrimitive,
+                      asn1.ClassApplication)
+        return self._finish_message(encoder)
+
+    def create_abandon_request(self, abandon, msgid):
+        """Create a request to abandon the operation with ID `abandon'."""
+        encoder = self._start_message(msgid)
+        encoder.write(abandon, ABANDON_REQUEST, asn1.TypePrimitive,
+                      asn1.ClassApplication)
+        return self._finish_message(encoder)
+
+    def create_add_request(self, dn, attrs, msgid):
+        """Create an add request. The `attrs' argument must be a list of
+        (type, values) tuples."""
+        encoder = self._start_message(msgid)
+        encoder.enter(ADD_REQUEST, asn1.ClassApplication)
+        encoder.write(dn, asn1.OctetString)
+        encoder.enter(asn1.Sequence)  # attributes
+        for type, values in attrs:
+            self._encode_attribute(encoder, type, values)
+        encoder.leave()  # end of attributes
+        encoder.leave()  # end of AddRequest
+        return self._finish_message(encoder)
+
+    def create_modify_request(self, dn, mods, msgid):
+        """Create a modify request. The `mods' argument must be a list of
+        (op, type, values) tuples with `op' one of the MOD_* constants."""
+        encoder = self._start_message(msgid)
+        encoder.enter(MODIFY_REQUEST, asn1.ClassApplication)
+        encoder.write(dn, asn1.OctetString)
+        encoder.enter(asn1.Sequence)  # changes
+        for op, type, values in mods:
+            encoder.enter(asn1.Sequence)  # change
+            encoder.write(op, asn1.Enumerated)
+            self._encode_attribute(encoder, type, values)
+            encoder.leave()  # end of change
+        encoder.leave()  # end of changes
+        encoder.leave()  # end of ModifyRequest
+        return self._finish_message(encoder)
+
+    def create_delete_request(self, dn, msgid):
+        """Create a delete request."""
+        encoder = self._start_message(msgid)
+        encoder.write(dn, DELETE_REQUEST, asn1.TypePrimitive,
+                      asn1.ClassApplication)
+        return self._finish_message(encoder)
+
     def parse_message_header(self, buffer):
         """Parse an LDAP header and return the tuple (messageid,
         protocolOp)."""
@@ -122,7 +506,8 @@ class Client(object):
         self._check_tag(decoder.peek(), asn1.Integer)
         msgid = decoder.read()[1]
         tag = decoder.peek()
-        self._check_tag(tag, None, asn1.TypeConstructed, asn1.ClassApplication)
+        # Some operations (e.g. DelRequest) are primitive
+        self._check_tag(tag, None, tag[1], asn1.ClassApplication)
         op = tag[0]
         return (msgid, op)
 
@@ -133,6 +518,52 @@ class Client(object):
         is a (msgid, dn, attrs) tuple. attrs is a dictionary with LDAP types
         as keys and a list of attribute values as its values.
         """
+        return self._parse_search_result(buffer, self._parse_attributes)
+
+    def parse_search_entries(self, buffer):
+        """Parse an LDAP search result into a list of SearchResultEntry
+        instances. The attributes of the entries are decoded only when they
+        are accessed."""
+        return self._parse_search_result(buffer, self._create_entry)
+
+    def _parse_attributes(self, decoder, msgid, dn):
+        """Parse the attributes of a search result entry. Return the tuple
+        (msgid, dn, attrs)."""
+        decoder.enter()  # enter attributes
+        attrs = {}
+        while True:
+            tag = decoder.peek()
+            if tag is None:
+                break
+            self._check_tag(tag, asn1.Sequence)
+            decoder.enter()  # one attribute
+            self._check_tag(decoder.peek(), asn1.OctetString)
+            name = decoder.read()[1]  # type
+            self._check_tag(decoder.peek(), asn1.Set)
+            decoder.enter()  # vals
+            values = []
+            while True:
+                tag = decoder.peek()
+                if tag is None:
+                    break
+                self._check_tag(tag, asn1.OctetString)
+                values.append(decoder.read()[1])
+            attrs[name] = values
+            decoder.leave()  # leave vals
+            decoder.leave()  # leave attribute
+        decoder.leave()  # leave attributes
+        return (msgid, dn, attrs)
+
+    def _create_entry(self, decoder, msgid, dn):
+        """Create a SearchResultEntry from the attributes of a search result
+        entry."""
+        data = decoder.read()[1]  # the encoded attributes
+        return SearchResultEntry(msgid, dn, data)
+
+    def _parse_search_result(self, buffer, parse_attributes):
+        """Parse an LDAP search result. The attributes of each entry are
+        parsed by `parse_attributes', which also creates the result
+        entries."""
         decoder = asn1.Decoder()
         decoder.start(buffer)
         messages = []
@@ -145,39 +576,54 @@ class Client(object):
             self._check_tag(decoder.peek(), asn1.Integer)
             msgid = decoder.read()[1]  # messageID
             tag = decoder.peek()
-            self._check_tag(tag, (4,5), asn1.TypeConstructed, asn1.ClassApplication)
-            if tag[0] == 5:
+            self._check_tag(tag, (4,5,19), asn1.TypeConstructed, asn1.ClassApplication)
+            if tag[0] == SEARCH_RESULT_DONE:
                 break
+            elif tag[0] == SEARCH_RESULT_REFERENCE:
+                decoder.read()  # skip continuation references
+                self._skip_controls(decoder)
+                decoder.leave()  # leave LDAPMessage
+                continue
             decoder.enter()  #  SearchResultEntry
             self._check_tag(decoder.peek(), asn1.OctetString)
             dn = decoder.read()[1]  # objectName
             self._check_tag(decoder.peek(), asn1.Sequence)
-            decoder.enter()  # enter attributes
-            attrs = {}
-            while True:
-                tag = decoder.peek()
-                if tag is None:
-                    break
-                self._check_tag(tag, asn1.Sequence)
-                decoder.enter()  # one attribute
-                self._check_tag(decoder.peek(), asn1.OctetString)
-                name = decoder.read()[1]  # type
-                self._check_tag(decoder.peek(), asn1.Set)
-                decoder.enter()  # vals
-                values = []
-                while True:
-                    tag = decoder.peek()
-                    if tag is None:
-                        break
-                    self._check_tag(tag, asn1.OctetString)
-                    values.append(decoder.read()[1])
-                attrs[name] = values
-                decoder.leave()  # leave vals
-                decoder.leave()  # leave attribute
-            decoder.leave()  # leave attributes
-            messages.append((msgid, dn, attrs))
+            messages.append(parse_attributes(decoder, msgid, dn))
+            decoder.leave()  # leave SearchResultEntry
+            self._skip_controls(decoder)
+            decoder.leave()  # leave LDAPMessage
         return messages
 
+    def _skip_controls(self, decoder):
+        """Skip the optional controls at the end of an LDAPMessage."""
+        tag = decoder.peek()
+        if tag is not None:
+            self._check_tag(tag, 0, asn1.TypeConstructed, asn1.ClassContext)
+            decoder.read()
+
+    def parse_result(self, buffer):
+        """Parse an LDAP response that carries an LDAPResult.
+
+        This returns the tuple (msgid, op, code, matcheddn, message).
+        """
+        decoder = asn1.Decoder()
+        decoder.start(buffer)
+        self._check_tag(decoder.peek(), asn1.Sequence)
+        decoder.enter()  # enter LDAPMessage
+        self._check_tag(decoder.peek(), asn1.Integer)
+        msgid = decoder.read()[1]
+        tag = decoder.peek()
+        self._check_tag(tag, None, asn1.TypeConstructed, asn1.ClassApplication)
+        op = tag[0]
+        decoder.enter()  # enter response
+        self._check_tag(decoder.peek(), asn1.Enumerated)
+        code = decoder.read()[1]  # resultCode
+        self._check_tag(decoder.peek(), asn1.OctetString)
+        matcheddn = decoder.read()[1]
+        self._check_tag(decoder.peek(), asn1.OctetString)
+        message = decoder.read()[1]  # diagnosticMessage
+        return (msgid, op, code, matcheddn, message)
+
     def _check_tag(self, tag, id, typ=None, cls=None):
         """Ensure that `tag' matches with `id', `typ' and `syntax'."""
         if cls is None:
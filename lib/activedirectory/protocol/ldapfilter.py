@@ -8,7 +8,6 @@
 
 from __future__ import absolute_import
 import re
-from activedirectory.util.parser import Parser as PLYParser
 
 
 class Error(Exception):
@@ -60,94 +59,124 @@ class PRESENT(object):
         self.type = type
 
 
-class Parser(PLYParser):
-    """A parser for LDAP filters (see RFC2254).
+class SUBSTRING(object):
 
-    The parser is pretty complete. Currently lacking are substring matches and
+    def __init__(self, type, initial, any, final):
+        self.type = type
+        self.initial = initial
+        self.any = any
+        self.final = final
+
+class EXTENSIBLE(object):
+
+    def __init__(self, type, rule, value, dnattrs=False):
+        self.type = type
+        self.rule = rule
+        self.value = value
+        self.dnattrs = dnattrs
+
+
+class Parser(object):
+    """A parser for LDAP filters (see RFC4515).
+
+    This is a recursive descent parser that works on offsets into the input
+    string. It supports all filter types including substring matches and
     extensible matches.
     """
 
-    exception = Error
-    tokens = ('LPAREN', 'RPAREN', 'EQUALS', 'AND', 'OR', 'NOT',
-              'LTE','GTE', 'APPROX', 'PRESENT', 'STRING')
-
-    t_LPAREN = r'\('
-    t_RPAREN = r'\)'
-    t_EQUALS = r'='
-    t_AND = r'&'
-    t_OR = r'\|'
-    t_NOT = r'!'
-    t_LTE = r'<='
-    t_GTE = r'>='
-    t_APPROX = r'~='
-    t_PRESENT = r'=\*'
-
+    re_item = re.compile(r'([^()=<>~:*&|!\\]*)(:[dD][nN])?(?::([^()=<>~:*]+))?'
+                         r'(:=|=|~=|>=|<=)')
+    re_value = re.compile(r'[^()]*')
     re_escape = re.compile(r'\\([0-9a-fA-F]{2})')
+    re_bad_escape = re.compile(r'\\(?![0-9a-fA-F]{2})')
+
+    def parse(self, input, fname=None):
+        """Parse the filter `input' and return the parsed filter."""
+        if hasattr(input, 'read'):
+            input = input.read()
+        self.m_input = input
+        parsed, pos = self._parse_filter(input, 0)
+        if pos != len(input):
+            self._error(pos)
+        return parsed
+
+    def _error(self, pos):
+        """Raise a syntax error at position `pos'."""
+        err = Error('syntax error at position %d' % pos)
+        err.message = str(err)
+        raise err
+
+    def _parse_filter(self, input, pos):
+        """Parse a parenthesized filter at `pos'. Return the tuple (filter,
+        pos) with `pos' the position after the filter."""
+        if not input.startswith('(', pos):
+            self._error(pos)
+        pos += 1
+        op = input[pos:pos+1]
+        if op == '&' or op == '|':
+            pos += 1
+            terms = []
+            while input.startswith('(', pos):
+                term, pos = self._parse_filter(input, pos)
+                terms.append(term)
+            if not terms:
+                self._error(pos)
+            if op == '&':
+                parsed = AND(*terms)
+            else:
+                parsed = OR(*terms)
+        elif op == '!':
+            term, pos = self._parse_filter(input, pos+1)
+            parsed = NOT(term)
+        else:
+            parsed, pos = self._parse_item(input, pos)
+        if not input.startswith(')', pos):
+            self._error(pos)
+        return parsed, pos+1
+
+    def _parse_item(self, input, pos):
+        """Parse a simple, present, substring or extensible item."""
+        mobj = self.re_item.match(input, pos)
+        if mobj is None:
+            self._error(pos)
+        type, dn, rule, op = mobj.groups()
+        pos = mobj.end()
+        end = self.re_value.match(input, pos).end()
+        value = input[pos:end]
+        if self.re_bad_escape.search(value):
+            self._error(pos)
+        if op == ':=':
+            if not type and not rule or '*' in value:
+                self._error(pos)
+            parsed = EXTENSIBLE(type or None, rule, self._unescape(value),
+                                dn is not None)
+        elif not type or dn is not None or rule is not None:
+            self._error(mobj.start())
+        elif '*' not in value:
+            value = self._unescape(value)
+            if op == '=':
+                parsed = EQUALS(type, value)
+            elif op == '<=':
+                parsed = LTE(type, value)
+            elif op == '>=':
+                parsed = GTE(type, value)
+            else:
+                parsed = APPROX(type, value)
+        elif op != '=':
+            self._error(pos)
+        elif value == '*':
+            parsed = PRESENT(type)
+        else:
+            parts = value.split('*')
+            if '' in parts[1:-1]:
+                self._error(pos)
+            parts = [ self._unescape(part) for part in parts ]
+            parsed = SUBSTRING(type, parts[0] or None, parts[1:-1],
+                               parts[-1] or None)
+        return parsed, end
 
     def _unescape(self, value):
         """Unescape a hex encoded string."""
-        pos = 0
-        parts = []
-        while True:
-            mobj = self.re_escape.search(value, pos)
-            if not mobj:
-                parts.append(value[pos:])
-                break
-            parts.append(value[pos:mobj.start()])
-            ch = chr(int(mobj.group(1), 16))
-            parts.append(ch)
-            pos = mobj.end()
-        result = ''.join(parts)
-        return result
-
-    def t_STRING(self, t):
-        r'[^()=&|!<>~*]+'
-        t.value = self._unescape(t.value)
-        return t
-
-    def p_filter(self, p):
-        """filter : LPAREN and RPAREN
-                  | LPAREN or RPAREN
-                  | LPAREN not RPAREN
-                  | LPAREN item RPAREN
-        """
-        p[0] = p[2]
-
-    def p_and(self, p):
-        'and : AND filterlist'
-        p[0] = AND(*p[2])
-
-    def p_or(self, p):
-        'or : OR filterlist'
-        p[0] = OR(*p[2])
-
-    def p_not(self, p):
-        'not : NOT filter'
-        p[0] = NOT(p[2])
-
-    def p_filterlist(self, p):
-        """filterlist : filter
-                      | filter filterlist
-        """
-        if len(p) == 2:
-            p[0] = (p[1],)
-        else:
-            p[0] = (p[1],) + p[2]
-
-    def p_item(self, p):
-        """item : STRING EQUALS STRING
-                | STRING LTE STRING
-                | STRING GTE STRING
-                | STRING APPROX STRING
-                | STRING PRESENT
-        """
-        if p[2] == '=':
-            p[0] = EQUALS(p[1], p[3])
-        elif p[2] == '<=':
-            p[0] = LTE(p[1], p[3])
-        elif p[2] == '>=':
-            p[0] = GTE(p[1], p[3])
-        elif p[2] == '~=':
-            p[0] = APPROX(p[1], p[3])
-        elif p[2] == '=*':
-            p[0] = PRESENT(p[1])
+        if '\\' not in value:
+            return value
+        return self.re_escape.sub(lambda m: chr(int(m.group(1), 16)), value)
@@ -7,16 +7,25 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import os
 import time
+import heapq
 import errno
 import socket
 import select
+import struct
 import random
+import weakref
+import threading
+import functools
+
+import dns.resolver
+import dns.exception
 
 from ..util import misc
 from . import asn1, ldap
 import six
-from six.moves import range
+from six.moves import queue, range
 
 
 SERVER_PDC = 0x1
@@ -39,12 +48,26 @@ class Reply(object):
 
     def __init__(self, **kwargs):
         """Constructor."""
-        for key in kwargs:
-            setattr(self, key, kwargs[key])
+        self.__dict__.update(kwargs)
 
 
 class Decoder(object):
-    """Netlogon decoder."""
+    """Netlogon decoder.
+
+    Integers are read with struct. Compressed names often share suffixes
+    through pointers, so every name that is decoded at an offset is
+    remembered, and a shared suffix is decompressed only once per buffer.
+    """
+
+    _header = struct.Struct('<II16s')
+    _uint32 = struct.Struct('<I')
+
+    def __init__(self):
+        """Constructor."""
+        self.m_buffer = None
+        self.m_data = None
+        self.m_offset = None
+        self.m_names = None
 
     def start(self, buffer):
         """Start decoding `buffer'."""
@@ -53,9 +76,12 @@ class Decoder(object):
 
     def parse(self):
         """Parse a netlogon reply."""
-        type = self._decode_uint32()
-        flags = self._decode_uint32()
-        domain_guid = self._read_bytes(16)
+        offset = self.m_offset
+        if offset + self._header.size > len(self.m_data):
+            raise Error('Premature end of input.')
+        type, flags, domain_guid = self._header.unpack_from(self.m_data,
+                                                            offset)
+        self.m_offset = offset + self._header.size
         forest = self._decode_rfc1035()
         domain = self._decode_rfc1035()
         hostname = self._decode_rfc1035()
@@ -70,50 +96,66 @@ class Decoder(object):
                      netbios_hostname=netbios_hostname, user=user,
                      client_site=client_site, server_site=server_site)
 
-    def _decode_rfc1035(self, _pointer=False):
+    def _decode_rfc1035(self):
         """Decompress an RFC1035 (section 4.1.4) compressed string."""
-        result = []
-        if _pointer == False:
-            _pointer = []
+        data = self.m_data
+        names = self.m_names
+        size = len(data)
+        offset = start = self.m_offset
+        end = None  # where the name ends at the start offset
+        labels = []
+        visited = None  # pointers followed, to detect cycles
+        marks = None  # (offset, label index) of each pointer target
         while True:
-            tag = self._read_byte()
+            if offset >= size:
+                raise Error('Premature end of input.')
+            tag = data[offset]
             if tag == 0:
+                offset += 1
                 break
             elif tag & 0xc0 == 0xc0:
-                byte = self._read_byte()
-                ptr = ((tag & ~0xc0) << 8) + byte
-                if ptr in _pointer:
+                if offset + 1 >= size:
+                    raise Error('Premature end of input.')
+                ptr = ((tag & 0x3f) << 8) | data[offset+1]
+                if end is None:
+                    end = offset + 2
+                    visited = set()
+                    marks = []
+                if ptr in visited:
                     raise Error('Cyclic pointer')
-                _pointer.append(ptr)
-                saved, self.m_offset = self.m_offset, ptr
-                result.append(self._decode_rfc1035(_pointer))
-                self.m_offset = saved
-                break
+                visited.add(ptr)
+                suffix = names.get(ptr)
+                if suffix is not None:
+                    if suffix:
+                        labels.append(suffix)
+                    break
+                marks.append((ptr, len(labels)))
+                offset = ptr
             elif tag & 0xc0:
                 raise Error('Illegal tag')
             else:
-                s = self._read_bytes(tag)
-                result.append(s)
-        result = b'.'.join(result)
+                offset += 1
+                if offset + tag > size:
+                    raise Error('Premature end of input.')
+                labels.append(six.binary_type(data[offset:offset+tag]))
+                offset += tag
+        result = names[start] = b'.'.join(labels)
+        if end is None:
+            end = offset
+        else:
+            for ptr, index in marks:
+                names[ptr] = b'.'.join(labels[index:])
+        self.m_offset = end
         return result
 
-    def _try_convert_int(self, value):
-        """Try to convert `value' to an integer."""
-        try:
-            value = int(value)
-        except OverflowError:
-            pass
-        return value
-
     def _decode_uint32(self):
         """Decode a 32-bit unsigned little endian integer from the current
         offset."""
-        value = 0
-        for i in range(4):
-            byte = self._read_byte()
-            value |= (byte << i*8)
-        value = self._try_convert_int(value)
-        return value
+        offset = self.m_offset
+        if offset + 4 > len(self.m_data):
+            raise Error('Premature end of input.')
+        self.m_offset = offset + 4
+        return self._uint32.unpack_from(self.m_data, offset)[0]
 
     def _offset(self):
         """Return the current offset."""
@@ -131,9 +173,16 @@ class Decoder(object):
 
     def _set_buffer(self, buffer):
         """Set the current buffer."""
-        if not isinstance(buffer, six.binary_type):
+        if not isinstance(buffer, (six.binary_type, bytearray, memoryview)):
             raise Error('Buffer must be bytes.')
         self.m_buffer = buffer
+        if six.PY2:
+            self.m_data = bytearray(buffer)  # index as integers
+        elif isinstance(buffer, bytes):
+            self.m_data = buffer
+        else:
+            self.m_data = bytes(buffer)
+        self.m_names = {}
 
     def _read_byte(self, offset=None):
         """Read a single byte from the input."""
@@ -142,11 +191,9 @@ class Decoder(object):
             update_offset = True
         else:
             update_offset = False
-        if offset >= len(self.m_buffer):
+        if offset >= len(self.m_data):
             raise Error('Premature end of input.')
-        byte = self.m_buffer[offset]
-        if isinstance(byte, str):
-            byte = ord(byte)
+        byte = self.m_data[offset]
         if update_offset:
             self.m_offset += 1
         return byte
@@ -159,146 +206,505 @@ class Decoder(object):
             update_offset = True
         else:
             update_offset = False
-        bytes = self.m_buffer[offset:offset+count]
-        if len(bytes) != count:
+        if offset + count > len(self.m_data):
             raise Error('Premature end of input.')
+        bytes = self.m_data[offset:offset+count]
         if update_offset:
             self.m_offset += count
-        return bytes
+        return six.binary_type(bytes)
 
 
-class Client(object):
-    """A client for the netlogon service.
+def _address_family(address):
+    """Return the address family of the IP address `address'."""
+    if ':' in address:
+        return socket.AF_INET6
+    return socket.AF_INET
 
-    This client can make multiple simultaneous netlogon calls.
+
+class AddressCache(object):
+    """A thread-safe cache of host name resolutions.
+
+    Host names are resolved with getaddrinfo(), so that the hosts file and
+    the other sources configured in nsswitch.conf take precedence, and the
+    result is cached for `_default_ttl' seconds. Names that getaddrinfo()
+    cannot resolve are looked up in DNS, e.g. with a resolver configured
+    for the domain, and cached for the TTL of the DNS records. Both IPv4
+    and IPv6 are supported. A host that has both kinds of addresses
+    resolves to its IPv4 address, unless `prefer_ipv6' is set.
+    """
+
+    _default_ttl = 60
+    _negative_ttl = 30
+    _threads = 16
+
+    def __init__(self, resolver=None, prefer_ipv6=False):
+        """Constructor. `resolver' is the dns.resolver.Resolver to use. By
+        default the system resolver configuration is used."""
+        self.m_resolver = resolver
+        self.m_prefer_ipv6 = prefer_ipv6
+        self.m_lock = threading.Lock()
+        self.m_cache = {}
+
+    def resolve(self, hostname):
+        """Return the IP address of `hostname', or None if it cannot be
+        resolved."""
+        now = time.time()
+        with self.m_lock:
+            entry = self.m_cache.get(hostname)
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        address, ttl = self._lookup(hostname)
+        if ttl is not None:
+            with self.m_lock:
+                self.m_cache[hostname] = (now + ttl, address)
+        return address
+
+    def resolve_many(self, hostnames):
+        """Resolve all of `hostnames' in parallel. Return a dictionary
+        mapping each host name to its IP address or None."""
+        result = {}
+        uncached = []
+        now = time.time()
+        with self.m_lock:
+            for hostname in hostnames:
+                entry = self.m_cache.get(hostname)
+                if entry is not None and entry[0] > now:
+                    result[hostname] = entry[1]
+                elif hostname not in result:
+                    result[hostname] = None
+                    uncached.append(hostname)
+        addresses = misc.run_parallel(self.resolve, uncached, self._threads)
+        for hostname, address in zip(uncached, addresses):
+            if isinstance(address, Exception):
+                raise address
+            result[hostname] = address
+        return result
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.m_lock:
+            self.m_cache.clear()
+
+    def _lookup(self, hostname):
+        """Look up `hostname'. Return the tuple (address, ttl), where a ttl
+        of None means that the result must not be cached."""
+        for family in (socket.AF_INET, socket.AF_INET6):
+            try:
+                packed = socket.inet_pton(family, hostname)
+            except (socket.error, ValueError):
+                continue
+            return socket.inet_ntop(family, packed), None
+        families = [ (socket.AF_INET, 'A'), (socket.AF_INET6, 'AAAA') ]
+        if self.m_prefer_ipv6:
+            families.reverse()
+        failed = False
+        try:
+            info = self._getaddrinfo(hostname)
+        except socket.gaierror as err:
+            info = []
+            failed = err.args[0] == socket.EAI_AGAIN
+        info = [ entry for entry in info if entry[0] in dict(families) ]
+        if info:
+            info.sort(key=lambda entry: entry[0] != families[0][0])
+            return info[0][4][0], self._default_ttl
+        for family, rdtype in families:
+            try:
+                resolver = self.m_resolver or \
+                    dns.resolver.get_default_resolver()
+                answer = resolver.query(hostname, rdtype)
+            except (dns.resolver.NXDOMAIN, dns.resolver.NoAnswer):
+                continue
+            except dns.exception.DNSException:
+                failed = True
+                continue
+            packed = socket.inet_pton(family, answer[0].address)
+            return socket.inet_ntop(family, packed), answer.rrset.ttl
+        if failed:
+            return None, None
+        return None, self._negative_ttl
+
+    def _getaddrinfo(self, hostname):
+        """Resolve `hostname' through the system resolver. Return the list
+        of getaddrinfo() tuples."""
+        return socket.getaddrinfo(hostname, None, 0, socket.SOCK_DGRAM)
+
+
+address_cache = AddressCache()
+
+
+class Query(object):
+    """A pending netlogon query."""
+
+    def __init__(self, hostname, port, domain):
+        """Constructor."""
+        self.hostname = hostname
+        self.port = port
+        self.domain = domain
+        self.sent = {}  # message ID -> time the request was sent
+
+
+class Transport(object):
+    """A long-lived UDP transport for netlogon queries.
+
+    The transport owns one UDP socket per address family and keeps it open
+    between calls. Requests of any number of clients, from any number of
+    threads, are multiplexed over these sockets. A background thread reads
+    the replies and passes each one to the client that sent the request
+    with the same message ID. The thread is started when the first request
+    is sent, and again in a child process after a fork.
+
+    Datagrams that are not a reply to a pending request are dropped, and
+    counted in `m_dropped'.
     """
 
-    _timeout = 2
-    _retries = 3
     _bufsize = 8192
+    _batch = 64  # maximum number of datagrams read per wakeup
 
     def __init__(self):
         """Constructor."""
-        self.m_socket = None
-        self.m_queries = {}
+        self.m_lock = threading.Lock()
+        self.m_client = ldap.Client()
+        self.m_sockets = {}
+        self.m_pending = {}  # message ID -> (address, inbox)
         self.m_offset = None
+        self.m_thread = None
+        self.m_wakeup = None
+        self.m_pid = None
+        self.m_dropped = 0
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=functools.partial(
+                _transport_after_fork, weakref.ref(self)))
+
+    def create_message_id(self):
+        """Create a new message ID that is not in use."""
+        with self.m_lock:
+            if self.m_offset is None:
+                self.m_offset = random.randint(0, 2**31-1)
+            while True:
+                msgid = self.m_offset
+                self.m_offset += 1
+                if self.m_offset == 2**31-1:
+                    self.m_offset = 0
+                if msgid not in self.m_pending:
+                    return msgid
+
+    def send(self, packet, addr, msgid, inbox):
+        """Send the request `packet' with message ID `msgid' to `addr'. The
+        tuple (data, addr, msgid) is put in the queue `inbox' for each reply
+        from `addr' with that message ID, until cancel() is called."""
+        with self.m_lock:
+            self._start()
+            self.m_pending[msgid] = (addr, inbox)
+            try:
+                sock = self._get_socket(_address_family(addr[0]))
+            except socket.error:
+                return  # treated like a lost datagram
+        try:
+            sock.sendto(packet, 0, addr)
+        except socket.error:
+            pass
 
-    def query(self, addr, domain):
-        """Add the Netlogon query to `addr' for `domain'."""
-        hostname, port = addr
-        addr = (socket.gethostbyname(hostname), port)
-        self.m_queries[addr] = [hostname, port, domain, None]
+    def cancel(self, msgids):
+        """Stop waiting for replies to the requests `msgids'."""
+        with self.m_lock:
+            for msgid in msgids:
+                self.m_pending.pop(msgid, None)
+
+    def close(self):
+        """Stop the receiver thread and close the sockets. The transport
+        can still be used afterwards, and is reopened when needed."""
+        with self.m_lock:
+            thread, self.m_thread = self.m_thread, None
+            if thread is not None and self.m_pid == os.getpid():
+                os.write(self.m_wakeup[1], b'x')
+            else:
+                thread = None
+        if thread is not None:
+            thread.join()
+        with self.m_lock:
+            self._reset()
+
+    def _reset(self):
+        """Close the sockets and forget all pending requests. Must be called
+        with the lock held."""
+        for sock in self.m_sockets.values():
+            sock.close()
+        if self.m_wakeup is not None:
+            for fd in self.m_wakeup:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.m_sockets = {}
+        self.m_pending = {}
+        self.m_wakeup = None
+        self.m_thread = None
+
+    def _after_fork(self):
+        """Reset the transport in a child process after a fork. The lock
+        is replaced, as another thread may have held it at the time."""
+        self.m_lock = threading.Lock()
+        self._reset()
+        self.m_pid = os.getpid()
+
+    def _start(self):
+        """Start the receiver thread if it is not running. Must be called
+        with the lock held."""
+        if self.m_pid != os.getpid():
+            self._reset()  # inherited from our parent process
+            self.m_pid = os.getpid()
+        if self.m_thread is not None:
+            return
+        self.m_wakeup = os.pipe()
+        self.m_thread = threading.Thread(target=self._run)
+        self.m_thread.daemon = True
+        self.m_thread.start()
+
+    def _get_socket(self, family):
+        """Return the UDP socket for address family `family'. Must be called
+        with the lock held."""
+        sock = self.m_sockets.get(family)
+        if sock is None:
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind(('', 0))
+            self.m_sockets[family] = sock
+            os.write(self.m_wakeup[1], b'x')  # make the thread select on it
+        return sock
+
+    def _run(self):
+        """Receive replies until the transport is closed."""
+        while True:
+            with self.m_lock:
+                if self.m_thread is not threading.current_thread():
+                    return
+                sockets = list(self.m_sockets.values())
+                wakeup = self.m_wakeup[0]
+            try:
+                ready = select.select(sockets + [wakeup], [], [])[0]
+            except (select.error, ValueError) as err:
+                if not isinstance(err, ValueError) and \
+                        err.args[0] == errno.EINTR:
+                    continue  # interrupted by a signal
+                with self.m_lock:  # a socket was closed under us
+                    if self.m_thread is threading.current_thread():
+                        self._reset()
+                return
+            for sock in ready:
+                if sock == wakeup:
+                    os.read(wakeup, 4096)
+                else:
+                    self._receive(sock)
+
+    def _receive(self, sock):
+        """Read up to `_batch' available datagrams from `sock'."""
+        for i in range(self._batch):
+            try:
+                data, addr = sock.recvfrom(self._bufsize, socket.MSG_DONTWAIT)
+            except socket.error as err:
+                error = err.args[0]
+                if error == errno.EINTR:
+                    continue  # signal interrupt
+                elif error == errno.ECONNREFUSED:
+                    continue  # ICMP error for an earlier request
+                break  # no data available now
+            self._dispatch(data, addr[:2])
+
+    def _dispatch(self, data, addr):
+        """Pass the reply `data' from `addr' to the client that is waiting
+        for it."""
+        if data[:1] != b'\x30':
+            self.m_dropped += 1  # not an LDAPMessage
+            return
+        try:
+            msgid, opcode = self.m_client.parse_message_header(data)
+        except (asn1.Error, ldap.Error):
+            self.m_dropped += 1
+            return
+        with self.m_lock:
+            entry = self.m_pending.get(msgid)
+        if entry is None or entry[0] != addr:
+            self.m_dropped += 1  # late, or an erroneous datagram
+            return
+        entry[1].put((data, addr, msgid))
+
+
+def _transport_after_fork(ref):
+    """Reset the Transport referenced by the weak reference `ref' in a
+    child process."""
+    transport = ref()
+    if transport is not None:
+        transport._after_fork()
+
+
+shared_transport = Transport()
 
-    def call(self, timeout=None, retries=None):
-        """Wait for results for `timeout' seconds."""
+
+class Client(object):
+    """A client for the netlogon service.
+
+    This client can make multiple simultaneous netlogon calls. All servers
+    are queried at once, and each server is retried on its own schedule
+    with exponential backoff. This makes it possible to sweep hundreds of
+    domain controllers in about the time it takes to query one. Requests
+    are sent over a Transport, which by default is shared by all clients.
+    """
+
+    _timeout = 1  # initial retransmission timeout
+    _backoff = 2  # factor by which the timeout grows after each request
+    _retries = 4  # number of requests sent to each server
+    _deadline = 8  # maximum duration of a call
+
+    def __init__(self, cache=None, transport=None):
+        """Constructor. Host names are resolved through the AddressCache
+        `cache', which defaults to the shared `address_cache'. Requests are
+        sent over `transport', which defaults to `shared_transport'."""
+        self.m_targets = []
+        self.m_queries = {}  # (hostname, addr) -> Query
+        self.m_msgids = {}  # message ID -> (hostname, addr)
+        self.m_inbox = None
+        if cache is None:
+            cache = address_cache
+        self.m_cache = cache
+        if transport is None:
+            transport = shared_transport
+        self.m_transport = transport
+
+    def query(self, addr, domain):
+        """Add the Netlogon query to `addr' for `domain'. The host names of
+        all queries are resolved in parallel when call() is invoked."""
+        self.m_targets.append((addr, domain))
+
+    def call(self, timeout=None, retries=None, deadline=None, sufficient=None):
+        """Send all queries and wait for the replies. Return a list of
+        Reply instances.
+
+        A server that does not reply within `timeout' seconds is queried
+        again, up to `retries' requests in total. The timeout is multiplied
+        by `_backoff' after every request. The call returns when all servers
+        have either replied or run out of retries, or after `deadline'
+        seconds. If `sufficient' is given, it is called with the list of
+        replies received so far whenever new replies arrive, and the call
+        returns early as soon as it returns True.
+        """
         if timeout is None:
             timeout = self._timeout
         if retries is None:
             retries = self._retries
+        if deadline is None:
+            deadline = self._deadline
+        self._resolve_targets()
+        begin = time.time()
+        end = begin + deadline
+        schedule = [ (begin, key) for key in self.m_queries ]
+        heapq.heapify(schedule)
         result = []
-        self._create_socket()
-        for i in range(retries):
-            if not self.m_queries:
-                break
-            self._send_all_requests()
-            result += self._wait_for_replies(timeout)
-        self._close_socket()
-        self.m_queries = {}
+        msgids = []
+        self.m_inbox = queue.Queue()
+        try:
+            while self.m_queries:
+                now = time.time()
+                if now >= end:
+                    break
+                while schedule and schedule[0][0] <= now:
+                    key = heapq.heappop(schedule)[1]
+                    query = self.m_queries.get(key)
+                    if query is None:
+                        continue  # already replied
+                    if len(query.sent) >= retries:
+                        del self.m_queries[key]
+                        continue
+                    msgid = self._send_request(key[1], query)
+                    self.m_msgids[msgid] = key
+                    msgids.append(msgid)
+                    interval = timeout * self._backoff ** (len(query.sent) - 1)
+                    heapq.heappush(schedule, (now + interval, key))
+                if not schedule:
+                    break
+                wakeup = min(schedule[0][0], end)
+                replies = []
+                for data, addr, msgid in self._receive(wakeup - now):
+                    reply = self._process_reply(data, addr, msgid)
+                    if reply is not None:
+                        replies.append(reply)
+                if not replies:
+                    continue
+                result += replies
+                if sufficient is not None and sufficient(result):
+                    break
+        finally:
+            self.m_transport.cancel(msgids)
+            self.m_queries = {}
+            self.m_msgids = {}
+            self.m_inbox = None
         return result
 
-    def _create_socket(self):
-        """Create an UDP socket for `server':`port'."""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.bind(('', 0))
-        self.m_socket = sock
-
-    def _close_socket(self):
-        """Close the UDP socket."""
-        self.m_socket.close()
-        self.m_socket = None
+    def _resolve_targets(self):
+        """Resolve the host names of all targets and create the queries.
+        Targets that cannot be resolved are dropped. Queries are keyed by
+        host name and address, so that host names that resolve to the same
+        address each get their own reply."""
+        targets, self.m_targets = self.m_targets, []
+        hostnames = [ addr[0] for addr, domain in targets ]
+        addresses = self.m_cache.resolve_many(hostnames)
+        for (hostname, port), domain in targets:
+            address = addresses[hostname]
+            if address is not None:
+                self.m_queries[(hostname, (address, port))] = \
+                    Query(hostname, port, domain)
 
     def _create_message_id(self):
-        """Create a new sequence number."""
-        if self.m_offset is None:
-            self.m_offset = random.randint(0, 2**31-1)
-        msgid = self.m_offset
-        self.m_offset += 1
-        if self.m_offset == 2**31-1:
-            self.m_offset = 0
+        """Create a new message ID."""
+        return self.m_transport.create_message_id()
+
+    def _send_request(self, addr, query):
+        """Send a request for `query' to `addr'. Return its message ID."""
+        msgid = self._create_message_id()
+        packet = self._create_netlogon_query(query.domain, msgid)
+        query.sent[msgid] = time.time()
+        self.m_transport.send(packet, addr, msgid, self.m_inbox)
         return msgid
 
-    def _send_all_requests(self):
-        """Send requests to all hosts."""
-        for addr in self.m_queries:
-            domain = self.m_queries[addr][2]
-            msgid = self._create_message_id()
-            self.m_queries[addr][3] = msgid
-            packet = self._create_netlogon_query(domain, msgid)
-            self.m_socket.sendto(packet, 0, addr)
-
-    def _wait_for_replies(self, timeout):
-        """Wait one single timeout on all the sockets."""
-        begin = time.time()
-        end = begin + timeout
-        replies = []
+    def _receive(self, timeout):
+        """Wait up to `timeout' seconds for replies. Return a list of
+        (data, addr, msgid) tuples."""
+        try:
+            replies = [ self.m_inbox.get(timeout=max(timeout, 0)) ]
+        except queue.Empty:
+            return []
         while True:
-            if not self.m_queries:
-                break
-            timeleft = end - time.time()
-            if timeleft <= 0:
-                break
-            fds = [ self.m_socket.fileno() ]
             try:
-                result = select.select(fds, [], [], timeleft)
-            except select.error as err:
-                error = err.args[0]
-                if error == errno.EINTR:
-                    continue  # interrupted by signal
-                else:
-                    raise Error(str(err))  # unrecoverable
-            if not result[0]:
-                continue  # timeout
-            assert fds == result[0]
-            while True:
-                if not self.m_queries:
-                    break
-                try:
-                    data, addr = self.m_socket.recvfrom(self._bufsize,  
-                                                        socket.MSG_DONTWAIT)
-                except socket.error as err:
-                    error = err.args[0]
-                    if error == errno.EINTR:
-                        continue  # signal interrupt
-                    elif error == errno.EAGAIN:
-                        break  # no data available now
-                    else:
-                        raise Error(str(err))  # unrecoverable
-                try:
-                    hostname, port, domain, msgid = self.m_queries[addr]
-                except KeyError:
-                    continue  # someone sent us an erroneous datagram?
-                try:
-                    id, opcode = self._parse_message_header(data)
-                except (asn1.Error, ldap.Error, Error):
-                    continue
-                if id != msgid:
-                    continue
-                del self.m_queries[addr]
-                try:
-                    reply = self._parse_netlogon_reply(data)
-                except (asn1.Error, ldap.Error, Error):
-                    continue
-                if not reply:
-                    continue
-                reply.q_hostname = hostname
-                reply.q_port = port
-                reply.q_domain = domain
-                reply.q_msgid = msgid
-                reply.q_address = addr
-                timing = time.time() - begin
-                reply.q_timing = timing
-                replies.append(reply)
-        return replies
+                replies.append(self.m_inbox.get_nowait())
+            except queue.Empty:
+                return replies
+
+    def _process_reply(self, data, addr, msgid):
+        """Process the reply `data' from `addr' to request `msgid'. Return a
+        Reply, or None if it is not a valid reply to one of our queries."""
+        key = self.m_msgids.get(msgid)
+        if key is None or key[1] != addr:
+            return
+        query = self.m_queries.get(key)
+        if query is None:
+            return  # already replied, or given up
+        del self.m_queries[key]
+        return self._create_reply(data, addr, query, msgid)
+
+    def _create_reply(self, data, addr, query, msgid):
+        """Parse the reply `data' from `addr' to request `msgid' of `query'.
+        Return a Reply, or None if the reply is invalid."""
+        try:
+            reply = self._parse_netlogon_reply(data)
+        except (asn1.Error, ldap.Error, Error):
+            return
+        if not reply:
+            return
+        reply.q_hostname = query.hostname
+        reply.q_port = query.port
+        reply.q_domain = query.domain
+        reply.q_msgid = msgid
+        reply.q_address = addr
+        reply.q_timing = time.time() - query.sent[msgid]
+        return reply
 
     def _create_netlogon_query(self, domain, msgid):
         """Create a netlogon query for `domain'."""
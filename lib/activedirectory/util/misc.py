@@ -7,7 +7,13 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import os
+import time
 import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from six.moves import range, queue
 
 
 def hostname():
@@ -21,3 +27,74 @@ def hostname():
     if '.' in hostname:
         hostname = hostname.split('.')[0]
     return hostname
+
+
+_max_workers = 64  # size of the shared thread pool
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """Return the shared thread pool, creating it when needed."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(_max_workers)
+        return _executor
+
+
+def _reset_executor():
+    """Forget the shared thread pool in a child process after a fork. Its
+    threads do not exist in the child."""
+    global _executor, _executor_lock
+    _executor = None
+    _executor_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_executor)
+
+
+def run_parallel(function, items, threads=16, timeout=None):
+    """Call `function' on each of `items', using up to `threads' threads of
+    a shared thread pool. Return the list of results in the order of
+    `items'. A call that raised an exception has the exception instance as
+    its result, so that callers can tell errors from regular results.
+
+    If `timeout' is given, wait at most `timeout' seconds. Calls that have
+    not finished by then have a result of None. They run to completion in
+    the background, and their results are discarded.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    work = queue.Queue()
+    for index, item in enumerate(items):
+        work.put((index, item))
+    if timeout is not None:
+        end = time.time() + timeout
+    def worker():
+        while timeout is None or time.time() < end:
+            try:
+                index, item = work.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(item)
+            except Exception as err:
+                results[index] = err
+    nworkers = min(threads, len(items))
+    if nworkers <= 1 and timeout is None:
+        worker()
+        return results
+    if timeout is None:
+        # The calling thread works as well, so that progress is made even
+        # if all threads of the pool are busy.
+        nworkers -= 1
+    executor = _get_executor()
+    futures = [ executor.submit(worker) for i in range(nworkers) ]
+    if timeout is None:
+        worker()
+        wait(futures)
+    else:
+        wait(futures, max(end - time.time(), 0))
+    return list(results)
@@ -41,11 +41,16 @@ setup(
         'activedirectory.util'
     ],
     tests_require=['nose', 'pexpect'],
-    install_requires=['python-ldap>=3.0', 'dnspython', 'ply==3.8', 'six'],
+    install_requires=['python-ldap>=3.0', 'dnspython', 'six',
+                      'futures; python_version < "3"'],
     ext_modules=[Extension(
         'activedirectory.protocol.krb5',
         ['lib/activedirectory/protocol/krb5.c'],
         libraries=['krb5']
+    ), Extension(
+        'activedirectory.protocol._asn1',
+        ['lib/activedirectory/protocol/_asn1.c'],
+        optional=True
     )],
     zip_safe=False,  # eggs are the devil.
     test_suite='nose.collector'
@@ -1,7 +1,15 @@
+import sys
 import pytest
 from .base import Conf
 
 
+# The asyncio modules use syntax that is not available on Python 2.
+collect_ignore = []
+if sys.version_info < (3, 5):
+    collect_ignore.append('protocol/test_asyncldap.py')
+    collect_ignore.append('protocol/test_asyncnetlogon.py')
+
+
 @pytest.fixture
 def conf():
     return Conf()
@@ -0,0 +1,211 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import os
+import time
+import threading
+
+from activedirectory.core.cache import FileCache
+from activedirectory.core.locate import Locator
+from activedirectory.protocol import netlogon
+
+
+def create_reply(hostname):
+    return netlogon.Reply(type=23, flags=netlogon.SERVER_LDAP,
+                          domain_guid=b'\x00' * 16, domain=b'example.com',
+                          hostname=hostname.encode('ascii'),
+                          server_site=b'Site', q_hostname=hostname,
+                          q_port=389, q_address=('10.0.0.1', 389),
+                          q_timing=0.01, checked=True)
+
+
+class CountingLocator(Locator):
+    """Locator that counts network lookups, which return `servers'."""
+
+    def __init__(self, *args, **kwargs):
+        super(CountingLocator, self).__init__(*args, **kwargs)
+        self.calls = 0
+        self.servers = [ create_reply('dc2.example.com') ]
+
+    def _discover(self, domain, role, maxservers):
+        self.calls += 1
+        return self.servers
+
+
+def wait_for_refresh(loc):
+    end = time.time() + 5
+    while loc.m_refreshing and time.time() < end:
+        time.sleep(0.01)
+    assert not loc.m_refreshing
+
+
+class TestFileCache(object):
+    """Test suite for FileCache."""
+
+    def test_servers(self, tmpdir):
+        cache = FileCache(str(tmpdir.join('cache.db')))
+        assert cache.get('EXAMPLE.COM', 'dc', 'Site') is None
+        servers = [ create_reply('dc1.example.com'),
+                    create_reply('dc2.example.com') ]
+        cache.put('EXAMPLE.COM', 'dc', 'Site', 1000.0, 3, servers)
+        stamp, nrequested, result = cache.get('EXAMPLE.COM', 'dc', 'Site')
+        assert (stamp, nrequested) == (1000.0, 3)
+        assert [ reply.__dict__ for reply in result ] == \
+            [ reply.__dict__ for reply in servers ]
+        assert cache.get('EXAMPLE.COM', 'gc', 'Site') is None
+        assert cache.get('EXAMPLE.COM', 'dc', 'Other') is None
+        cache.put('EXAMPLE.COM', 'dc', 'Site', 2000.0, 1, servers[:1])
+        stamp, nrequested, result = cache.get('EXAMPLE.COM', 'dc', 'Site')
+        assert (stamp, nrequested, len(result)) == (2000.0, 1, 1)
+
+    def test_no_site(self, tmpdir):
+        cache = FileCache(str(tmpdir.join('cache.db')))
+        cache.put('EXAMPLE.COM', 'dc', None, 1000.0, 3, [])
+        assert cache.get('EXAMPLE.COM', 'dc', None) == (1000.0, 3, [])
+
+    def test_sites(self, tmpdir):
+        cache = FileCache(str(tmpdir.join('cache.db')))
+        assert cache.get_site('EXAMPLE.COM') is None
+        cache.put_site('EXAMPLE.COM', 1000.0, u'Site')
+        assert cache.get_site('EXAMPLE.COM') == (1000.0, u'Site')
+        cache.clear()
+        assert cache.get_site('EXAMPLE.COM') is None
+
+    def test_shared(self, tmpdir):
+        fname = str(tmpdir.join('cache.db'))
+        pid = os.fork()
+        if pid == 0:
+            try:
+                FileCache(fname).put_site('EXAMPLE.COM', 1000.0, u'Site')
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        assert FileCache(fname).get_site('EXAMPLE.COM') == (1000.0, u'Site')
+
+    def test_corrupt_file(self, tmpdir):
+        fname = tmpdir.join('cache.db')
+        fname.write(b'garbage' * 1000, mode='wb')
+        cache = FileCache(str(fname))
+        assert cache.get('EXAMPLE.COM', 'dc', 'Site') is None
+        cache.put_site('EXAMPLE.COM', 1000.0, u'Site')
+        assert cache.get_site('EXAMPLE.COM') is None
+
+
+class TestLocatorCache(object):
+    """Test suite for the Locator cache file."""
+
+    def test_locate_from_file(self, tmpdir):
+        fname = str(tmpdir.join('cache.db'))
+        cache = FileCache(fname)
+        cache.put_site('EXAMPLE.COM', time.time(), u'Site')
+        cache.put('EXAMPLE.COM', 'dc', u'Site', time.time(), 3,
+                  [ create_reply('dc1.example.com') ])
+        loc = Locator(cache_file=fname)
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        assert loc.m_site == u'Site'
+        assert ('EXAMPLE.COM', 'dc') in loc.m_cache
+
+    def test_expired(self, tmpdir):
+        fname = str(tmpdir.join('cache.db'))
+        cache = FileCache(fname)
+        cache.put('EXAMPLE.COM', 'dc', u'Site', time.time() - 1000, 3,
+                  [ create_reply('dc1.example.com') ])
+        loc = Locator(site=u'Site', cache_file=fname)
+        entry = cache.get('EXAMPLE.COM', 'dc', u'Site')
+        assert not loc._cache_usable(entry, 3)
+        cache.put('EXAMPLE.COM', 'dc', u'Site', time.time(), 1,
+                  [ create_reply('dc1.example.com') ])
+        entry = cache.get('EXAMPLE.COM', 'dc', u'Site')
+        assert loc._cache_usable(entry, 1)
+        assert not loc._cache_usable(entry, 3)
+
+    def test_refresh_ahead(self):
+        loc = CountingLocator(site=u'Site')
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = \
+            (time.time() - 0.8 * loc.m_timeout, 3,
+             [ create_reply('dc1.example.com') ])
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        wait_for_refresh(loc)
+        assert loc.calls == 1
+        assert loc.locate_many('example.com') == ['dc2.example.com']
+        wait_for_refresh(loc)
+        assert loc.calls == 1
+
+    def test_refresh_failure(self):
+        loc = CountingLocator(site=u'Site')
+        loc.servers = []
+        entry = (time.time() - 0.8 * loc.m_timeout, 3,
+                 [ create_reply('dc1.example.com') ])
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = entry
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        wait_for_refresh(loc)
+        assert loc.calls == 1
+        assert loc.m_cache[('EXAMPLE.COM', 'dc')] is entry
+
+    def test_serve_stale(self):
+        loc = CountingLocator(site=u'Site')
+        loc.servers = []
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = \
+            (time.time() - loc.m_timeout - 10, 3,
+             [ create_reply('dc1.example.com') ])
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        assert loc.calls == 1
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = \
+            (time.time() - loc.m_timeout - loc._max_stale - 10, 3,
+             [ create_reply('dc1.example.com') ])
+        assert loc.locate_many('example.com') == []
+        assert loc.calls == 2
+
+    def test_serve_stale_retry(self):
+        loc = CountingLocator(site=u'Site')
+        loc.servers = []
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = \
+            (time.time() - loc.m_timeout - 10, 3,
+             [ create_reply('dc1.example.com') ])
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        assert loc.calls == 1
+        threads = []
+        def discover(domain, role, maxservers):
+            threads.append(threading.current_thread())
+            return []
+        loc._discover = discover
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        wait_for_refresh(loc)
+        assert len(threads) == 1
+        assert threads[0] is not threading.current_thread()
+        del loc._discover
+        loc.servers = [ create_reply('dc2.example.com') ]
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        wait_for_refresh(loc)
+        assert loc.calls == 2
+        assert loc.locate_many('example.com') == ['dc2.example.com']
+        assert loc.m_failed == {}
+
+    def test_serve_stale_retry_expired(self):
+        loc = CountingLocator(site=u'Site')
+        loc.servers = []
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = \
+            (time.time() - loc.m_timeout - 10, 3,
+             [ create_reply('dc1.example.com') ])
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        loc.m_failed[('EXAMPLE.COM', 'dc')] = time.time() - 1
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        assert loc.calls == 2
+        assert not loc.m_refreshing
+
+    def test_stale_from_file(self, tmpdir):
+        fname = str(tmpdir.join('cache.db'))
+        cache = FileCache(fname)
+        cache.put('EXAMPLE.COM', 'dc', u'Site', time.time() - 1000, 3,
+                  [ create_reply('dc1.example.com') ])
+        loc = CountingLocator(site=u'Site', cache_file=fname)
+        loc.servers = []
+        assert loc.locate_many('example.com') == ['dc1.example.com']
+        assert loc.calls == 1
+
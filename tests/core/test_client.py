@@ -7,10 +7,15 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import time
 import pytest
+import ldap
 
 from activedirectory.core.object import activate
 from activedirectory.core.client import Client
+from activedirectory.core.health import HealthRegistry
+from activedirectory.core.pool import ConnectionPool
+from activedirectory.util import compat
 from activedirectory.core.locate import Locator
 from activedirectory.core.constant import AD_USERCTRL_NORMAL_ACCOUNT
 from activedirectory.core.creds import Creds
@@ -21,6 +26,316 @@ from ..base import assert_raises
 from . import utils
 
 
+class Connection(object):
+    """Fake LDAP connection for health testing."""
+
+    def __init__(self, uri, bind=True):
+        self.uri = uri
+        self.bound = bind
+        self.searches = []
+
+    def search_s(self, base, scope, filterstr='(objectClass=*)',
+                 attrlist=None):
+        self.searches.append((base, scope, attrlist))
+        return [('', {})]
+
+
+class HealthClient(Client):
+    """Client that connects to fake servers. Servers in `down' fail."""
+
+    def __init__(self, domain):
+        super(HealthClient, self).__init__(domain)
+        self.m_locator = Locator(health=HealthRegistry())
+        self.down = set()
+        self.uris = []
+
+    def _create_ldap_connection(self, uri, bind=True):
+        self.uris.append(uri)
+        if uri in self.down:
+            raise ldap.SERVER_DOWN()
+        return Connection(uri, bind)
+
+
+class PagedControl(object):
+    """Paged results response control."""
+
+    controlType = compat.LDAP_CONTROL_PAGED_RESULTS
+
+    def __init__(self, cookie):
+        self.cookie = cookie
+
+
+class FakeServer(object):
+    """Fake LDAP connection that serves `pages' of search results with the
+    paged results control, and the values of multi-valued attributes in
+    `values' in ranges of `rangesize'."""
+
+    def __init__(self, pages=None, values=None, rangesize=2):
+        self.pages = pages or []
+        self.values = values or {}
+        self.rangesize = rangesize
+        self.requests = {}
+        self.abandoned = []
+        self.fetched = []  # pages requested
+        self.msgid = 0
+
+    def search_ext(self, base, scope, filter, attrs, serverctrls=None):
+        self.msgid += 1
+        if serverctrls:
+            cookie = serverctrls[0].cookie
+            self.requests[self.msgid] = ('page', int(cookie or 0))
+            self.fetched.append(int(cookie or 0))
+        else:
+            self.requests[self.msgid] = ('range', base, attrs[0])
+        return self.msgid
+
+    def result3(self, msgid):
+        request = self.requests.pop(msgid)
+        if request[0] == 'page':
+            page = request[1]
+            cookie = str(page + 1) if page + 1 < len(self.pages) else ''
+            return (ldap.RES_SEARCH_RESULT, self.pages[page], msgid,
+                    [PagedControl(cookie)])
+        dn, attr = request[1:]
+        type, lo = attr.split(';range=')
+        lo = int(lo.rstrip('-*'))
+        values = self.values[(dn, type)]
+        hi = lo + self.rangesize - 1
+        if hi >= len(values) - 1:
+            key = '%s;range=%d-*' % (type, lo)
+        else:
+            key = '%s;range=%d-%d' % (type, lo, hi)
+        return (ldap.RES_SEARCH_RESULT, [(dn, {key: values[lo:hi+1]})],
+                msgid, [])
+
+    def abandon(self, msgid):
+        self.abandoned.append(msgid)
+        del self.requests[msgid]
+
+
+class RangeClient(Client):
+    """Client that sends all requests to a FakeServer."""
+
+    def __init__(self, server):
+        super(RangeClient, self).__init__('example.com')
+        self.pool = ConnectionPool(lambda: server)
+
+    def _connection_pool(self, base, server=None, scheme=None):
+        return self.pool
+
+
+class TestPagedResults(object):
+    """Test suite for paged results with prefetching."""
+
+    pages = [ [('cn=%d' % i, {})] for i in range(4) ]
+
+    def test_pages(self):
+        for prefetch in (True, False):
+            server = FakeServer(self.pages)
+            client = Client('example.com')
+            client._prefetch = prefetch
+            result = list(client._iter_paged_results(server, '', '', 0, None))
+            assert result == self.pages
+            assert server.requests == {}
+            assert server.abandoned == []
+
+    def test_close(self):
+        server = FakeServer(self.pages)
+        client = Client('example.com')
+        pages = client._iter_paged_results(server, '', '', 0, None)
+        assert next(pages) == self.pages[0]
+        assert list(server.requests) == [2]  # page 2 was prefetched
+        pages.close()
+        assert server.abandoned == [2]
+        assert server.requests == {}
+
+    def test_close_without_prefetch(self):
+        server = FakeServer(self.pages)
+        client = Client('example.com')
+        client._prefetch = False
+        pages = client._iter_paged_results(server, '', '', 0, None)
+        assert next(pages) == self.pages[0]
+        pages.close()
+        assert server.abandoned == []
+        assert server.requests == {}
+
+    def test_single_page(self):
+        server = FakeServer(self.pages[:1])
+        client = Client('example.com')
+        result = list(client._iter_paged_results(server, '', '', 0, None))
+        assert result == self.pages[:1]
+        assert server.requests == {}
+
+
+class TestRangeRetrieval(object):
+    """Test suite for incremental retrieval of multi-valued attributes."""
+
+    def create_result(self, server):
+        result = []
+        for dn in ('cn=a', 'cn=b'):
+            attrs = {}
+            for type in ('member', 'memberOf'):
+                values = [ ('%s-%s-%d' % (dn, type, i)).encode('ascii')
+                           for i in range(7) ]
+                server.values[(dn, type)] = values
+                attrs['%s;range=0-1' % type] = values[:2]
+            attrs['cn'] = [dn.encode('ascii')]
+            result.append((dn, attrs))
+        return result
+
+    def test_ranges(self):
+        server = FakeServer()
+        client = RangeClient(server)
+        result = client._process_range_subtypes(self.create_result(server))
+        for dn, attrs in result:
+            assert sorted(attrs) == ['cn', 'member', 'memberOf']
+            for type in ('member', 'memberOf'):
+                assert attrs[type] == server.values[(dn, type)]
+        assert server.requests == {}
+        assert server.abandoned == []
+        assert client.pool.m_owned == {}
+
+    def test_limited_requests(self):
+        server = FakeServer(rangesize=1)
+        client = RangeClient(server)
+        client._range_requests = 3
+        outstanding = []
+        result3 = server.result3
+
+        def counting_result3(msgid):
+            outstanding.append(len(server.requests))
+            return result3(msgid)
+
+        server.result3 = counting_result3
+        result = client._process_range_subtypes(self.create_result(server))
+        assert max(outstanding) == 3
+        assert result[1][1]['memberOf'] == server.values[('cn=b', 'memberOf')]
+
+    def test_error(self):
+        server = FakeServer()
+        client = RangeClient(server)
+        result = self.create_result(server)
+        server.values[('cn=b', 'member')] = None  # makes the reply fail
+        assert_raises(TypeError, client._process_range_subtypes, result)
+        assert server.requests == {}
+        assert len(server.abandoned) == 3
+        assert client.pool.m_owned == {}
+
+
+class TestIterSearch(object):
+    """Test suite for streaming search results."""
+
+    def create_pages(self, server):
+        pages = []
+        for i in range(3):
+            dn = 'cn=%d' % i
+            values = [ ('%s-%d' % (dn, j)).encode('ascii') for j in range(5) ]
+            server.values[(dn, 'member')] = values
+            pages.append([ (dn, {'member;range=0-1': values[:2]}),
+                           (None, ['ldap://other.example.com/']) ])
+        server.pages = pages
+
+    def test_pages(self):
+        server = FakeServer()
+        self.create_pages(server)
+        client = RangeClient(server)
+        entries = client.search(base='dc=example,dc=com', stream=True)
+        dn, attrs = next(entries)
+        assert dn == 'cn=0'
+        assert attrs == {'member': server.values[('cn=0', 'member')]}
+        assert server.fetched == [0, 1]  # the next page is prefetched
+        result = [ (dn, attrs) ] + list(entries)
+        assert server.fetched == [0, 1, 2]
+        assert [ dn for dn, attrs in result ] == ['cn=0', 'cn=1', 'cn=2']
+        for dn, attrs in result:
+            assert attrs == {'member': server.values[(dn, 'member')]}
+        assert server.requests == {}
+        assert client.pool.m_owned == {}
+
+    def test_close(self):
+        server = FakeServer()
+        self.create_pages(server)
+        client = RangeClient(server)
+        entries = client.iter_search(base='dc=example,dc=com')
+        assert next(entries)[0] == 'cn=0'
+        entries.close()
+        assert server.fetched == [0, 1]
+        assert server.abandoned == [2]
+        assert server.requests == {}
+        assert client.pool.m_owned == {}
+
+
+class TestClientHealth(object):
+    """Test suite for routing Client connections by health."""
+
+    def test_connect(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        conn = client._connect(['dc1', 'dc2'])
+        assert conn.uri == 'ldap://dc1:389/'
+        assert health.get('dc1').ldap_latency is not None
+        health.record_ldap('dc2', 0.0)
+        health.record_ldap('dc1', 10.0)
+        conn = client._connect(['dc1', 'dc2'], scheme='gc')
+        assert conn.uri == 'ldap://dc2:3268/'
+
+    def test_connect_without_bind(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        conn = client._connect(['dc1'], bind=False)
+        assert conn.searches == [('', ldap.SCOPE_BASE, ['1.1'])]
+        assert health.get('dc1').ldap_latency is not None
+        conn = client._connect(['dc1'])
+        assert conn.searches == []
+
+    def test_connect_probe(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        health.record_ldap('dc1', 10.0)
+        health.record_ldap('dc2', 0.1)
+        assert client._connect(['dc1', 'dc2']).uri == 'ldap://dc2:389/'
+        health.get('dc1').probed -= health._probe_interval
+        assert client._connect(['dc1', 'dc2']).uri == 'ldap://dc1:389/'
+        assert client._connect(['dc1', 'dc2']).uri == 'ldap://dc2:389/'
+
+    def test_failover(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        client.down.add('ldap://dc1:389/')
+        conn = client._connect(['dc1', 'dc2'])
+        assert conn.uri == 'ldap://dc2:389/'
+        assert health.get('dc1').failures == 1
+        client.down.add('ldap://dc2:389/')
+        assert_raises(ldap.SERVER_DOWN, client._connect, ['dc1', 'dc2'])
+
+    def test_acceptable_connection(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        conn = client._connect(['dc1', 'dc2'])
+        assert client._acceptable_connection(conn)
+        health.record_ldap('dc2', 0.0)
+        for i in range(health._failures):
+            health.record_failure('dc1')
+        assert not client._acceptable_connection(conn)
+
+    def test_track(self):
+        client = HealthClient('example.com')
+        health = client.m_locator.m_health
+        conn = client._connect(['dc1'])
+
+        def fail():
+            with client._track(conn):
+                raise ldap.SERVER_DOWN()
+
+        assert_raises(ldap.SERVER_DOWN, fail)
+        assert health.get('dc1').failures == 1
+        latency = health.get('dc1').ldap_latency
+        with client._track(conn):
+            time.sleep(0.01)
+        assert health.get('dc1').failures == 0
+        assert health.get('dc1').ldap_latency == latency
+
+
 class TestADClient(object):
     """Test suite for ADClient"""
 
@@ -35,6 +350,36 @@ class TestADClient(object):
         result = client.search('(objectClass=user)')
         assert len(result) > 1
 
+    def test_iter_search(self, conf):
+        conf.require(ad_user=True)
+        domain = conf.domain()
+        creds = Creds(domain)
+        creds.acquire(conf.ad_user_account(), conf.ad_user_password())
+        activate(creds)
+        client = Client(domain)
+        result = client.search('(objectClass=user)', stream=True)
+        assert not isinstance(result, list)
+        count = 0
+        for dn, attrs in result:
+            assert dn is not None
+            count += 1
+        assert count == len(client.search('(objectClass=user)'))
+
+    def test_search_compact(self, conf):
+        conf.require(ad_user=True)
+        domain = conf.domain()
+        creds = Creds(domain)
+        creds.acquire(conf.ad_user_account(), conf.ad_user_password())
+        activate(creds)
+        client = Client(domain)
+        result = client.search('(objectClass=user)', compact=True)
+        expected = client.search('(objectClass=user)')
+        assert len(result) == len(expected)
+        for (dn, attrs), (dn2, attrs2) in zip(result, expected):
+            assert dn == dn2
+            assert attrs == attrs2
+        assert_raises(ValueError, client.search, stream=True, compact=True)
+
     def test_add(self, conf):
         conf.require(ad_admin=True)
         domain = conf.domain()
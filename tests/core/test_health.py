@@ -0,0 +1,128 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import time
+import itertools
+
+from activedirectory.core.health import HealthRegistry
+
+
+class TestHealthRegistry(object):
+    """Test suite for HealthRegistry."""
+
+    def test_average(self):
+        health = HealthRegistry()
+        assert health.get('dc1') is None
+        health.record_ldap('dc1', 1.0)
+        assert health.get('dc1').ldap_latency == 1.0
+        health.record_ldap('dc1', 2.0)
+        assert abs(health.get('dc1').ldap_latency - 1.3) < 1e-9
+        health.record_ldap('dc1')
+        assert abs(health.get('dc1').ldap_latency - 1.3) < 1e-9
+        health.record_netlogon('DC1.', 0.1)
+        assert health.get('dc1').netlogon_latency == 0.1
+        assert health.get(b'Dc1') is health.get('dc1')
+
+    def test_error_rate(self):
+        health = HealthRegistry()
+        health.record_failure('dc1')
+        assert abs(health.get('dc1').error_rate - 0.1) < 1e-9
+        health.record_ldap('dc1', 1.0)
+        assert abs(health.get('dc1').error_rate - 0.09) < 1e-9
+        assert health.get('dc1').failures == 0
+
+    def test_circuit_breaker(self):
+        health = HealthRegistry()
+        for i in range(health._failures - 1):
+            health.record_failure('dc1')
+        assert health.available('dc1')
+        health.record_failure('dc1')
+        assert not health.available('dc1')
+        health.get('dc1').opened -= health._reset_timeout
+        assert health.available('dc1')  # half open: try again
+        health.record_failure('dc1')
+        assert not health.available('dc1')
+        health.get('dc1').opened -= health._reset_timeout
+        health.record_ldap('dc1', 1.0)
+        assert health.available('dc1')
+        health.record_failure('dc1')
+        assert health.available('dc1')
+
+    def test_order(self):
+        health = HealthRegistry()
+        servers = ['dc1', 'dc2', 'dc3', 'dc4', 'dc5']
+        assert health.order(servers) == servers
+        health.record_netlogon('dc4', 0.2)
+        health.record_netlogon('dc3', 0.1)
+        assert health.order(servers) == ['dc3', 'dc4', 'dc1', 'dc2', 'dc5']
+        health.record_ldap('dc4', 0.5)
+        health.record_ldap('dc3', 1.0)
+        assert health.order(servers) == ['dc4', 'dc3', 'dc1', 'dc2', 'dc5']
+        for i in range(health._failures):
+            health.record_failure('dc4')
+        assert health.order(servers) == ['dc3', 'dc1', 'dc2', 'dc5', 'dc4']
+
+    def test_order_consistent(self):
+        health = HealthRegistry()
+        health.record_netlogon('dc1', 0.1)
+        health.record_ldap('dc1', 1.0)
+        health.record_netlogon('dc2', 0.2)
+        health.record_netlogon('dc3', 0.3)
+        health.record_ldap('dc3', 0.5)
+        for servers in itertools.permutations(['dc1', 'dc2', 'dc3']):
+            assert health.order(list(servers)) == ['dc2', 'dc3', 'dc1']
+
+    def test_order_probe(self):
+        health = HealthRegistry()
+        health.record_ldap('dc1', 0.1)
+        health.record_ldap('dc2', 1.0)
+        health.record_ldap('dc3', 2.0)
+        servers = ['dc1', 'dc2', 'dc3']
+        assert health.order(servers, probe=True) == servers
+        health.get('dc3').probed -= health._probe_interval
+        assert health.order(servers) == servers
+        assert health.order(servers, probe=True) == ['dc3', 'dc1', 'dc2']
+        assert health.order(servers, probe=True) == servers
+        health.get('dc2').probed -= health._probe_interval
+        for i in range(health._failures):
+            health.record_failure('dc2')
+        assert health.order(servers, probe=True) == ['dc1', 'dc3', 'dc2']
+
+    def test_order_key(self):
+        health = HealthRegistry()
+        health.record_netlogon('dc2', 0.1)
+        servers = [(1, 'dc1'), (2, 'dc2')]
+        assert health.order(servers, key=lambda srv: srv[1]) == \
+            [(2, 'dc2'), (1, 'dc1')]
+
+    def test_error_rate_order(self):
+        health = HealthRegistry()
+        health.record_ldap('dc1', 0.1)
+        health.record_ldap('dc2', 0.12)
+        assert health.order(['dc1', 'dc2']) == ['dc1', 'dc2']
+        for i in range(5):
+            health.record_failure('dc1')
+            health.record_ldap('dc1', 0.1)
+        assert health.order(['dc1', 'dc2']) == ['dc2', 'dc1']
+
+    def test_acceptable(self):
+        health = HealthRegistry()
+        servers = ['dc1', 'dc2']
+        assert health.acceptable('dc1', servers)
+        health.record_ldap('dc1', 0.1)
+        assert health.acceptable('dc1', servers)
+        health.record_ldap('dc2', 0.1)
+        for i in range(5):
+            health.record_ldap('dc1', 1.0)
+        assert not health.acceptable('dc1', servers)
+        assert health.acceptable('dc2', servers)
+        for i in range(health._failures):
+            health.record_failure('dc2')
+        assert health.acceptable('dc1', servers)
+        assert not health.acceptable('dc2', servers)
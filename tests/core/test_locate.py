@@ -9,9 +9,16 @@
 from __future__ import absolute_import
 from __future__ import print_function
 import math
+import time
+import random
 import signal
+import logging
 
+import dns.resolver
+
+from activedirectory.core.health import HealthRegistry
 from activedirectory.core.locate import Locator
+from activedirectory.protocol import netlogon
 from threading import Timer
 from six.moves import range
 
@@ -26,6 +33,48 @@ class SRV(object):
         self.port = port
 
 
+class Record(object):
+    """DNS A or PTR record for Locator testing."""
+
+    def __init__(self, address=None, target=None):
+        self.address = address
+        self.target = target
+
+    def to_text(self):
+        return self.target
+
+
+class SlowResolver(object):
+    """DNS resolver for Locator testing. Every query takes `delay' seconds.
+    Host dcN resolves to 10.0.0.N, and back."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def query(self, query, type):
+        time.sleep(self.delay)
+        query = str(query)
+        if type == 'SRV':
+            return [ query ]
+        elif type == 'A':
+            return [ Record(address='10.0.0.%s' % query.strip('dc.')) ]
+        elif type == 'PTR':
+            number = query.split('.')[0]
+            return [ Record(target=Record(target='dc%s.' % number)) ]
+
+
+class FailingResolver(SlowResolver):
+    """DNS resolver for Locator testing. Queries for "missing" do not
+    exist, and queries for "crash" raise an unexpected exception."""
+
+    def query(self, query, type):
+        if query == 'missing':
+            raise dns.resolver.NXDOMAIN()
+        elif query == 'crash':
+            raise RuntimeError('crash')
+        return SlowResolver.query(self, query, type)
+
+
 class TestLocator(object):
     """Test suite for Locator."""
 
@@ -87,9 +136,111 @@ class TestLocator(object):
             # asserting an error here.
             assert abs(count[x] - n*p) < 6 * stddev(n, p)
 
+    def test_order_dns_srv_single_groups(self):
+        srv = [ SRV(10, 0), SRV(0, 10), SRV(10, 5), SRV(20, 0) ]
+        loc = Locator()
+        result = loc._order_dns_srv(srv)
+        assert sorted(result, key=id) == sorted(srv, key=id)
+        assert [ res.priority for res in result ] == [0, 10, 10, 20]
+        assert [ res.priority for res in loc._order_dns_srv(srv[3:]) ] == [20]
+        assert loc._order_dns_srv([]) == []
+
+    def test_order_dns_srv_zero_weight(self):
+        loc = Locator()
+        srv = [ SRV(0, 0) for i in range(5) ]
+        result = loc._order_dns_srv(srv)
+        assert sorted(result, key=id) == sorted(srv, key=id)
+        srv.append(SRV(0, 1))
+        for i in range(100):
+            assert loc._order_dns_srv(srv)[0] is srv[-1]
+
+    def test_order_dns_srv_seed(self):
+        srv = [ SRV(i % 3, i) for i in range(100) ]
+        result1 = Locator(rng=random.Random(1))._order_dns_srv(srv)
+        result2 = Locator(rng=random.Random(1))._order_dns_srv(srv)
+        assert result1 == result2
+
     def test_detect_site(self, conf):
         conf.require(ad_user=True)
         loc = Locator()
         domain = conf.domain()
         site = loc._detect_site(domain)
         assert site is not None
+
+    def test_dns_query_many(self):
+        loc = Locator(resolver=SlowResolver(0.2))
+        queries = [ ('query%d' % i, 'SRV') for i in range(10) ]
+        begin = time.time()
+        answers = loc._dns_query_many(queries)
+        assert time.time() - begin < 0.6
+        assert answers == [ [query] for query, type in queries ]
+
+    def test_dns_query_many_deadline(self):
+        loc = Locator(resolver=SlowResolver(1))
+        begin = time.time()
+        answers = loc._dns_query_many([('query', 'SRV')], time.time() + 0.1)
+        assert time.time() - begin < 0.5
+        assert answers == [[]]
+
+    def test_dns_query_many_errors(self, caplog):
+        loc = Locator(resolver=FailingResolver(0))
+        queries = [ ('missing', 'SRV'), ('crash', 'SRV'), ('query', 'SRV') ]
+        with caplog.at_level(logging.DEBUG):
+            answers = loc._dns_query_many(queries)
+        assert answers == [ [], [], ['query'] ]
+        errors = [ record.getMessage() for record in caplog.records
+                   if record.levelno >= logging.ERROR ]
+        assert len(errors) == 1
+        assert 'crash' in errors[0]
+
+    def test_check_replies(self):
+        loc = Locator(site='Default-First-Site', resolver=SlowResolver(0.1))
+        replies = [ netlogon.Reply(flags=netlogon.SERVER_LDAP,
+                                   domain=b'example.com',
+                                   q_hostname='dc%d' % i,
+                                   q_domain='EXAMPLE.COM') for i in range(10) ]
+        replies[0].domain = b'other.com'
+        begin = time.time()
+        assert loc._sufficient_domain_controllers(replies, 'dc', 9)
+        assert time.time() - begin < 0.9
+        assert [ reply.checked for reply in replies ] == [False] + [True] * 9
+
+    def test_check_replies_deadline(self):
+        loc = Locator(site='Default-First-Site', resolver=SlowResolver(1))
+        reply = netlogon.Reply(flags=netlogon.SERVER_LDAP,
+                               domain=b'example.com', q_hostname='dc1',
+                               q_domain='EXAMPLE.COM')
+        begin = time.time()
+        loc._check_replies([reply], 'dc', time.time() + 0.1)
+        assert time.time() - begin < 0.5
+        assert reply.checked is False
+
+    def test_select_by_health(self):
+        health = HealthRegistry()
+        loc = Locator(site='Site', health=health)
+        replies = [ netlogon.Reply(hostname=b'dc%d' % i, q_hostname='dc%d' % i,
+                                   q_port=389, q_timing=0.1 * (4 - i),
+                                   server_site=b'Site' if i < 2 else b'Other',
+                                   checked=True) for i in range(4) ]
+        addresses = [ ('dc%d' % i, 389) for i in range(4) ]
+        result = loc._select_domain_controllers(replies, 'dc', 4, addresses)
+        assert [ reply.hostname for reply in result ] == \
+            [b'dc1', b'dc0', b'dc3', b'dc2']
+        assert health.get('dc0').netlogon_latency == 0.4
+        for i in range(health._failures):
+            health.record_failure('dc1')
+        result = loc._select_domain_controllers(replies, 'dc', 3, addresses)
+        assert [ reply.hostname for reply in result ] == \
+            [b'dc0', b'dc3', b'dc2']
+
+    def test_cache_order_by_health(self):
+        health = HealthRegistry()
+        loc = Locator(site='Site', health=health)
+        replies = [ netlogon.Reply(hostname=b'dc%d' % i, server_site=b'Site')
+                    for i in range(3) ]
+        loc.m_cache[('EXAMPLE.COM', 'dc')] = (time.time(), 3, replies)
+        assert loc.locate_many('example.com') == ['dc0', 'dc1', 'dc2']
+        health.record_ldap('dc2', 0.1)
+        health.record_ldap('dc0', 0.2)
+        assert loc.locate_many('example.com') == ['dc2', 'dc0', 'dc1']
+        assert loc.locate('example.com') == 'dc2'
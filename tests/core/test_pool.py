@@ -0,0 +1,201 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import threading
+
+import ldap
+
+from activedirectory.core.pool import ConnectionPool
+from activedirectory.core.exception import Error as ADError
+
+from ..base import assert_raises
+
+
+class Connection(object):
+    """Fake LDAP connection for pool testing."""
+
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+
+    def whoami_s(self):
+        if not self.healthy:
+            raise ldap.SERVER_DOWN()
+        return ''
+
+    def unbind_s(self):
+        self.closed = True
+
+
+class Factory(object):
+    """Connection factory for pool testing."""
+
+    def __init__(self):
+        self.created = []
+
+    def __call__(self):
+        conn = Connection()
+        self.created.append(conn)
+        return conn
+
+
+class TestConnectionPool(object):
+    """Test suite for ConnectionPool."""
+
+    def test_reuse(self):
+        factory = Factory()
+        pool = ConnectionPool(factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is conn
+        assert len(factory.created) == 1
+
+    def test_nested_checkout(self):
+        pool = ConnectionPool(Factory(), maxsize=1)
+        conn = pool.checkout()
+        assert pool.checkout(timeout=0) is conn
+        pool.checkin(conn)
+        pool.checkin(conn)
+        assert pool.size() == 1
+
+    def test_threads(self):
+        factory = Factory()
+        pool = ConnectionPool(factory, maxsize=2)
+        conn = pool.checkout()
+        result = []
+
+        def worker():
+            with pool.connection() as conn2:
+                result.append(conn2)
+
+        threads = [ threading.Thread(target=worker) for i in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool.checkin(conn)
+        assert len(result) == 4
+        assert conn not in result
+        assert len(factory.created) == 2
+
+    def test_timeout(self):
+        pool = ConnectionPool(Factory(), maxsize=1)
+        conn = pool.checkout()
+        result = []
+
+        def worker():
+            try:
+                pool.checkout(timeout=0.01)
+            except ADError:
+                result.append(True)
+
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        assert result == [True]
+
+    def test_failed_connection(self):
+        factory = Factory()
+        pool = ConnectionPool(factory)
+
+        def fail():
+            with pool.connection():
+                raise ldap.SERVER_DOWN()
+
+        assert_raises(ldap.SERVER_DOWN, fail)
+        assert factory.created[0].closed
+        assert pool.size() == 0
+        conn = pool.checkout()
+        assert conn is factory.created[1]
+
+    def test_health_check(self):
+        factory = Factory()
+        pool = ConnectionPool(factory)
+        pool._check_interval = -1
+        conn = pool.checkout()
+        pool.checkin(conn)
+        conn.healthy = False
+        conn2 = pool.checkout()
+        assert conn2 is not conn
+        assert conn.closed
+        assert pool.size() == 1
+
+    def test_check(self):
+        factory = Factory()
+        pool = ConnectionPool(factory, check=lambda conn: conn.healthy)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        assert pool.checkout() is conn
+        pool.checkin(conn)
+        conn.healthy = False
+        conn2 = pool.checkout()
+        assert conn2 is not conn
+        assert conn.closed
+        assert pool.size() == 1
+
+    def test_idle_eviction(self):
+        factory = Factory()
+        pool = ConnectionPool(factory, minsize=1, maxsize=3, idletime=0)
+        conn = pool.checkout()
+        thread = threading.Thread(target=lambda: pool.checkin(pool.checkout()))
+        thread.start()
+        thread.join()
+        pool.checkin(conn)
+        assert pool.size() == 2
+        assert pool.checkout() is conn
+        assert factory.created[1].closed
+        assert pool.size() == 1
+
+    def test_close(self):
+        factory = Factory()
+        pool = ConnectionPool(factory)
+        conn = pool.checkout()
+        pool.checkin(conn)
+        pool.close()
+        assert conn.closed
+        assert_raises(ADError, pool.checkout)
+
+    def test_checkin_other_thread(self):
+        factory = Factory()
+        pool = ConnectionPool(factory, maxsize=1)
+
+        def pages():
+            with pool.connection() as conn:
+                yield conn
+                yield conn
+
+        gen = pages()
+        conn = next(gen)
+        thread = threading.Thread(target=gen.close)
+        thread.start()
+        thread.join()
+        assert pool.size() == 1
+        assert pool.checkout(timeout=1) is conn
+        pool.checkin(conn)
+        assert pool.m_owned == {} and pool.m_threads == {}
+
+    def test_nested_checkin_other_thread(self):
+        pool = ConnectionPool(Factory(), maxsize=1)
+        conn = pool.checkout()
+        assert pool.checkout() is conn
+        thread = threading.Thread(target=pool.checkin, args=(conn,))
+        thread.start()
+        thread.join()
+        assert pool.checkout() is conn
+        pool.checkin(conn)
+        pool.checkin(conn)
+        assert pool.m_owned == {} and pool.m_threads == {}
+
+    def test_error_checkin(self):
+        pool = ConnectionPool(Factory())
+        assert_raises(ADError, pool.checkin, Connection())
+
+    def test_error_size(self):
+        assert_raises(ValueError, ConnectionPool, Factory(), maxsize=0)
+        assert_raises(ValueError, ConnectionPool, Factory(), 2, 1)
@@ -0,0 +1,79 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import array
+import collections
+
+from activedirectory.core.result import SearchResult, _extend
+
+from ..base import assert_raises
+
+
+ENTRIES = [
+    ('cn=a,dc=example', {'cn': [b'a'], 'member': [b'cn=x', b'cn=y']}),
+    ('cn=b,dc=example', {'cn': [b'b'], 'member': []}),
+    ('cn=c,dc=example', {'cn': [b''], 'description': [b'\x00' * 300]}),
+]
+
+
+class TestSearchResult(object):
+    """Test suite for SearchResult."""
+
+    def test_entries(self):
+        result = SearchResult(ENTRIES)
+        assert len(result) == 3
+        assert list(result) == ENTRIES
+        assert result[1] == ENTRIES[1]
+        assert result[-1] == ENTRIES[-1]
+        assert result[1:] == ENTRIES[1:]
+        assert [ entry.dn for entry in result.entries() ] == \
+            [ dn for dn, attrs in ENTRIES ]
+
+    def test_attributes(self):
+        result = SearchResult(ENTRIES)
+        dn, attrs = result[0]
+        assert attrs['member'] == [b'cn=x', b'cn=y']
+        assert attrs.get('cn') == [b'a']
+        assert attrs.get('description') is None
+        assert 'cn' in attrs and 'description' not in attrs
+        assert sorted(attrs) == ['cn', 'member']
+        assert sorted(attrs.keys()) == ['cn', 'member']
+        assert len(attrs) == 2
+        assert sorted(attrs.items()) == sorted(ENTRIES[0][1].items())
+        assert result[1][1]['member'] == []
+        assert_raises(KeyError, attrs.__getitem__, 'description')
+
+    def test_shared_layout(self):
+        result = SearchResult(ENTRIES)
+        entries = result.entries()
+        assert entries[0].m_layout is entries[1].m_layout
+        assert entries[0].m_layout is not entries[2].m_layout
+
+    def test_layout_order(self):
+        result = SearchResult([
+            ('cn=a', collections.OrderedDict([('cn', [b'a']), ('sn', [b'x'])])),
+            ('cn=b', collections.OrderedDict([('sn', [b'y']), ('cn', [b'b'])])),
+        ])
+        entries = result.entries()
+        assert entries[0].m_layout is entries[1].m_layout
+        assert entries[1]['cn'] == [b'b'] and entries[1]['sn'] == [b'y']
+
+    def test_append(self):
+        result = SearchResult()
+        for dn, attrs in ENTRIES:
+            result.append(dn, attrs)
+        assert list(result) == ENTRIES
+
+    def test_large_offsets(self):
+        offsets = array.array('I', [1, 2])
+        offsets = _extend(offsets, [3])
+        assert offsets.typecode == 'I'
+        offsets = _extend(offsets, [2**32])
+        assert offsets.itemsize == 8
+        assert list(offsets) == [1, 2, 3, 2**32]
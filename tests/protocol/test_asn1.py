@@ -70,6 +70,18 @@ class TestEncoder(object):
         res = enc.output()
         assert res == b'\x02\x02\xff\x7f'
 
+    def test_small_integer_boundaries(self):
+        for value, encoded in ((32767, b'\x7f\xff'),
+                               (32768, b'\x00\x80\x00'),
+                               (65535, b'\x00\xff\xff'),
+                               (65536, b'\x01\x00\x00')):
+            for cls in (asn1.Encoder, asn1.PyEncoder):
+                enc = cls()
+                enc.start()
+                enc.write(value)
+                res = enc.output()
+                assert res == b'\x02' + six.int2byte(len(encoded)) + encoded
+
     def test_octet_string(self):
         enc = asn1.Encoder()
         enc.start()
@@ -187,6 +199,23 @@ class TestEncoder(object):
         res = enc.output()
         assert res == b'\xe1\x03\x02\x01\x01'
 
+    def test_implicit_primitive(self):
+        enc = asn1.Encoder()
+        enc.start()
+        enc.write('foo', 10, asn1.TypePrimitive, asn1.ClassApplication)
+        enc.write(1, 0, asn1.TypePrimitive, asn1.ClassContext)
+        res = enc.output()
+        assert res == b'\x4a\x03foo\x80\x01\x01'
+
+    def test_write_encoded(self):
+        enc = asn1.Encoder()
+        enc.start()
+        enc.enter(asn1.Sequence)
+        enc.write_encoded(b'\x02\x01\x01')
+        enc.leave()
+        res = enc.output()
+        assert res == b'\x30\x03\x02\x01\x01'
+
     def test_long_tag_id(self):
         enc = asn1.Encoder()
         enc.start()
@@ -203,6 +232,19 @@ class TestEncoder(object):
         res = enc.output()
         assert res == b'\x04\x82\xff\xff' + b'x' * 0xffff
 
+    def test_nested_long_length(self):
+        enc = asn1.Encoder()
+        enc.start()
+        enc.enter(asn1.Sequence)
+        enc.enter(asn1.Sequence)
+        enc.write('x' * 0xfe)
+        enc.leave()
+        enc.write(1)
+        enc.leave()
+        res = enc.output()
+        assert res == b'\x30\x82\x01\x08\x30\x82\x01\x01\x04\x81\xfe' + \
+            b'x' * 0xfe + b'\x02\x01\x01'
+
     def test_error_init(self):
         enc = asn1.Encoder()
         assert_raises(asn1.Error, enc.enter, asn1.Sequence)
@@ -443,6 +485,14 @@ class TestDecoder(object):
         tag, val = dec.read()
         assert val == 1
 
+    def test_implicit_primitive(self):
+        buf = b'\x4a\x03foo'
+        dec = asn1.Decoder()
+        dec.start(buf)
+        tag, val = dec.read()
+        assert tag == (10, asn1.TypePrimitive, asn1.ClassApplication)
+        assert val == b'foo'
+
     def test_long_tag_id(self):
         buf = b'\x3f\x83\xff\x7f\x03\x02\x01\x01'
         dec = asn1.Decoder()
@@ -487,6 +537,41 @@ class TestDecoder(object):
         tag, val = dec.read()
         assert val == 3
         assert dec.eof()
+
+    def test_leave_unread(self):
+        buf = b'\x30\x07\x30\x03\x02\x01\x01\x05\x00\x02\x01\x02'
+        dec = asn1.Decoder()
+        dec.start(buf)
+        dec.enter()
+        dec.enter()
+        assert_raises(asn1.Error, dec.leave)
+        dec.read()
+        dec.leave()
+        tag, val = dec.read()
+        assert val is None
+        assert dec.eof()
+        dec.leave()
+        tag, val = dec.read()
+        assert val == 2
+        assert dec.eof()
+
+    def test_leave_trailing_data(self):
+        buf = b'\x31\x05\x02\x01\x01\xff\xff'
+        dec = asn1.Decoder()
+        dec.start(buf)
+        dec.enter()
+        dec.read()
+        assert_raises(asn1.Error, dec.leave)
+
+    def test_buffer_types(self):
+        buf = b'\x30\x05\x04\x03foo'
+        for data in (bytearray(buf), memoryview(buf)):
+            dec = asn1.Decoder()
+            dec.start(data)
+            dec.enter()
+            tag, val = dec.read()
+            assert val == b'foo'
+            assert isinstance(val, six.binary_type)
  
     def test_error_init(self):
         dec = asn1.Decoder()
@@ -501,6 +586,8 @@ class TestDecoder(object):
         dec.start(buf)
         assert_raises(asn1.Error, dec.leave)
         dec.enter()
+        dec.read()
+        dec.read()
         dec.leave()
         assert_raises(asn1.Error, dec.leave)
 
@@ -549,6 +636,12 @@ class TestDecoder(object):
         dec.start(buf)
         assert_raises(asn1.Error, dec.read)
 
+    def test_error_missing_constructed_bytes(self):
+        buf = b'\x30\x05\x02\x01\x01'
+        dec = asn1.Decoder()
+        dec.start(buf)
+        assert_raises(asn1.Error, dec.enter)
+
     def test_error_non_normalized_positive_integer(self):
         buf = b'\x02\x02\x00\x01'
         dec = asn1.Decoder()
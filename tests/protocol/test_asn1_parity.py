@@ -0,0 +1,187 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+"""Parity tests for the C and Python implementations of the ASN.1 codec."""
+
+from __future__ import absolute_import
+
+import pytest
+
+from activedirectory.protocol import asn1
+
+_asn1 = pytest.importorskip('activedirectory.protocol._asn1')
+
+
+def decode(cls, data):
+    """Decode `data' completely with decoder class `cls'. Return a nested
+    list of (tag, value) tuples, or the error that was raised."""
+    def walk(dec):
+        result = []
+        while not dec.eof():
+            tag = dec.peek()
+            if tag[1] == asn1.TypeConstructed:
+                dec.enter()
+                result.append((tag, walk(dec)))
+                dec.leave()
+            else:
+                result.append(dec.read())
+        return result
+    dec = cls()
+    try:
+        dec.start(data)
+        return walk(dec)
+    except Exception as err:
+        return (type(err), str(err))
+
+
+def encode(cls, tree):
+    """Encode a tree as returned by decode() with encoder class `cls'."""
+    def walk(enc, tree):
+        for (nr, typ, tcls), value in tree:
+            if typ == asn1.TypeConstructed:
+                enc.enter(nr, tcls)
+                walk(enc, value)
+                enc.leave()
+            else:
+                enc.write(value, nr, typ, tcls)
+    enc = cls()
+    enc.start()
+    walk(enc, tree)
+    return enc.output()
+
+
+def call(obj, method, *args):
+    """Call `method' and return the result or the error that was raised."""
+    try:
+        return getattr(obj, method)(*args)
+    except Exception as err:
+        return (type(err), str(err))
+
+
+class TestParity(object):
+    """Compare the C implementation with the Python implementation."""
+
+    def test_accelerated(self):
+        assert asn1.Encoder is _asn1.Encoder
+        assert asn1.Decoder is _asn1.Decoder
+
+    @pytest.mark.parametrize('name', ['searchrequest.bin', 'searchresult.bin',
+                                      'netlogon.bin'])
+    def test_real_data(self, conf, name):
+        buf = conf.read_file('protocol/%s' % name)
+        result = decode(asn1.PyDecoder, buf)
+        assert decode(_asn1.Decoder, buf) == result
+        assert decode(_asn1.Decoder, bytearray(buf)) == result
+        assert decode(_asn1.Decoder, memoryview(buf)) == result
+        if isinstance(result, list):
+            # Active Directory does not use DER, so compare the re-encoded
+            # DER output instead of the original.
+            output = encode(asn1.PyEncoder, result)
+            assert encode(_asn1.Encoder, result) == output
+            assert decode(_asn1.Decoder, output) == result
+
+    @pytest.mark.parametrize('name', ['searchrequest.bin', 'searchresult.bin'])
+    def test_truncated(self, conf, name):
+        buf = conf.read_file('protocol/%s' % name)
+        for i in range(len(buf)):
+            result = decode(asn1.PyDecoder, buf[:i])
+            assert decode(_asn1.Decoder, buf[:i]) == result
+
+    @pytest.mark.parametrize('name', ['searchrequest.bin', 'searchresult.bin'])
+    def test_corrupted(self, conf, name):
+        buf = bytearray(conf.read_file('protocol/%s' % name))
+        for i in range(len(buf)):
+            for byte in (0x00, 0x1f, 0x7f, 0x80, 0x84, 0xff):
+                data = bytes(buf[:i] + bytearray([byte]) + buf[i+1:])
+                result = decode(asn1.PyDecoder, data)
+                assert decode(_asn1.Decoder, data) == result
+
+    @pytest.mark.parametrize('value', [
+        0, 1, 127, 128, 255, 256, -1, -127, -128, -129, -256, -257,
+        2**31 - 1, -2**31, 2**63 - 1, -2**63, 2**63, -2**63 - 1, 2**100,
+        -2**100, True, False])
+    def test_integer(self, value):
+        for nr in (asn1.Integer, asn1.Enumerated):
+            enc = _asn1.Encoder()
+            enc.start()
+            enc.write(value, nr)
+            pyenc = asn1.PyEncoder()
+            pyenc.start()
+            pyenc.write(value, nr)
+            buf = enc.output()
+            assert buf == pyenc.output()
+            assert decode(_asn1.Decoder, buf) == decode(asn1.PyDecoder, buf)
+
+    @pytest.mark.parametrize('args', [
+        (b'foo',), (u'f\xf6\xf6',), (b'x' * 300,), (None,),
+        (True, asn1.Boolean), (0, asn1.Boolean), (None, asn1.Null),
+        ('1.2.840.113554.1.2.2', asn1.ObjectIdentifier),
+        ('2.999', asn1.ObjectIdentifier), ('1', asn1.ObjectIdentifier),
+        (b'raw', 0x0c), (b'implicit', 0, None, asn1.ClassContext),
+        (7, 3, None, asn1.ClassApplication), (b'long', 0x1234),
+        (b'long', 0x1234, None, asn1.ClassPrivate),
+        (1.5,), (1.5, 1, None, asn1.ClassContext)])
+    def test_write(self, args):
+        results = []
+        for cls in (_asn1.Encoder, asn1.PyEncoder):
+            enc = cls()
+            enc.start()
+            result = call(enc, 'write', *args)
+            if result is None:
+                result = enc.output()
+            results.append(result)
+        assert results[0] == results[1]
+        if isinstance(results[0], bytes):
+            buf = results[0]
+            assert decode(_asn1.Decoder, buf) == decode(asn1.PyDecoder, buf)
+
+    @pytest.mark.parametrize('size', [0, 1, 127, 128, 255, 256, 65535,
+                                      65536])
+    def test_nested(self, size):
+        results = []
+        for cls in (_asn1.Encoder, asn1.PyEncoder):
+            enc = cls()
+            enc.start()
+            enc.enter(asn1.Sequence)
+            enc.enter(3, asn1.ClassContext)
+            enc.write_encoded(b'x' * size)
+            enc.leave()
+            enc.enter(0x100, asn1.ClassApplication)
+            enc.write(size)
+            enc.leave()
+            enc.leave()
+            results.append(enc.output())
+        assert results[0] == results[1]
+        buf = results[0]
+        assert decode(_asn1.Decoder, buf) == decode(asn1.PyDecoder, buf)
+
+    @pytest.mark.parametrize('data', [
+        b'\x01\x02\xff\xff', b'\x01\x00', b'\x02\x00', b'\x02\x02\x00\x01',
+        b'\x02\x02\xff\x80', b'\x05\x01\x00', b'\x06\x00', b'\x06\x02\x80\x01',
+        b'\x06\x02\xff\x7f', b'\x04\xff', b'\x04\x84\xff\xff\xff\xff',
+        b'\x04\x89\x01\x00\x00\x00\x00\x00\x00\x00\x00', b'\x1f\x81',
+        b'\x30\x80', b'\x02\x09\x00\x80\x00\x00\x00\x00\x00\x00\x00',
+        b'\x02\x09\xff\x7f\xff\xff\xff\xff\xff\xff\xff'])
+    def test_decode_errors(self, data):
+        assert decode(_asn1.Decoder, data) == decode(asn1.PyDecoder, data)
+
+    def test_state_errors(self):
+        for method in ('peek', 'read', 'eof', 'enter', 'leave'):
+            result = call(asn1.PyDecoder(), method)
+            assert call(_asn1.Decoder(), method) == result
+        for method, args in (('enter', (asn1.Sequence,)), ('leave', ()),
+                             ('write', (1,)), ('output', ()),
+                             ('write_encoded', (b'',))):
+            result = call(asn1.PyEncoder(), method, *args)
+            assert call(_asn1.Encoder(), method, *args) == result
+        for cls in (_asn1.Decoder, asn1.PyDecoder):
+            dec = cls()
+            dec.start(b'\x02\x01\x01')
+            dec.read()
+            assert call(dec, 'enter') == (asn1.Error, 'Premature end of input.')
+            assert call(dec, 'leave') == (asn1.Error, 'Tag stack is empty.')
+            assert call(dec, 'start', u'text')[0] is asn1.Error
@@ -0,0 +1,185 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+"""Test suite for activedirectory.protocol.asyncldap."""
+
+from __future__ import absolute_import
+import asyncio
+
+from activedirectory.protocol import asn1, ldap
+from activedirectory.protocol.asyncldap import AsyncClient
+
+from ..base import assert_raises
+
+
+def encode_result(msgid, op, code=0):
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Sequence)
+    enc.write(msgid)
+    enc.enter(op, asn1.ClassApplication)
+    enc.write(code, asn1.Enumerated)
+    enc.write(b'')
+    enc.write(b'')
+    enc.leave()
+    enc.leave()
+    return enc.output()
+
+
+def encode_entry(msgid, dn):
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Sequence)
+    enc.write(msgid)
+    enc.enter(ldap.SEARCH_RESULT_ENTRY, asn1.ClassApplication)
+    enc.write(dn)
+    enc.enter(asn1.Sequence)
+    enc.enter(asn1.Sequence)
+    enc.write('cn')
+    enc.enter(asn1.Set)
+    enc.write(dn.split('=')[1])
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    return enc.output()
+
+
+class Server(object):
+    """A minimal LDAP server. Requests are answered in reverse order once
+    `batch' requests have been received, to test message multiplexing."""
+
+    def __init__(self, batch=1):
+        self.batch = batch
+        self.requests = []
+
+    async def handle(self, reader, writer):
+        client = AsyncClient()
+        client.m_reader = reader
+        queue = []
+        while True:
+            try:
+                message = await client._read_message()
+            except asyncio.IncompleteReadError:
+                break
+            msgid, op = ldap.Client().parse_message_header(message)
+            self.requests.append(op)
+            if op in (ldap.UNBIND_REQUEST, ldap.ABANDON_REQUEST):
+                continue
+            queue.append((msgid, op, message))
+            if len(queue) < self.batch:
+                continue
+            for msgid, op, message in reversed(queue):
+                writer.write(self.response(msgid, op, message))
+            queue = []
+        writer.close()
+
+    def response(self, msgid, op, message):
+        if op == ldap.SEARCH_REQUEST:
+            dec = asn1.Decoder()
+            dec.start(message)
+            dec.enter()
+            dec.read()
+            dec.enter()
+            base = dec.read()[1].decode('utf-8')
+            return encode_entry(msgid, base) + encode_entry(msgid, base) + \
+                encode_result(msgid, ldap.SEARCH_RESULT_DONE)
+        elif op == ldap.DELETE_REQUEST:
+            return encode_result(msgid, ldap.DELETE_RESPONSE, 32)
+        return encode_result(msgid, op + 1)
+
+
+def run(server, test):
+    async def main():
+        srv = await asyncio.start_server(server.handle, '127.0.0.1', 0)
+        port = srv.sockets[0].getsockname()[1]
+        try:
+            async with AsyncClient() as client:
+                await client.connect('127.0.0.1', port)
+                return await test(client)
+        finally:
+            srv.close()
+            await srv.wait_closed()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+class TestAsyncClient(object):
+    """Test suite for AsyncClient."""
+
+    def test_search(self):
+        async def test(client):
+            await client.bind('cn=user', 'password')
+            return await client.search('cn=foo')
+        result = run(Server(), test)
+        assert result == [('cn=foo', {'cn': [b'foo']})] * 2
+
+    def test_multiplexing(self):
+        async def test(client):
+            bases = [ 'cn=%d' % i for i in range(10) ]
+            searches = [ client.search(base) for base in bases ]
+            return bases, await asyncio.gather(*searches)
+        bases, results = run(Server(batch=10), test)
+        for base, result in zip(bases, results):
+            assert [ dn for dn, attrs in result ] == [base, base]
+
+    def test_add_modify(self):
+        async def test(client):
+            await client.add('cn=foo', [('cn', ['foo'])])
+            await client.modify('cn=foo', [('replace', 'cn', ['bar'])])
+        server = Server()
+        run(server, test)
+        assert server.requests[:2] == [ldap.ADD_REQUEST, ldap.MODIFY_REQUEST]
+
+    def test_error_result(self):
+        async def test(client):
+            try:
+                await client.delete('cn=foo')
+            except ldap.Error as err:
+                return err.code
+        assert run(Server(), test) == 32
+
+    def test_error_not_connected(self):
+        client = AsyncClient()
+        loop = asyncio.new_event_loop()
+        assert_raises(ldap.Error, loop.run_until_complete,
+                      client.delete('cn=foo'))
+        loop.close()
+
+    def test_serialized_writes(self):
+        class Writer(object):
+            def __init__(self):
+                self.draining = 0
+                self.concurrent = 0
+            def write(self, data):
+                pass
+            async def drain(self):
+                self.draining += 1
+                self.concurrent = max(self.concurrent, self.draining)
+                await asyncio.sleep(0.01)
+                self.draining -= 1
+        async def test(client):
+            writer = client.m_writer = Writer()
+            client.m_write_lock = asyncio.Lock()
+            tasks = [ asyncio.ensure_future(client.delete('cn=%d' % i))
+                      for i in range(5) ]
+            while len(client.m_pending) < 5 or writer.draining:
+                await asyncio.sleep(0.01)
+            for messages, future in client.m_pending.values():
+                future.set_result([encode_result(0, ldap.DELETE_RESPONSE)])
+            await asyncio.gather(*tasks)
+            client.m_writer = None
+            return writer.concurrent
+        loop = asyncio.new_event_loop()
+        try:
+            assert loop.run_until_complete(test(AsyncClient())) == 1
+        finally:
+            loop.close()
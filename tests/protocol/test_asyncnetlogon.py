@@ -0,0 +1,137 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+"""Test suite for activedirectory.protocol.asyncnetlogon."""
+
+from __future__ import absolute_import
+import time
+import socket
+import asyncio
+
+import pytest
+
+from activedirectory.protocol import netlogon
+from activedirectory.protocol.asyncnetlogon import AsyncClient
+
+from ..base import assert_raises
+from .utils import Responder, has_ipv6
+
+
+def run(test):
+    async def main():
+        async with AsyncClient() as client:
+            return await test(client)
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+class TestAsyncClient(object):
+    """Test suite for asyncnetlogon.AsyncClient."""
+
+    def test_ping(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'))
+        try:
+            reply = run(lambda client:
+                        client.ping(responder.addresses[0], 'freeadi.org'))
+        finally:
+            responder.close()
+        assert reply.domain == b'freeadi.org'
+        assert reply.client_site == b'Default-First-Site'
+        assert (reply.q_hostname, reply.q_port) == responder.addresses[0]
+        assert reply.q_domain == 'freeadi.org'
+
+    def test_ping_backoff(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'), drop=2)
+        try:
+            reply = run(lambda client:
+                        client.ping(responder.addresses[0], 'freeadi.org',
+                                    timeout=0.1, retries=3))
+        finally:
+            responder.close()
+        assert reply is not None
+        times = responder.requests[responder.addresses[0][1]]
+        assert len(times) == 3
+        assert 0.1 <= times[1] - times[0] < 0.2
+        assert 0.2 <= times[2] - times[1] < 0.3
+
+    def test_ping_no_reply(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'),
+                              drop=None)
+        try:
+            reply = run(lambda client:
+                        client.ping(responder.addresses[0], 'freeadi.org',
+                                    timeout=0.05, retries=2))
+        finally:
+            responder.close()
+        assert reply is None
+
+    def test_ping_many(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'),
+                              count=100)
+        silent = Responder(conf.read_file('protocol/netlogon.bin'), drop=None)
+        try:
+            addrs = responder.addresses + silent.addresses
+            replies = run(lambda client:
+                          client.ping_many(addrs, 'freeadi.org',
+                                           timeout=0.05, retries=2))
+        finally:
+            responder.close()
+            silent.close()
+        assert len(replies) == 100
+        assert set((reply.q_hostname, reply.q_port) for reply in replies) == \
+            set(responder.addresses)
+
+    def test_ping_many_sufficient(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'), count=3)
+        silent = Responder(conf.read_file('protocol/netlogon.bin'), drop=None)
+        try:
+            addrs = responder.addresses + silent.addresses
+            begin = time.time()
+            replies = run(lambda client:
+                          client.ping_many(addrs, 'freeadi.org', timeout=1,
+                                 sufficient=lambda replies: len(replies) >= 3))
+            elapsed = time.time() - begin
+        finally:
+            responder.close()
+            silent.close()
+        assert len(replies) == 3
+        assert elapsed < 1
+
+    def test_ping_many_deadline(self, conf):
+        silent = Responder(conf.read_file('protocol/netlogon.bin'), drop=None)
+        try:
+            begin = time.time()
+            replies = run(lambda client:
+                          client.ping_many(silent.addresses, 'freeadi.org',
+                                           timeout=0.05, retries=10,
+                                           deadline=0.2))
+            elapsed = time.time() - begin
+        finally:
+            silent.close()
+        assert replies == []
+        assert 0.2 <= elapsed < 0.3
+
+    def test_error_not_open(self):
+        client = AsyncClient()
+        loop = asyncio.new_event_loop()
+        assert_raises(netlogon.Error, loop.run_until_complete,
+                      client.ping(('127.0.0.1', 389), 'freeadi.org'))
+        loop.close()
+
+    @pytest.mark.skipif(not has_ipv6(), reason='IPv6 is not available')
+    def test_ping_ipv6(self, conf):
+        responder = Responder(conf.read_file('protocol/netlogon.bin'),
+                              family=socket.AF_INET6)
+        try:
+            reply = run(lambda client:
+                        client.ping(responder.addresses[0], 'freeadi.org'))
+        finally:
+            responder.close()
+        assert reply.q_address == responder.addresses[0]
@@ -9,7 +9,9 @@
 
 from __future__ import absolute_import
 import os.path
-from activedirectory.protocol import ldap
+from activedirectory.protocol import asn1, ldap
+
+from ..base import assert_raises
 
 
 
@@ -37,3 +39,190 @@ def test_decode_real_search_reply(conf):
     print(repr(attrs))
     print(repr({ 'netlogon': [netlogon] }))
     assert attrs == { b'netlogon': [netlogon] }
+
+def test_encode_delete_request():
+    client = ldap.Client()
+    req = client.create_delete_request('cn=test', msgid=2)
+    assert req == b'\x30\x0c\x02\x01\x02\x4a\x07cn=test'
+
+def test_encode_bind_request():
+    client = ldap.Client()
+    req = client.create_bind_request('cn=test', 'secret', msgid=1)
+    assert req == b'\x30\x19\x02\x01\x01\x60\x14\x02\x01\x03\x04\x07cn=test' \
+                  b'\x80\x06secret'
+
+def test_encode_modify_request():
+    client = ldap.Client()
+    mods = [(ldap.MOD_REPLACE, 'cn', ['x'])]
+    req = client.create_modify_request('cn=y', mods, msgid=3)
+    assert req == b'\x30\x1d\x02\x01\x03\x66\x18\x04\x04cn=y\x30\x10\x30\x0e' \
+                  b'\x0a\x01\x02\x30\x09\x04\x02cn\x31\x03\x04\x01x'
+
+def test_decode_result():
+    client = ldap.Client()
+    buf = b'\x30\x0c\x02\x01\x05\x69\x07\x0a\x01\x20\x04\x00\x04\x00'
+    assert client.parse_result(buf) == (5, ldap.ADD_RESPONSE, 32, b'', b'')
+
+def test_decode_multiple_entries():
+    client = ldap.Client()
+    entry = b'\x30\x13\x02\x01\x07\x64\x0e\x04\x01x\x30\x09\x30\x07\x04\x01a' \
+            b'\x31\x02\x04\x00'
+    done = b'\x30\x0c\x02\x01\x07\x65\x07\x0a\x01\x00\x04\x00\x04\x00'
+    reply = client.parse_search_result(entry + entry + done)
+    assert reply == [(7, b'x', {b'a': [b'']})] * 2
+
+def test_decode_lazy_entries(conf):
+    client = ldap.Client()
+    buf = conf.read_file('protocol/searchresult.bin')
+    entries = client.parse_search_entries(buf)
+    assert len(entries) == 1
+    entry = entries[0]
+    assert entry.msgid == 4
+    assert entry.dn == b''
+    netlogon = conf.read_file('protocol/netlogon.bin')
+    assert entry[b'netlogon'] == [netlogon]
+    assert dict(entry) == client.parse_search_result(buf)[0][2]
+
+def test_decode_lazy_multiple_values():
+    client = ldap.Client()
+    entry = b'\x30\x22\x02\x01\x07\x64\x1d\x04\x01x\x30\x18\x30\x07\x04\x01a' \
+            b'\x31\x02\x04\x00\x30\x0d\x04\x01b\x31\x08\x04\x02b1\x04\x02b2'
+    done = b'\x30\x0c\x02\x01\x07\x65\x07\x0a\x01\x00\x04\x00\x04\x00'
+    entries = client.parse_search_entries(entry + done)
+    assert len(entries) == 1
+    entry = entries[0]
+    assert len(entry) == 2
+    assert sorted(entry) == [b'a', b'b']
+    assert b'b' in entry and b'c' not in entry
+    assert entry[b'a'] == [b'']
+    assert entry.get(b'b') == [b'b1', b'b2']
+    assert entry.get(b'c') is None
+    assert sorted(entry.items()) == [(b'a', [b'']), (b'b', [b'b1', b'b2'])]
+    assert_raises(KeyError, entry.__getitem__, b'c')
+
+def test_decode_lazy_error():
+    client = ldap.Client()
+    entry = b'\x30\x13\x02\x01\x07\x64\x0e\x04\x01x\x30\x09\x30\x07\x04\x01a' \
+            b'\x30\x02\x04\x00'
+    assert_raises(ldap.Error, client.parse_search_entries, entry)
+    entry = b'\x30\x13\x02\x01\x07\x64\x0e\x04\x01x\x30\x09\x30\x07\x04\x01a' \
+            b'\x31\x02\x02\x00'
+    entries = client.parse_search_entries(entry)
+    assert_raises(ldap.Error, entries[0].__getitem__, b'a')
+
+def test_encode_substring_filter():
+    client = ldap.Client()
+    req = client.create_search_request('', '(cn=a*b*c)', msgid=1)
+    assert b'\xa4\x0f\x04\x02cn\x30\x09\x80\x01a\x81\x01b\x82\x01c' in req
+
+def test_encode_extensible_filter():
+    client = ldap.Client()
+    req = client.create_search_request('', '(cn:dn:1.2:=x)', msgid=1)
+    assert b'\xa9\x0f\x81\x031.2\x82\x02cn\x83\x01x\x84\x01\xff' in req
+
+def test_encode_present_filter():
+    client = ldap.Client()
+    req = client.create_search_request('dc=x', '(objectClass=*)', msgid=1)
+    assert b'\x87\x0bobjectClass' in req
+    assert b'\xa7' not in req
+    req = client.create_search_request('dc=x', None, msgid=1)
+    assert b'\x87\x0bobjectClass' in req
+
+def test_encode_not_filter():
+    client = ldap.Client()
+    req = client.create_search_request('', '(!(cn=x))', msgid=1)
+    assert b'\xa2\x09\xa3\x07\x04\x02cn\x04\x01x' in req
+
+def test_filter_cache():
+    client = ldap.Client()
+    filter = '(&(DnsDomain=FREEADI.ORG)(Host=magellan)(NtVer=\\06\\00\\00\\00))'
+    ldap.filter_cache.clear()
+    req1 = client.create_search_request('', filter, msgid=1)
+    req2 = client.create_search_request('', filter, msgid=1)
+    assert req1 == req2
+    stats = ldap.filter_cache.stats()
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+    assert stats['size'] == 1
+
+def test_filter_cache_lru():
+    cache = ldap.FilterCache(2)
+    cache.put('a', b'1')
+    cache.put('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.put('c', b'3')
+    assert cache.get('b') is None
+    assert cache.get('a') == b'1'
+    assert cache.get('c') == b'3'
+    cache.set_maxsize(1)
+    assert cache.stats()['size'] == 1
+    assert cache.get('c') == b'3'
+
+def test_message_framer(conf):
+    client = ldap.Client()
+    buf = conf.read_file('protocol/searchresult.bin')
+    entry, done = buf[:146], buf[146:]  # SearchResultEntry and -Done
+    delete = client.create_delete_request('cn=test', msgid=5)
+    stream = buf + delete
+    framer = ldap.MessageFramer()
+    messages = []
+    for i in range(len(stream)):
+        messages += framer.feed(stream[i:i+1])
+    assert messages == [entry, done, delete]
+    assert framer.pending() == 0
+    assert framer.feed(stream) == [entry, done, delete]
+    assert framer.feed(stream[:-1]) == [entry, done]
+    assert framer.pending() == len(delete) - 1
+    assert framer.feed(stream[-1:]) == [delete]
+    assert client.parse_message_header(entry) == (4, ldap.SEARCH_RESULT_ENTRY)
+
+def test_message_framer_long_length():
+    client = ldap.Client()
+    req = client.create_delete_request('cn=%s' % ('x' * 300), msgid=1)
+    framer = ldap.MessageFramer()
+    framer._compact_size = 0
+    assert framer.feed(req[:3]) == []
+    assert framer.feed(req[3:] + req[:2]) == [req]
+    assert framer.pending() == 2
+    assert framer.feed(req[2:]) == [req]
+
+def test_message_framer_error():
+    framer = ldap.MessageFramer()
+    assert_raises(ldap.Error, framer.feed, b'\x04\x01x')
+    framer = ldap.MessageFramer()
+    assert_raises(ldap.Error, framer.feed, b'\x30\x80\x00\x00')
+
+
+def test_modify_operation():
+    assert ldap.modify_operation('add') == ldap.MOD_ADD
+    assert ldap.modify_operation('replace') == ldap.MOD_REPLACE
+    assert ldap.modify_operation(ldap.MOD_DELETE) == ldap.MOD_DELETE
+    assert_raises(ValueError, ldap.modify_operation, 'update')
+
+
+def test_parse_search_result_controls():
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Sequence)
+    enc.write(1)
+    enc.enter(ldap.SEARCH_RESULT_ENTRY, asn1.ClassApplication)
+    enc.write(b'cn=foo')
+    enc.enter(asn1.Sequence)
+    enc.leave()
+    enc.leave()
+    enc.enter(0, asn1.ClassContext)  # controls
+    enc.enter(asn1.Sequence)
+    enc.write(b'1.2.3.4')
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.enter(asn1.Sequence)
+    enc.write(1)
+    enc.enter(ldap.SEARCH_RESULT_DONE, asn1.ClassApplication)
+    enc.write(ldap.SUCCESS, asn1.Enumerated)
+    enc.write(b'')
+    enc.write(b'')
+    enc.leave()
+    enc.leave()
+    client = ldap.Client()
+    assert client.parse_search_result(enc.output()) == [(1, b'cn=foo', {})]
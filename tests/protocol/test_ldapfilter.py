@@ -7,6 +7,9 @@
 # "AUTHORS" for a complete overview.
 
 from __future__ import absolute_import
+import threading
+
+from six.moves import range
 from activedirectory.protocol import ldapfilter
 
 from ..base import assert_raises
@@ -105,6 +108,17 @@ class TestLDAPFilterParser(object):
         res = parser.parse(filt)
         assert res.value == '\\\x00*'
 
+    def test_empty_value(self):
+        parser = ldapfilter.Parser()
+        res = parser.parse('(description=)')
+        assert isinstance(res, ldapfilter.EQUALS)
+        assert res.value == ''
+        res = parser.parse('(description~=)')
+        assert isinstance(res, ldapfilter.APPROX)
+        assert res.value == ''
+        res = parser.parse('(&(cn=)(sn<=))')
+        assert res.terms[0].value == res.terms[1].value == ''
+
     def test_error_incomplete_term(self):
         parser = ldapfilter.Parser()
         filt = '('
@@ -113,8 +127,6 @@ class TestLDAPFilterParser(object):
         assert_raises(ldapfilter.Error, parser.parse, filt)
         filt = '(type='
         assert_raises(ldapfilter.Error, parser.parse, filt)
-        filt = '(type=)'
-        assert_raises(ldapfilter.Error, parser.parse, filt)
 
     def test_error_not_multi_term(self):
         parser = ldapfilter.Parser()
@@ -128,5 +140,90 @@ class TestLDAPFilterParser(object):
 
     def test_error_illegal_character(self):
         parser = ldapfilter.Parser()
-        filt = '(type=val*e)'
+        filt = '(type=val(e)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+        filt = '(type>=val*e)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+
+    def test_error_illegal_escape(self):
+        parser = ldapfilter.Parser()
+        filt = r'(type=\zz)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+        filt = '(type=value\\)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+
+    def test_error_trailing_input(self):
+        parser = ldapfilter.Parser()
+        filt = '(type=value))'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+        filt = '(&)'
         assert_raises(ldapfilter.Error, parser.parse, filt)
+
+    def test_substring(self):
+        filt = '(type=in*an\\2ay*fi)'
+        parser = ldapfilter.Parser()
+        res = parser.parse(filt)
+        assert isinstance(res, ldapfilter.SUBSTRING)
+        assert res.type == 'type'
+        assert res.initial == 'in'
+        assert res.any == ['an*y']
+        assert res.final == 'fi'
+
+    def test_substring_open(self):
+        parser = ldapfilter.Parser()
+        res = parser.parse('(type=*mid*)')
+        assert res.initial is None
+        assert res.any == ['mid']
+        assert res.final is None
+        res = parser.parse('(type=start*)')
+        assert res.initial == 'start'
+        assert res.any == []
+        assert res.final is None
+
+    def test_error_substring_empty_any(self):
+        parser = ldapfilter.Parser()
+        filt = '(type=a**b)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+
+    def test_extensible(self):
+        parser = ldapfilter.Parser()
+        res = parser.parse('(userAccountControl:1.2.840.113556.1.4.803:=2)')
+        assert isinstance(res, ldapfilter.EXTENSIBLE)
+        assert res.type == 'userAccountControl'
+        assert res.rule == '1.2.840.113556.1.4.803'
+        assert res.value == '2'
+        assert not res.dnattrs
+        res = parser.parse('(o:dn:=Ace Industry)')
+        assert res.type == 'o'
+        assert res.rule is None
+        assert res.dnattrs
+        res = parser.parse('(:dn:2.4.6.8.10:=Dino)')
+        assert res.type is None
+        assert res.rule == '2.4.6.8.10'
+        assert res.dnattrs
+
+    def test_error_extensible(self):
+        parser = ldapfilter.Parser()
+        filt = '(:=value)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+        filt = '(type:dn=value)'
+        assert_raises(ldapfilter.Error, parser.parse, filt)
+
+    def test_threads(self):
+        result = []
+
+        def worker(i):
+            parser = ldapfilter.Parser()
+            for j in range(100):
+                res = parser.parse('(&(type=%d)(type2=%d))' % (i, j))
+                result.append(res.terms[0].value == str(i) and
+                              res.terms[1].value == str(j))
+
+        threads = [ threading.Thread(target=worker, args=(i,))
+                    for i in range(4) ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(result) == 400
+        assert all(result)
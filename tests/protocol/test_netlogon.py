@@ -8,8 +8,11 @@
 
 from __future__ import absolute_import
 import os.path
+import time
 import signal
+import socket
 import dns.resolver
+import threading
 from threading import Timer
 
 import six
@@ -19,6 +22,7 @@ import pytest
 from activedirectory.protocol import netlogon
 
 from ..base import assert_raises
+from .utils import Responder, has_ipv6
 
 
 def decode_uint32(buffer, offset):
@@ -96,6 +100,21 @@ class TestDecoder(object):
         s = b'\x03foo\x00\x03bar\xc0\x00\x03baz\xc0\x05'
         assert decode_rfc1035(s, 11) == (b'baz.bar.foo', 17)
 
+    def test_rfc1035_shared_suffix(self):
+        s = b'\x03foo\x03bar\x00\x03baz\xc0\x04\x03qux\xc0\x04\xc0\x00'
+        d = netlogon.Decoder()
+        d.start(s)
+        assert d._decode_rfc1035() == b'foo.bar'
+        assert d._decode_rfc1035() == b'baz.bar'
+        assert d._decode_rfc1035() == b'qux.bar'
+        assert d._decode_rfc1035() == b'foo.bar'
+        assert d._offset() == len(s)
+
+    def test_rfc1035_buffer_types(self):
+        s = b'\x03foo\x00\x03bar\xc0\x00'
+        for buf in (bytearray(s), memoryview(s)):
+            assert decode_rfc1035(buf, 5) == (b'bar.foo', 11)
+
     def test_rfc1035_multi_string(self):
         s = b'\x03foo\x00\x03bar\x00'
         assert decode_rfc1035(s, 0) == (b'foo', 5)
@@ -127,6 +146,11 @@ class TestDecoder(object):
         s = b'\x03foo\xc0\x06\x03bar\xc0\x0c\x03baz\xc0\x00'
         assert_raises(netlogon.Error, decode_rfc1035, s, 0)
 
+    def test_error_rfc1035_long_cycle(self):
+        s = b''.join(b'\x01a\xc0' + six.int2byte(4 * (i + 1) % 240)
+                     for i in range(60))
+        assert_raises(netlogon.Error, decode_rfc1035, s, 0)
+
     def test_error_rfc1035_illegal_tags(self):
         s = b'\x80' + 0x80 * b'a' + b'\x00'
         assert_raises(netlogon.Error, decode_rfc1035, s, 0)
@@ -251,3 +275,395 @@ class TestClient(object):
         t = Timer(3, conf.remove_network_blocks); t.start()
         result = client.call()
         assert len(result) == len(addrs)
+
+
+class Address(object):
+    """DNS address record for AddressCache testing."""
+
+    def __init__(self, address):
+        self.address = address
+
+
+class Answer(list):
+    """DNS answer for AddressCache testing."""
+
+    def __init__(self, addresses, ttl):
+        list.__init__(self, [ Address(address) for address in addresses ])
+        self.rrset = Address(None)
+        self.rrset.ttl = ttl
+
+
+class Resolver(object):
+    """DNS resolver for AddressCache testing. `records' maps (name, type)
+    tuples to the tuple (addresses, ttl)."""
+
+    def __init__(self, records):
+        self.records = records
+        self.queries = []
+
+    def query(self, name, type):
+        self.queries.append((name, type))
+        if (name, type) not in self.records:
+            raise dns.resolver.NXDOMAIN()
+        addresses, ttl = self.records[(name, type)]
+        return Answer(addresses, ttl)
+
+
+class AddressCache(netlogon.AddressCache):
+    """AddressCache with a fake system resolver. `hosts' maps host names
+    to IP addresses."""
+
+    def __init__(self, resolver, hosts=None, prefer_ipv6=False):
+        netlogon.AddressCache.__init__(self, resolver, prefer_ipv6)
+        self.hosts = hosts or {}
+
+    def _getaddrinfo(self, hostname):
+        if hostname not in self.hosts:
+            raise socket.gaierror(socket.EAI_NONAME, 'Name not known')
+        address = self.hosts[hostname]
+        family = netlogon._address_family(address)
+        return [ (family, socket.SOCK_DGRAM, 0, '', (address, 0)) ]
+
+
+class TestAddressCache(object):
+    """Test suite for netlogon.AddressCache."""
+
+    def test_resolve(self):
+        resolver = Resolver({('dc1.example.com', 'A'): (['10.0.0.1'], 60),
+                             ('dc2.example.com', 'AAAA'): (['2001:DB8::1'], 60)})
+        cache = AddressCache(resolver)
+        assert cache.resolve('dc1.example.com') == '10.0.0.1'
+        assert cache.resolve('dc2.example.com') == '2001:db8::1'
+        assert cache.resolve('192.0.2.1') == '192.0.2.1'
+        assert cache.resolve('::1') == '::1'
+        assert ('192.0.2.1', 'A') not in resolver.queries
+
+    def test_prefer_ipv6(self):
+        records = {('dc.example.com', 'A'): (['10.0.0.1'], 60),
+                   ('dc.example.com', 'AAAA'): (['2001:db8::1'], 60)}
+        cache = AddressCache(Resolver(records))
+        assert cache.resolve('dc.example.com') == '10.0.0.1'
+        cache = AddressCache(Resolver(records), prefer_ipv6=True)
+        assert cache.resolve('dc.example.com') == '2001:db8::1'
+
+    def test_ttl(self):
+        resolver = Resolver({('dc.example.com', 'A'): (['10.0.0.1'], 0.1)})
+        cache = AddressCache(resolver)
+        assert cache.resolve('dc.example.com') == '10.0.0.1'
+        resolver.records[('dc.example.com', 'A')] = (['10.0.0.2'], 60)
+        assert cache.resolve('dc.example.com') == '10.0.0.1'
+        time.sleep(0.1)
+        assert cache.resolve('dc.example.com') == '10.0.0.2'
+        assert len(resolver.queries) == 2
+        cache.clear()
+        assert cache.resolve('dc.example.com') == '10.0.0.2'
+        assert len(resolver.queries) == 3
+
+    def test_hosts_file(self):
+        cache = netlogon.AddressCache(Resolver({}))
+        assert cache.resolve('localhost') in ('127.0.0.1', '::1')
+
+    def test_hosts_precedence(self):
+        resolver = Resolver({('dc.example.com', 'A'): (['10.0.0.1'], 60)})
+        cache = AddressCache(resolver, {'dc.example.com': '192.0.2.1'})
+        assert cache.resolve('dc.example.com') == '192.0.2.1'
+        assert resolver.queries == []
+
+    def test_negative(self):
+        resolver = Resolver({})
+        cache = AddressCache(resolver)
+        assert cache.resolve('nonexistent.invalid') is None
+        count = len(resolver.queries)
+        assert cache.resolve('nonexistent.invalid') is None
+        assert len(resolver.queries) == count
+
+    def test_resolve_many(self):
+        records = dict((('dc%d.example.com' % i, 'A'), (['10.0.0.%d' % i], 60))
+                       for i in range(50))
+        resolver = Resolver(records)
+        cache = AddressCache(resolver)
+        hostnames = [ 'dc%d.example.com' % i for i in range(50) ]
+        result = cache.resolve_many(hostnames + ['missing.invalid'])
+        assert result['missing.invalid'] is None
+        for i in range(50):
+            assert result['dc%d.example.com' % i] == '10.0.0.%d' % i
+        count = len(resolver.queries)
+        assert cache.resolve_many(hostnames) == \
+            dict((hostname, result[hostname]) for hostname in hostnames)
+        assert len(resolver.queries) == count
+
+    def test_resolve_many_error(self):
+        cache = AddressCache(Resolver({}))
+        def getaddrinfo(hostname):
+            if hostname == 'crash.example.com':
+                raise RuntimeError('crash')
+            raise socket.gaierror(socket.EAI_NONAME, 'Name not known')
+        cache._getaddrinfo = getaddrinfo
+        hostnames = [ 'dc1.example.com', 'crash.example.com' ]
+        assert_raises(RuntimeError, cache.resolve_many, hostnames)
+        assert cache.resolve_many(hostnames[:1]) == {'dc1.example.com': None}
+
+
+class TestSweep(object):
+    """Test suite for netlogon.Client against a local responder."""
+
+    def test_many_servers(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, count=200)
+        try:
+            client = netlogon.Client()
+            for addr in responder.addresses:
+                client.query(addr, 'freeadi.org')
+            result = client.call(timeout=1)
+        finally:
+            responder.close()
+        assert len(result) == 200
+        assert set((res.q_hostname, res.q_port) for res in result) == \
+            set(responder.addresses)
+        for res in result:
+            assert res.domain == b'freeadi.org'
+            assert res.q_timing >= 0.0
+
+    def test_backoff(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, drop=2)
+        try:
+            client = netlogon.Client()
+            client.query(responder.addresses[0], 'freeadi.org')
+            result = client.call(timeout=0.1, retries=3)
+        finally:
+            responder.close()
+        assert len(result) == 1
+        times = responder.requests[responder.addresses[0][1]]
+        assert len(times) == 3
+        assert 0.1 <= times[1] - times[0] < 0.2
+        assert 0.2 <= times[2] - times[1] < 0.3
+        assert result[0].q_timing < 0.1
+
+    def test_retries_exhausted(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, drop=None)
+        try:
+            client = netlogon.Client()
+            client.query(responder.addresses[0], 'freeadi.org')
+            begin = time.time()
+            result = client.call(timeout=0.05, retries=3)
+            elapsed = time.time() - begin
+        finally:
+            responder.close()
+        assert result == []
+        assert len(responder.requests[responder.addresses[0][1]]) == 3
+        assert 0.35 <= elapsed < 0.5
+
+    def test_deadline(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, drop=None)
+        try:
+            client = netlogon.Client()
+            client.query(responder.addresses[0], 'freeadi.org')
+            begin = time.time()
+            result = client.call(timeout=0.05, retries=10, deadline=0.2)
+            elapsed = time.time() - begin
+        finally:
+            responder.close()
+        assert result == []
+        assert 0.2 <= elapsed < 0.3
+
+    def test_sufficient(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, count=3)
+        silent = Responder(netlogon_data, drop=None)
+        try:
+            client = netlogon.Client()
+            for addr in responder.addresses + silent.addresses:
+                client.query(addr, 'freeadi.org')
+            begin = time.time()
+            result = client.call(timeout=1,
+                                 sufficient=lambda replies: len(replies) >= 3)
+            elapsed = time.time() - begin
+        finally:
+            responder.close()
+            silent.close()
+        assert len(result) == 3
+        assert elapsed < 1
+
+    def test_unresolvable(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        try:
+            client = netlogon.Client(AddressCache(Resolver({})))
+            client.query(responder.addresses[0], 'freeadi.org')
+            client.query(('nonexistent.invalid', 389), 'freeadi.org')
+            result = client.call(timeout=0.1)
+        finally:
+            responder.close()
+        assert len(result) == 1
+
+    def test_shared_address(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        address, port = responder.addresses[0]
+        hosts = {'dc1.example.com': address, 'dc2.example.com': address}
+        try:
+            client = netlogon.Client(AddressCache(Resolver({}), hosts))
+            client.query(('dc1.example.com', port), 'freeadi.org')
+            client.query(('dc2.example.com', port), 'freeadi.org')
+            result = client.call(timeout=0.1)
+        finally:
+            responder.close()
+        assert sorted(res.q_hostname for res in result) == \
+            ['dc1.example.com', 'dc2.example.com']
+
+    @pytest.mark.skipif(not has_ipv6(), reason='IPv6 is not available')
+    def test_dual_stack(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder4 = Responder(netlogon_data)
+        responder6 = Responder(netlogon_data, family=socket.AF_INET6)
+        try:
+            client = netlogon.Client()
+            client.query(responder4.addresses[0], 'freeadi.org')
+            client.query(responder6.addresses[0], 'freeadi.org')
+            result = client.call(timeout=0.1)
+        finally:
+            responder4.close()
+            responder6.close()
+        assert len(result) == 2
+        assert set(res.q_address for res in result) == \
+            set(responder4.addresses + responder6.addresses)
+
+
+class TestTransport(object):
+    """Test suite for netlogon.Transport."""
+
+    def test_persistent_socket(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        transport = netlogon.Transport()
+        try:
+            sockets = []
+            for i in range(3):
+                client = netlogon.Client(transport=transport)
+                client.query(responder.addresses[0], 'freeadi.org')
+                assert len(client.call(timeout=0.5)) == 1
+                sockets.append(transport.m_sockets[socket.AF_INET])
+            assert sockets[0] is sockets[1] is sockets[2]
+            assert transport.m_pending == {}
+        finally:
+            transport.close()
+            responder.close()
+        assert transport.m_sockets == {}
+
+    def test_concurrent_calls(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data, count=40)
+        transport = netlogon.Transport()
+        results = {}
+        def worker(n):
+            client = netlogon.Client(transport=transport)
+            for addr in responder.addresses[n*10:n*10+10]:
+                client.query(addr, 'freeadi.org')
+            results[n] = client.call(timeout=0.5)
+        try:
+            threads = [ threading.Thread(target=worker, args=(n,))
+                        for n in range(4) ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            transport.close()
+            responder.close()
+        for n in range(4):
+            addrs = set((res.q_hostname, res.q_port) for res in results[n])
+            assert addrs == set(responder.addresses[n*10:n*10+10])
+
+    def test_reopen(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        transport = netlogon.Transport()
+        try:
+            for i in range(2):
+                client = netlogon.Client(transport=transport)
+                client.query(responder.addresses[0], 'freeadi.org')
+                assert len(client.call(timeout=0.5)) == 1
+                transport.close()
+                assert transport.m_thread is None
+        finally:
+            responder.close()
+
+    def test_message_ids(self):
+        transport = netlogon.Transport()
+        transport.m_offset = 2**31 - 2
+        transport.m_pending[0] = None
+        assert transport.create_message_id() == 2**31 - 2
+        assert transport.create_message_id() == 1
+
+    def test_garbage(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        transport = netlogon.Transport()
+        peer = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            client = netlogon.Client(transport=transport)
+            client.query(responder.addresses[0], 'freeadi.org')
+            assert len(client.call(timeout=0.5)) == 1
+            port = transport.m_sockets[socket.AF_INET].getsockname()[1]
+            for data in (b'garbage', b'\x30\x03\x02\x01', b'') * 20:
+                peer.sendto(data, ('127.0.0.1', port))
+            begin = time.time()
+            while transport.m_dropped < 60 and time.time() - begin < 2:
+                time.sleep(0.01)
+            assert transport.m_dropped == 60
+            client.query(responder.addresses[0], 'freeadi.org')
+            assert len(client.call(timeout=0.5)) == 1
+        finally:
+            peer.close()
+            transport.close()
+            responder.close()
+
+    def test_closed_socket(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        transport = netlogon.Transport()
+        try:
+            client = netlogon.Client(transport=transport)
+            client.query(responder.addresses[0], 'freeadi.org')
+            assert len(client.call(timeout=0.5)) == 1
+            thread = transport.m_thread
+            transport.m_sockets[socket.AF_INET].close()
+            os.write(transport.m_wakeup[1], b'x')
+            thread.join(2)
+            assert not thread.is_alive()
+            assert transport.m_thread is None
+            client.query(responder.addresses[0], 'freeadi.org')
+            assert len(client.call(timeout=0.5)) == 1
+        finally:
+            transport.close()
+            responder.close()
+
+    @pytest.mark.skipif(not hasattr(os, 'register_at_fork'),
+                        reason='os.register_at_fork() is not available')
+    def test_fork(self, conf):
+        netlogon_data = conf.read_file('protocol/netlogon.bin')
+        responder = Responder(netlogon_data)
+        transport = netlogon.Transport()
+        try:
+            client = netlogon.Client(transport=transport)
+            client.query(responder.addresses[0], 'freeadi.org')
+            assert len(client.call(timeout=0.5)) == 1
+            transport.m_lock.acquire()  # as if held by another thread
+            pid = os.fork()
+            if pid == 0:
+                status = 1
+                try:
+                    if transport.m_thread is None and not transport.m_sockets:
+                        client = netlogon.Client(transport=transport)
+                        client.query(responder.addresses[0], 'freeadi.org')
+                        status = len(client.call(timeout=0.5)) != 1
+                finally:
+                    os._exit(status)
+            transport.m_lock.release()
+            assert os.waitpid(pid, 0)[1] == 0
+        finally:
+            transport.close()
+            responder.close()
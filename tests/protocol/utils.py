@@ -0,0 +1,105 @@
+#
+# This file is part of Python-AD. Python-AD is free software that is made
+# available under the MIT license. Consult the file "LICENSE" that is
+# distributed together with this file for the exact licensing terms.
+#
+# Python-AD is copyright (c) 2007 by the Python-AD authors. See the file
+# "AUTHORS" for a complete overview.
+
+from __future__ import absolute_import
+import time
+import socket
+import select
+import threading
+
+from activedirectory.protocol import asn1, ldap
+
+
+def netlogon_response(msgid, netlogon):
+    """Return a CLDAP response with message ID `msgid' that carries the
+    netlogon attribute `netlogon'."""
+    enc = asn1.Encoder()
+    enc.start()
+    enc.enter(asn1.Sequence)
+    enc.write(msgid)
+    enc.enter(ldap.SEARCH_RESULT_ENTRY, asn1.ClassApplication)
+    enc.write(b'')
+    enc.enter(asn1.Sequence)
+    enc.enter(asn1.Sequence)
+    enc.write(b'netlogon')
+    enc.enter(asn1.Set)
+    enc.write(netlogon)
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.leave()
+    enc.enter(asn1.Sequence)
+    enc.write(msgid)
+    enc.enter(ldap.SEARCH_RESULT_DONE, asn1.ClassApplication)
+    enc.write(ldap.SUCCESS, asn1.Enumerated)
+    enc.write(b'')
+    enc.write(b'')
+    enc.leave()
+    enc.leave()
+    return enc.output()
+
+
+def has_ipv6():
+    """Return True if the IPv6 loopback address can be used."""
+    try:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.bind(('::1', 0))
+        sock.close()
+    except socket.error:
+        return False
+    return True
+
+
+class Responder(object):
+    """A fake CLDAP server that answers netlogon queries on a number of
+    local UDP ports.
+
+    Each port drops the first `drop' requests it receives. A `drop' of None
+    means the port never answers. The arrival time of every request is
+    recorded in `requests', keyed by port.
+    """
+
+    def __init__(self, netlogon, count=1, drop=0, family=socket.AF_INET):
+        """Constructor."""
+        self.netlogon = netlogon
+        self.drop = drop
+        self.sockets = []
+        self.requests = {}
+        host = '::1' if family == socket.AF_INET6 else '127.0.0.1'
+        for i in range(count):
+            sock = socket.socket(family, socket.SOCK_DGRAM)
+            sock.bind((host, 0))
+            self.sockets.append(sock)
+            self.requests[sock.getsockname()[1]] = []
+        self.addresses = [ (host, sock.getsockname()[1])
+                           for sock in self.sockets ]
+        self.m_running = True
+        self.m_thread = threading.Thread(target=self._run)
+        self.m_thread.daemon = True
+        self.m_thread.start()
+
+    def _run(self):
+        client = ldap.Client()
+        while self.m_running:
+            ready = select.select(self.sockets, [], [], 0.01)[0]
+            for sock in ready:
+                data, addr = sock.recvfrom(8192)
+                requests = self.requests[sock.getsockname()[1]]
+                requests.append(time.time())
+                if self.drop is None or len(requests) <= self.drop:
+                    continue
+                msgid = client.parse_message_header(data)[0]
+                sock.sendto(netlogon_response(msgid, self.netlogon), addr)
+
+    def close(self):
+        """Stop the responder."""
+        self.m_running = False
+        self.m_thread.join()
+        for sock in self.sockets:
+            sock.close()